@@ -0,0 +1,187 @@
+"""
+Benchmark: vectorized spending analytics against the same aggregates in loops.
+
+Both sides get the same synthetic items. "loops" is the per-item Python the
+report code uses (dicts per period and item name, a sorted list for the
+percentiles), "numpy" is services.spend_analytics.summarize over the columns.
+Results are checked to match before timing. "load" is build_columns over the
+stored expense documents, the part of a request spent before any aggregation.
+
+    python -m benchmarks.analytics [--items 100000] [--names 500] [--repeat 5]
+"""
+
+import argparse
+import json
+import math
+import random
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from models.item_model import Item
+from services import expense_codec, spend_analytics
+
+
+def make_documents(items: int, names: int, rng: random.Random) -> list[tuple[str, dict]]:
+    """Stored expense documents with 1-9 items each, spread over one year"""
+    vocabulary = [f"item-{n}" for n in range(names)]
+    start = datetime(2025, 1, 1)
+    documents = []
+    while items > 0:
+        count = min(items, rng.randint(1, 9))
+        items -= count
+        created_at = start + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+        expense_items = [
+            Item(
+                item_id=str(uuid.UUID(int=rng.getrandbits(128))),
+                item_name=rng.choice(vocabulary),
+                item_price=round(rng.uniform(0.5, 200), 2),
+                item_quantity=rng.randint(1, 5),
+            )
+            for _ in range(count)
+        ]
+        data = {
+            "items": expense_codec.encode_items(expense_items),
+            "schema_version": expense_codec.EXPENSE_SCHEMA_VERSION,
+            "created_at": created_at,
+        }
+        documents.append((str(len(documents)), data))
+    return documents
+
+
+def percentile(ordered: list[float], p: float) -> float:
+    # Linear interpolation, numpy's default method
+    rank = (len(ordered) - 1) * p / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def loops(rows: list[tuple[str, float, int, date]], top: int, window: int) -> dict:
+    def series(key):
+        totals: dict = defaultdict(float)
+        counts: dict = defaultdict(int)
+        for name, price, quantity, day in rows:
+            period = key(day)
+            totals[period] += price * quantity
+            counts[period] += 1
+        return [
+            {"period": period, "total": totals[period], "item_count": counts[period]}
+            for period in sorted(totals)
+        ]
+
+    daily = series(lambda day: day.isoformat())
+    weekly = series(lambda day: (day - timedelta(days=day.weekday())).isoformat())
+    monthly = series(lambda day: f"{day.year:04d}-{day.month:02d}")
+
+    first = min(row[3] for row in rows)
+    last = max(row[3] for row in rows)
+    by_day: dict = defaultdict(float)
+    for name, price, quantity, day in rows:
+        by_day[day] += price * quantity
+    days = [first + timedelta(days=n) for n in range((last - first).days + 1)]
+    moving_average = []
+    for end in range(window - 1, len(days)):
+        spend = sum(by_day[days[n]] for n in range(end - window + 1, end + 1))
+        moving_average.append({"period": days[end].isoformat(), "average": spend / window})
+
+    totals: dict = {}
+    quantities: dict = {}
+    counts: dict = {}
+    for name, price, quantity, day in rows:
+        totals[name] = totals.get(name, 0.0) + price * quantity
+        quantities[name] = quantities.get(name, 0) + quantity
+        counts[name] = counts.get(name, 0) + 1
+    ranked = sorted(totals, key=lambda name: -totals[name])[:top]
+
+    ordered = sorted(price * quantity for name, price, quantity, day in rows)
+    return {
+        "item_count": len(rows),
+        "total": sum(totals.values()),
+        "percentiles": {
+            f"p{p}": percentile(ordered, p) for p in spend_analytics.PERCENTILES
+        },
+        "daily": daily,
+        "weekly": weekly,
+        "monthly": monthly,
+        "moving_average": moving_average,
+        "items": [
+            {
+                "item_name": name,
+                "total": totals[name],
+                "quantity": quantities[name],
+                "count": counts[name],
+            }
+            for name in ranked
+        ],
+    }
+
+
+def same(first, second) -> bool:
+    if isinstance(first, dict):
+        return first.keys() == second.keys() and all(
+            same(first[k], second[k]) for k in first
+        )
+    if isinstance(first, list):
+        return len(first) == len(second) and all(map(same, first, second))
+    if isinstance(first, float):
+        return math.isclose(first, second, rel_tol=1e-9, abs_tol=1e-6)
+    return first == second
+
+
+def best_ms(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return round(min(timings) * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--names", type=int, default=500, help="distinct item names")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--window", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    documents = make_documents(args.items, args.names, random.Random(args.seed))
+    columns = spend_analytics.build_columns(documents)
+    rows = [
+        (name, price, quantity, data["created_at"].date())
+        for _, data in documents
+        for name, price, quantity in zip(*expense_codec.item_columns(data))
+    ]
+
+    vectorized = spend_analytics.summarize(columns, args.top, args.window)
+    looped = loops(rows, args.top, args.window)
+    vectorized.pop("expense_count")
+    # Ties in the ranking may be ordered differently, compare the totals only
+    for result in (vectorized, looped):
+        result["items"] = [item["total"] for item in result["items"]]
+    assert same(vectorized, looped), "numpy and loop results differ"
+
+    numpy_ms = best_ms(
+        lambda: spend_analytics.summarize(columns, args.top, args.window), args.repeat
+    )
+    loops_ms = best_ms(lambda: loops(rows, args.top, args.window), args.repeat)
+    report = {
+        "items": len(rows),
+        "expenses": len(documents),
+        "encoding": expense_codec.ITEM_ENCODING,
+        "load_ms": best_ms(
+            lambda: spend_analytics.build_columns(documents), args.repeat
+        ),
+        "numpy_ms": numpy_ms,
+        "loops_ms": loops_ms,
+        "speedup": round(loops_ms / numpy_ms, 1),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
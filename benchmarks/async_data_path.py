@@ -0,0 +1,168 @@
+"""
+Benchmark: p99 latency of concurrent mixed requests, inline vs executor data path.
+
+The real routes are driven in-process through httpx's ASGI transport on the
+memory storage backend, with --latency-ms of delay per storage call standing in
+for a Firestore round trip. "inline" calls the blocking services directly from
+the route coroutines (the old behaviour of routers/router.py), "executor" goes
+through db.executor.run_blocking as the routes do now.
+
+    python -m benchmarks.async_data_path --requests 400 --rate 200 --latency-ms 10
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+
+from benchmarks.endpoints import YEAR_START, access_token, percentile, seed_rows
+
+ROUTER_MODULES = ("routers.router", "routers.statistika_router")
+
+
+async def run_inline(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+@contextlib.contextmanager
+def inline_data_path():
+    """Makes the routes call their services on the event loop"""
+    originals = {name: sys.modules[name].run_blocking for name in ROUTER_MODULES}
+    for name in ROUTER_MODULES:
+        sys.modules[name].run_blocking = run_inline
+    try:
+        yield
+    finally:
+        for name, original in originals.items():
+            sys.modules[name].run_blocking = original
+
+
+def request_mix(user_id: str, targets: list, requests: int, rng: random.Random):
+    base = f"/{user_id}/expenses"
+    months = [YEAR_START.date().replace(month=m) for m in range(1, 13)]
+
+    def create():
+        body = {
+            "description": "bench",
+            "items": [{"item_name": "coffee", "item_price": 2.5, "item_quantity": 1}],
+        }
+        return "POST", f"{base}/create", {"json": body}
+
+    def list_range():
+        day = rng.choice(months)
+        params = {"date_from": str(day), "date_to": str(day.replace(day=28))}
+        return "GET", f"{base}/", {"params": params}
+
+    def update_item():
+        expense_id, item_id = rng.choice(targets)
+        body = {"item_name": "updated", "item_price": 3.0, "item_quantity": 1}
+        return "PUT", f"{base}/{expense_id}/item/{item_id}/update", {"json": body}
+
+    def create_report():
+        day = rng.choice(months)
+        params = {"date_from": str(day), "date_to": str(day.replace(day=28))}
+        return "POST", f"{base}/report/create", {"params": params}
+
+    def statistics():
+        return "GET", "/statistics/most-called-endpoint", {}
+
+    scenarios = (create, list_range, update_item, create_report, statistics)
+    return [rng.choice(scenarios)() for _ in range(requests)]
+
+
+async def run_mode(client, mix: list, rate: float) -> dict:
+    """Open-loop run: request i arrives at i / rate seconds, latency is measured
+    from its arrival, so time spent waiting on a stalled event loop is counted."""
+    latencies: list[float] = []
+    errors = 0
+    loop = asyncio.get_running_loop()
+    origin = loop.time()
+
+    async def one(index: int, method: str, url: str, kwargs: dict):
+        nonlocal errors
+        arrival = origin + index / rate
+        await asyncio.sleep(max(0.0, arrival - loop.time()))
+        response = await client.request(method, url, **kwargs)
+        latencies.append((loop.time() - arrival) * 1000)
+        if response.status_code >= 400:
+            errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i, *request) for i, request in enumerate(mix)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": len(mix),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(mix) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from routers import dependencies
+    from server import app
+
+    rng = random.Random(args.seed)
+    user_id = "bench-data-path"
+    expense_service = dependencies.get_expense_service.get()
+    expense_service.import_expenses(user_id, seed_rows(args.expenses, rng))
+    expenses = expense_service.get_expenses_in_date_range(
+        user_id, None, None, limit=500
+    )
+    targets = [(e.expense_id, e.items[0].item_id) for e in expenses]
+
+    headers = {"Authorization": f"Bearer {access_token(user_id)}"}
+    results = {}
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://bench",
+        headers=headers,
+    ) as client:
+        for mode in ("inline", "executor"):
+            mix = request_mix(user_id, targets, args.requests, rng)
+            if mode == "inline":
+                with inline_data_path():
+                    results[mode] = await run_mode(client, mix, args.rate)
+            else:
+                results[mode] = await run_mode(client, mix, args.rate)
+    dependencies.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--rate", type=float, default=200.0, help="requests/s")
+    parser.add_argument(
+        "--latency-ms", type=float, default=10.0, help="delay per storage call"
+    )
+    parser.add_argument("--expenses", type=int, default=1000, help="seeded expenses")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # Read by db.firestore on import, so set before the app is loaded
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ["STORAGE_LATENCY_MS"] = str(args.latency_ms)
+
+    # Services print debug output, keep stdout for the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        results = asyncio.run(run(args))
+
+    from db.executor import shutdown_executor
+
+    shutdown_executor()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
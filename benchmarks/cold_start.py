@@ -0,0 +1,140 @@
+"""
+Benchmark: cold start, from a fresh interpreter to the first served request.
+
+Every run starts new Python processes, like a container scaled up from zero:
+one under -X importtime for the slowest imports, then one that imports server,
+runs the lifespan startup and serves two requests through the ASGI transport.
+
+    python -m benchmarks.cold_start [--backend memory] [--warmup] [--runs 3]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Any request that reaches the storage backend
+FIRST_REQUEST = "/statistics/last-called-endpoint"
+
+
+def import_profile(env: dict, top: int) -> dict:
+    """Parses python -X importtime, times are in milliseconds"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append(
+            {
+                "module": name.strip(),
+                "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            }
+        )
+    server = next(m for m in modules if m["module"] == "server")
+    slowest = sorted(
+        (m for m in modules if m["depth"] <= 2),
+        key=lambda m: m["cumulative_ms"],
+        reverse=True,
+    )
+    return {
+        "server_import_ms": server["cumulative_ms"],
+        "slowest": [
+            {k: m[k] for k in ("module", "cumulative_ms", "self_ms")}
+            for m in slowest[1 : top + 1]
+        ],
+    }
+
+
+async def serve_first_requests(wait_for_warmup: float) -> dict:
+    import httpx
+
+    import_started = time.perf_counter()
+    from server import app
+
+    imported = time.perf_counter()
+    timings = {"import_server_ms": (imported - import_started) * 1000}
+
+    async with app.router.lifespan_context(app):
+        started = time.perf_counter()
+        timings["lifespan_startup_ms"] = (started - imported) * 1000
+        if wait_for_warmup:
+            await asyncio.sleep(wait_for_warmup)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://cold"
+        ) as client:
+            for name in ("first_request_ms", "second_request_ms"):
+                request_started = time.perf_counter()
+                response = await client.get(FIRST_REQUEST)
+                response.raise_for_status()
+                timings[name] = (time.perf_counter() - request_started) * 1000
+    return {name: round(value, 2) for name, value in timings.items()}
+
+
+def startup_run(env: dict, wait_for_warmup: float) -> dict:
+    command = [sys.executable, "-m", "benchmarks.cold_start", "--child"]
+    command += ["--wait-for-warmup", str(wait_for_warmup)]
+    spawned = time.perf_counter()
+    result = subprocess.run(
+        command, env=env, capture_output=True, text=True, check=True
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process_ms"] = round((time.perf_counter() - spawned) * 1000, 2)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backend", default="memory", help="STORAGE_BACKEND")
+    parser.add_argument(
+        "--warmup", action="store_true", help="sets WARMUP_ON_STARTUP=true"
+    )
+    parser.add_argument(
+        "--wait-for-warmup",
+        type=float,
+        default=0.0,
+        help="seconds between startup and the first request",
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        timings = asyncio.run(serve_first_requests(args.wait_for_warmup))
+        print(json.dumps(timings))
+        return
+
+    env = dict(os.environ, STORAGE_BACKEND=args.backend)
+    env["WARMUP_ON_STARTUP"] = "true" if args.warmup else "false"
+    runs = [startup_run(env, args.wait_for_warmup) for _ in range(args.runs)]
+    report = {
+        "config": {
+            "backend": args.backend,
+            "warmup": args.warmup,
+            "wait_for_warmup": args.wait_for_warmup,
+            "runs": args.runs,
+        },
+        "imports": import_profile(env, args.top),
+        "startup": {
+            name: round(min(run[name] for run in runs), 2) for name in runs[0]
+        },
+        "runs": runs,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
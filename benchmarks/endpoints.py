@@ -0,0 +1,278 @@
+"""
+Benchmark: throughput and latency of the HTTP endpoints, driven in-process.
+
+The app is served through httpx's ASGI transport on the memory (or sqlite)
+storage backend, so no server, credentials or network are needed. Every dataset
+size gets its own user seeded with that many expenses, spread over one year.
+
+With --latency-ms, reads from concurrent requests overlap like network round
+trips. Writes of one user do not: every expense transaction touches the user's
+version and rollup documents, so they commit one at a time, as on Firestore.
+
+    python -m benchmarks.endpoints --sizes 100,10000 --requests 200 --concurrency 16
+    python -m benchmarks.endpoints --backend sqlite --output results.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+YEAR_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+STATISTICS_ENDPOINTS = (
+    "last-called-endpoint",
+    "most-called-endpoint",
+    "all-calls-statistics",
+)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed_rows(size: int, rng: random.Random):
+    for index in range(size):
+        created_at = YEAR_START + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+        items = [
+            {
+                "item_name": f"item-{rng.randrange(100)}",
+                "item_price": round(rng.uniform(1, 200), 2),
+                "item_quantity": rng.randint(1, 5),
+            }
+            for _ in range(rng.randint(1, 4))
+        ]
+        yield index + 1, {
+            "description": f"expense {index}",
+            "items": items,
+            "created_at": created_at.isoformat(),
+        }
+
+
+def access_token(user_id: str) -> str:
+    import jwt
+
+    from routers.auth_dependency import jwt_service
+
+    payload = {"sub": user_id, "type": "access", "exp": int(time.time()) + 24 * 3600}
+    return jwt.encode(payload, jwt_service.secret_key, algorithm=jwt_service.algorithm)
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+async def measure(client, make_request, requests: int, concurrency: int) -> dict:
+    """Closed loop: concurrency workers issue make_request(i) until requests are sent"""
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for index in counter:
+            method, url, kwargs = make_request(index)
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def run_size(app, size: int, args, rng: random.Random) -> dict:
+    import httpx
+
+    from routers.dependencies import get_expense_service
+
+    user_id = f"bench-{size}"
+    expense_service = get_expense_service.get()
+    seeded = expense_service.import_expenses(user_id, seed_rows(size, rng))
+    expenses = expense_service.get_expenses_in_date_range(
+        user_id, None, None, limit=500
+    )
+    targets = [(e.expense_id, e.items[0].item_id) for e in expenses]
+
+    headers = {"Authorization": f"Bearer {access_token(user_id)}"}
+    base = f"/{user_id}/expenses"
+    first_days = [YEAR_START.date().replace(month=m) for m in range(1, 13)]
+    month_ranges = [(day, day.replace(day=28)) for day in first_days]
+
+    def create(i):
+        body = {
+            "description": f"bench {i}",
+            "items": [{"item_name": "coffee", "item_price": 2.5, "item_quantity": 1}],
+        }
+        return "POST", f"{base}/create", {"json": body}
+
+    def list_range(i):
+        date_from, date_to = month_ranges[i % len(month_ranges)]
+        params = {"date_from": str(date_from), "date_to": str(date_to)}
+        return "GET", f"{base}/", {"params": params}
+
+    def update_item(i):
+        expense_id, item_id = targets[i % len(targets)]
+        price = float(i % 50 + 1)
+        body = {"item_name": "updated", "item_price": price, "item_quantity": 1}
+        return "PUT", f"{base}/{expense_id}/item/{item_id}/update", {"json": body}
+
+    def create_report(i):
+        date_from, date_to = month_ranges[i % len(month_ranges)]
+        params = {"date_from": str(date_from), "date_to": str(date_to)}
+        return "POST", f"{base}/report/create", {"params": params}
+
+    results = {
+        "seeded": seeded["imported"],
+        "seed_rows_per_second": seeded["rows_per_second"],
+    }
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", headers=headers
+    ) as client:
+        scenarios = {
+            "create_expense": create,
+            "list_date_range": list_range,
+            "update_item": update_item,
+            "create_report": create_report,
+        }
+        for name, make_request in scenarios.items():
+            results[name] = await measure(
+                client, make_request, args.requests, args.concurrency
+            )
+
+        response = await client.post(f"{base}/report/create")
+        report_id = response.json()["report id"]
+        results["get_report"] = await measure(
+            client,
+            lambda i: ("GET", f"{base}/report", {"params": {"report_id": report_id}}),
+            args.requests,
+            args.concurrency,
+        )
+        for endpoint in STATISTICS_ENDPOINTS:
+            results[f"statistics_{endpoint}"] = await measure(
+                client,
+                lambda i, e=endpoint: ("GET", f"/statistics/{e}", {}),
+                args.requests,
+                args.concurrency,
+            )
+    return results
+
+
+async def middleware_overhead(args) -> dict:
+    """Same cheap request against the routers with and without LoggingMiddleware"""
+    import httpx
+    from fastapi import FastAPI
+
+    from middleware.logging_middleware import LoggingMiddleware
+    from routers.router import router
+
+    bare = FastAPI()
+    bare.include_router(router)
+    logged = FastAPI()
+    logged.include_router(router)
+    logged.add_middleware(LoggingMiddleware)
+
+    user_id = "bench-middleware"
+    headers = {"Authorization": f"Bearer {access_token(user_id)}"}
+    request = ("GET", f"/{user_id}/expenses/", {"params": {"limit": 1}})
+
+    results = {}
+    for name, app in (("without", bare), ("with", logged)):
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://bench",
+            headers=headers,
+        ) as client:
+            results[name] = await measure(
+                client, lambda i: request, args.requests, args.concurrency
+            )
+    results["p50_overhead_ms"] = round(
+        results["with"]["p50_ms"] - results["without"]["p50_ms"], 2
+    )
+    return results
+
+
+async def run(args) -> dict:
+    from routers import dependencies
+    from server import app
+
+    rng = random.Random(args.seed)
+    sizes = {}
+    for size in args.sizes:
+        sizes[str(size)] = await run_size(app, size, args, rng)
+    overhead = await middleware_overhead(args)
+    dependencies.shutdown()
+    return {"sizes": sizes, "logging_middleware": overhead}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument(
+        "--sizes", default="100,1000", help="comma separated expenses per user"
+    )
+    parser.add_argument("--requests", type=int, default=200, help="per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--latency-ms", type=float, default=0.0, help="delay per storage call"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+
+    # Read by db.firestore on import, so set before the app is loaded
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ["STORAGE_LATENCY_MS"] = str(args.latency_ms)
+    if args.backend == "sqlite":
+        os.environ.setdefault("SQLITE_PATH", ":memory:")
+
+    started = datetime.now(timezone.utc)
+    # Services print debug output, keep stdout for the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        results = asyncio.run(run(args))
+
+    from db.executor import shutdown_executor
+
+    shutdown_executor()
+    report = {
+        "started_at": started.isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {
+            "backend": args.backend,
+            "sizes": args.sizes,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "latency_ms": args.latency_ms,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
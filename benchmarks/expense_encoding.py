@@ -0,0 +1,110 @@
+"""
+Benchmark: stored size and decode time of the expense item layouts.
+
+Sizes follow Firestore's storage size rules (field names and strings are their
+UTF-8 length + 1, numbers and timestamps 8 bytes), so they match what is billed
+and read per document. Decode time is services.expense_codec.decode_expense.
+
+    python -m benchmarks.expense_encoding [--expenses 2000] [--items 1,5,20]
+"""
+
+import argparse
+import json
+import random
+import time
+import uuid
+from datetime import datetime
+
+from models.expense_model import ExpenseResponse
+from models.item_model import Item
+from services import expense_codec
+
+LAYOUTS = {
+    "list": expense_codec.LIST_SCHEMA_VERSION,
+    "map": expense_codec.MAP_SCHEMA_VERSION,
+    "columnar": expense_codec.COLUMNAR_SCHEMA_VERSION,
+}
+
+# Document name user_id/expenses/expenses/expense_id (segments + 1 each, + 16)
+# plus the 32 bytes Firestore adds to every document
+DOCUMENT_OVERHEAD = (36 + 1) + 2 * (len("expenses") + 1) + (20 + 1) + 16 + 32
+
+
+def storage_size(value) -> int:
+    if isinstance(value, dict):
+        return sum(len(k.encode()) + 1 + storage_size(v) for k, v in value.items())
+    if isinstance(value, list):
+        return sum(storage_size(v) for v in value)
+    if isinstance(value, str):
+        return len(value.encode()) + 1
+    if isinstance(value, bool) or value is None:
+        return 1
+    return 8
+
+
+def make_expense(rng: random.Random, items: int) -> ExpenseResponse:
+    now = datetime.now()
+    return ExpenseResponse(
+        description="groceries",
+        items=[
+            Item(
+                item_id=str(uuid.UUID(int=rng.getrandbits(128))),
+                item_name=rng.choice(["milk", "bread", "coffee", "apples", "rice"]),
+                item_price=round(rng.uniform(0.5, 50), 2),
+                item_quantity=rng.randint(1, 5),
+            )
+            for _ in range(items)
+        ],
+        total_price=0,
+        created_at=now,
+        updated_at=now,
+    )
+
+
+def encode(expense: ExpenseResponse, version: int) -> dict:
+    if version == expense_codec.LIST_SCHEMA_VERSION:
+        return expense.model_dump(exclude={"expense_id"})
+    return expense_codec.encode_expense(expense, version)
+
+
+def measure(expenses: list[ExpenseResponse], version: int) -> dict:
+    documents = [encode(expense, version) for expense in expenses]
+    size = sum(storage_size(d) + DOCUMENT_OVERHEAD for d in documents)
+    size /= len(documents)
+    started = time.perf_counter()
+    for document in documents:
+        expense_codec.decode_expense("id", document)
+    elapsed = time.perf_counter() - started
+    return {
+        "bytes_per_document": round(size, 1),
+        "decode_us_per_document": round(elapsed / len(documents) * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--expenses", type=int, default=2000)
+    parser.add_argument("--items", default="1,5,20", help="items per expense")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = {}
+    for items in (int(n) for n in args.items.split(",")):
+        expenses = [make_expense(rng, items) for _ in range(args.expenses)]
+        layouts = {name: measure(expenses, v) for name, v in LAYOUTS.items()}
+        baseline = layouts["list"]
+        for layout in layouts.values():
+            layout["bytes_vs_list"] = round(
+                layout["bytes_per_document"] / baseline["bytes_per_document"], 3
+            )
+            decode_us = layout["decode_us_per_document"]
+            layout["decode_vs_list"] = round(
+                decode_us / baseline["decode_us_per_document"], 3
+            )
+        results[f"{items}_items"] = layouts
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: time to serialize expense lists into a JSON response body.
+
+"fastapi" is what a handler returning the models costs: jsonable_encoder and
+json.dumps, like JSONResponse.render. "response_model" adds the re-validation
+FastAPI does for a declared response model. "dump_json" is the path the routers
+use, pydantic-core writing bytes directly. Timestamp formatting is timed on
+its own as well, strftime against models.datetime_format.
+
+    python -m benchmarks.serialization [--expenses 1000] [--items 5] [--repeat 20]
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+
+from benchmarks.expense_encoding import make_expense
+from models.datetime_format import format_datetime
+from models.expense_model import ExpenseResponse
+from routers.router import expense_list
+from services import expense_codec
+
+
+def render(content) -> bytes:
+    # Same arguments as starlette's JSONResponse.render
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def fastapi(expenses: list[ExpenseResponse]) -> bytes:
+    return render(jsonable_encoder(expenses))
+
+
+def response_model(expenses: list[ExpenseResponse]) -> bytes:
+    validated = expense_list.validate_python(
+        [expense.model_dump() for expense in expenses]
+    )
+    return render(expense_list.dump_python(validated, mode="json"))
+
+
+def dump_json(expenses: list[ExpenseResponse]) -> bytes:
+    return expense_list.dump_json(expenses)
+
+
+def load(expenses_count: int, items: int, seed: int) -> list[ExpenseResponse]:
+    """Expenses as the service returns them, decoded from stored documents"""
+    rng = random.Random(seed)
+    started = datetime(2025, 1, 1)
+    expenses = []
+    for index in range(expenses_count):
+        expense = make_expense(rng, items)
+        expense.created_at = expense.updated_at = started + timedelta(minutes=index)
+        document = expense_codec.encode_expense(expense)
+        expenses.append(expense_codec.decode_expense(str(index), document))
+    return expenses
+
+
+def datetimes(expenses: list[ExpenseResponse]) -> dict:
+    values = [e.created_at for e in expenses] + [e.updated_at for e in expenses]
+    timings = {}
+    for name, serialize in (
+        ("strftime", lambda value: value.strftime("%Y/%m/%d %H:%M:%S")),
+        ("format_datetime", format_datetime),
+    ):
+        started = time.perf_counter()
+        for value in values:
+            serialize(value)
+        elapsed = time.perf_counter() - started
+        timings[f"{name}_us"] = round(elapsed / len(values) * 1e6, 3)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--expenses", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    expenses = load(args.expenses, args.items, args.seed)
+    expected = json.loads(fastapi(expenses))
+    results = {}
+    for serialize in (fastapi, response_model, dump_json):
+        assert json.loads(serialize(expenses)) == expected, serialize.__name__
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            serialize(expenses)
+            timings.append(time.perf_counter() - started)
+        per_1k = min(timings) * 1000 * 1000 / args.expenses
+        results[serialize.__name__] = {"ms_per_1k_expenses": round(per_1k, 2)}
+
+    baseline = results["fastapi"]["ms_per_1k_expenses"]
+    for result in results.values():
+        result["speedup"] = round(baseline / result["ms_per_1k_expenses"], 1)
+    results["datetime"] = datetimes(expenses)
+    report = {"expenses": args.expenses, "items": args.items, **results}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,614 @@
+"""
+Firestore-compatible document client for the offline storage backends.
+
+Only the subset of the google-cloud-firestore API used by the services is
+implemented: collection/document references, where/order_by/limit/start_after
+queries, batched writes, transactions, Increment, DELETE_FIELD and SERVER_TIMESTAMP.
+A StorageEngine subclass supplies the actual storage.
+"""
+
+import contextlib
+import copy
+import random
+import string
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+# Firestore rejects batches and transactions with more than 500 writes
+MAX_WRITES = 500
+
+# Runs of a transaction function before the conflict is raised, as in the client
+MAX_TRANSACTION_ATTEMPTS = 5
+
+DOCUMENT_ID = "__name__"
+
+Path = tuple[str, ...]
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class _Sentinel:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+DELETE_FIELD = _Sentinel("DELETE_FIELD")
+SERVER_TIMESTAMP = _Sentinel("SERVER_TIMESTAMP")
+
+
+def _auto_id() -> str:
+    alphabet = string.ascii_letters + string.digits
+    return "".join(random.choice(alphabet) for _ in range(20))
+
+
+def normalize(value: Any) -> Any:
+    """Stores datetimes the way Firestore returns them: timezone-aware UTC"""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    return value
+
+
+def split_field_path(field_path: str) -> list[str]:
+    """Splits a.b.`c-d` into its segments, \\ escapes a character inside backticks"""
+    parts, current, quoted, escaped = [], "", False, False
+    for char in field_path:
+        if escaped:
+            current += char
+            escaped = False
+        elif char == "\\" and quoted:
+            escaped = True
+        elif char == "`":
+            quoted = not quoted
+        elif char == "." and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+
+_MISSING = object()
+
+
+def get_field(data: dict, field_path: str) -> Any:
+    value: Any = data
+    for part in split_field_path(field_path):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _resolve(current: Any, value: Any) -> Any:
+    if isinstance(value, Increment):
+        base = current if isinstance(current, (int, float)) else 0
+        return base + value.value
+    if value is SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    return normalize(value)
+
+
+def _merge(target: dict, data: dict):
+    for key, value in data.items():
+        if value is DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = _resolve(target.get(key), value)
+
+
+def apply_write(
+    existing: Optional[dict], data: dict, merge: bool = False, update: bool = False
+) -> dict:
+    """Returns the document after a set()/update(), resolving sentinel values"""
+    if update:
+        if existing is None:
+            raise ValueError("No document to update")
+        result = copy.deepcopy(existing)
+        for field_path, value in data.items():
+            parts = split_field_path(field_path)
+            target = result
+            for part in parts[:-1]:
+                if not isinstance(target.get(part), dict):
+                    target[part] = {}
+                target = target[part]
+            if value is DELETE_FIELD:
+                target.pop(parts[-1], None)
+            else:
+                target[parts[-1]] = _resolve(target.get(parts[-1]), value)
+        return result
+
+    result = copy.deepcopy(existing) if merge and existing is not None else {}
+    _merge(result, data)
+    return result
+
+
+def _sort_value(value: Any) -> tuple:
+    # Firestore orders values of different types by type first
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, value)
+    if isinstance(value, str):
+        return (4, value)
+    return (5, str(value))
+
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: _sort_value(a) < _sort_value(b),
+    "<=": lambda a, b: _sort_value(a) <= _sort_value(b),
+    ">": lambda a, b: _sort_value(a) > _sort_value(b),
+    ">=": lambda a, b: _sort_value(a) >= _sort_value(b),
+    "in": lambda a, b: a in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+def matches(doc_id: str, data: dict, filters: list[tuple[str, str, Any]]) -> bool:
+    for field_path, op, value in filters:
+        current = doc_id if field_path == DOCUMENT_ID else get_field(data, field_path)
+        if current is _MISSING or not _OPERATORS[op](current, normalize(value)):
+            return False
+    return True
+
+
+class StorageEngine(ABC):
+    """Primitive document storage behind DocumentClient.
+
+    Documents are addressed by their path, e.g. ("user", "expenses", "expenses", id).
+    Every method is called with the client lock held.
+    """
+
+    @abstractmethod
+    def get(self, path: Path) -> Optional[dict]: ...
+
+    @abstractmethod
+    def put(self, path: Path, data: dict): ...
+
+    @abstractmethod
+    def delete(self, path: Path): ...
+
+    @abstractmethod
+    def scan(
+        self, parent: Path, filters: list[tuple[str, str, Any]]
+    ) -> Iterable[tuple[str, dict]]:
+        """Yields (document id, data) of the collection at parent matching filters"""
+
+    @abstractmethod
+    def collections(self) -> list[str]:
+        """Ids of the top-level collections"""
+
+    def aggregate(
+        self,
+        parent: Path,
+        filters: list[tuple[str, str, Any]],
+        required: list[str],
+        aggregations: list[tuple[str, Optional[str]]],
+    ) -> list[Any]:
+        """Values of ("count", None) and ("sum", field_path) aggregations over the
+        documents of parent that match filters and have every required field.
+
+        Engines that cannot compute them without reading the documents raise
+        NotImplementedError, like a server without aggregation queries.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support aggregation queries"
+        )
+
+    def commit(self):
+        """Called after a batch or transaction has applied all its writes"""
+
+
+def project(data: dict, field_paths: tuple) -> dict:
+    """The fields of data named by field_paths, like a select() query returns"""
+    result: dict = {}
+    for field_path in field_paths:
+        value = get_field(data, field_path)
+        if value is _MISSING:
+            continue
+        parts = split_field_path(field_path)
+        target = result
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return result
+
+
+class DocumentSnapshot:
+    # data may be the stored document itself. Engines never change a stored
+    # document in place (writes build a new one), and reads below copy it.
+    def __init__(self, reference: "DocumentReference", data: Optional[dict]):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self) -> Optional[dict]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str) -> Any:
+        value = get_field(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class DocumentReference:
+    def __init__(self, client: "DocumentClient", path: Path):
+        self._client = client
+        self.path = path
+        self.id = path[-1]
+
+    def collection(self, collection_id: str) -> "CollectionReference":
+        return CollectionReference(self._client, self.path + (collection_id,))
+
+    def get(self, field_paths=None, transaction=None) -> DocumentSnapshot:
+        return self._client._get(self, transaction)
+
+    def set(self, document_data: dict, merge: bool = False):
+        batch = self._client.batch()
+        batch.set(self, document_data, merge=merge)
+        batch.commit()
+
+    def create(self, document_data: dict):
+        batch = self._client.batch()
+        batch.create(self, document_data)
+        batch.commit()
+
+    def update(self, field_updates: dict):
+        batch = self._client.batch()
+        batch.update(self, field_updates)
+        batch.commit()
+
+    def delete(self):
+        batch = self._client.batch()
+        batch.delete(self)
+        batch.commit()
+
+
+class Query:
+    def __init__(
+        self,
+        client: "DocumentClient",
+        parent: Path,
+        filters: tuple = (),
+        orders: tuple = (),
+        limit: Optional[int] = None,
+        cursor: Optional[Any] = None,
+        projection: Optional[tuple] = None,
+    ):
+        self._client = client
+        self._parent = parent
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit
+        self._cursor = cursor
+        self._projection = projection
+
+    def _copy(self, **changes) -> "Query":
+        fields = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "cursor": self._cursor,
+            "projection": self._projection,
+        }
+        fields.update(changes)
+        return Query(self._client, self._parent, **fields)
+
+    def where(self, field_path: str, op_string: str, value: Any) -> "Query":
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "Query":
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int) -> "Query":
+        return self._copy(limit=count)
+
+    def select(self, field_paths) -> "Query":
+        return self._copy(projection=tuple(field_paths))
+
+    def start_after(self, document_fields) -> "Query":
+        return self._copy(cursor=document_fields)
+
+    def count(self, alias: Optional[str] = None) -> "AggregationQuery":
+        return AggregationQuery(self).count(alias)
+
+    def sum(self, field_ref: str, alias: Optional[str] = None) -> "AggregationQuery":
+        return AggregationQuery(self).sum(field_ref, alias)
+
+    def _key(self, doc_id: str, data: dict) -> tuple:
+        key = []
+        for field_path, direction in self._orders:
+            value = doc_id if field_path == DOCUMENT_ID else get_field(data, field_path)
+            key.append(_sort_value(value))
+        return tuple(key) + ((4, doc_id),)
+
+    def _cursor_key(self) -> tuple:
+        cursor = self._cursor
+        if isinstance(cursor, DocumentSnapshot):
+            return self._key(cursor.id, cursor._data or {})
+        doc_id = cursor.get(DOCUMENT_ID, "")
+        values = [
+            doc_id if field == DOCUMENT_ID else normalize(cursor[field])
+            for field, _ in self._orders
+        ]
+        return tuple(_sort_value(v) for v in values) + ((4, doc_id),)
+
+    def _run(self) -> list[tuple[str, dict]]:
+        filters = list(self._filters)
+        # Like Firestore, documents without an ordered field are left out
+        rows = [
+            (doc_id, data)
+            for doc_id, data in self._client._engine.scan(self._parent, filters)
+            if all(
+                field == DOCUMENT_ID or get_field(data, field) is not _MISSING
+                for field, _ in self._orders
+            )
+        ]
+        descending = any(d == "DESCENDING" for _, d in self._orders)
+        rows.sort(key=lambda row: self._key(*row), reverse=descending)
+        if self._cursor is not None:
+            cursor_key = self._cursor_key()
+            rows = [
+                row
+                for row in rows
+                if (self._key(*row) < cursor_key if descending else self._key(*row) > cursor_key)
+            ]
+        if self._limit is not None:
+            rows = rows[: self._limit]
+        return rows
+
+    def stream(self, transaction=None) -> Iterator[DocumentSnapshot]:
+        with self._client._operation("query"):
+            rows = self._run()
+        if transaction is not None:
+            transaction._read_query(self, rows)
+        for doc_id, data in rows:
+            reference = DocumentReference(self._client, self._parent + (doc_id,))
+            if self._projection is not None:
+                data = project(data, self._projection)
+            yield DocumentSnapshot(reference, data)
+
+    def get(self, transaction=None) -> list[DocumentSnapshot]:
+        return list(self.stream(transaction=transaction))
+
+
+class AggregationResult:
+    def __init__(self, alias: str, value: Any):
+        self.alias = alias
+        self.value = value
+
+
+class AggregationQuery:
+    """count() and sum() over the documents of a query, computed by the engine"""
+
+    def __init__(self, query: Query, aggregations: tuple = ()):
+        self._query = query
+        # (alias, kind, field path)
+        self._aggregations = aggregations
+
+    def _add(self, kind: str, field_path: Optional[str], alias: Optional[str]):
+        alias = alias or f"field_{len(self._aggregations) + 1}"
+        return AggregationQuery(
+            self._query, self._aggregations + ((alias, kind, field_path),)
+        )
+
+    def count(self, alias: Optional[str] = None) -> "AggregationQuery":
+        return self._add("count", None, alias)
+
+    def sum(self, field_ref: str, alias: Optional[str] = None) -> "AggregationQuery":
+        return self._add("sum", field_ref, alias)
+
+    def get(self, transaction=None) -> list[list[AggregationResult]]:
+        query = self._query
+        if query._limit is not None or query._cursor is not None:
+            raise NotImplementedError("Aggregations over limits or cursors")
+        client = query._client
+        with client._operation("aggregate"):
+            values = client._engine.aggregate(
+                query._parent,
+                list(query._filters),
+                [field for field, _ in query._orders if field != DOCUMENT_ID],
+                [(kind, field_path) for _, kind, field_path in self._aggregations],
+            )
+        return [
+            [
+                AggregationResult(alias, value)
+                for (alias, _, _), value in zip(self._aggregations, values)
+            ]
+        ]
+
+
+class CollectionReference(Query):
+    def __init__(self, client: "DocumentClient", path: Path):
+        super().__init__(client, path)
+        self.id = path[-1]
+
+    def document(self, document_id: Optional[str] = None) -> DocumentReference:
+        return DocumentReference(self._client, self._parent + (document_id or _auto_id(),))
+
+
+class WriteBatch:
+    def __init__(self, client: "DocumentClient"):
+        self._client = client
+        self._writes: list[tuple[str, DocumentReference, Any, bool]] = []
+
+    def _add(self, write: tuple):
+        if len(self._writes) >= MAX_WRITES:
+            raise ValueError(f"A batch can contain at most {MAX_WRITES} writes")
+        self._writes.append(write)
+
+    def create(self, reference: DocumentReference, document_data: dict):
+        self._add(("create", reference, document_data, False))
+
+    def set(self, reference: DocumentReference, document_data: dict, merge: bool = False):
+        self._add(("set", reference, document_data, merge))
+
+    def update(self, reference: DocumentReference, field_updates: dict):
+        self._add(("update", reference, field_updates, False))
+
+    def delete(self, reference: DocumentReference):
+        self._add(("delete", reference, None, False))
+
+    def _check_reads(self):
+        pass
+
+    def commit(self):
+        with self._client._operation("commit"):
+            self._check_reads()
+            engine = self._client._engine
+            # Validate every write before applying any, so a failed batch changes nothing
+            results = {}
+            for kind, reference, data, merge in self._writes:
+                current = results.get(reference.path, _MISSING)
+                if current is _MISSING:
+                    current = engine.get(reference.path)
+                if kind == "create" and current is not None:
+                    path = "/".join(reference.path)
+                    raise ValueError(f"Document already exists: {path}")
+                if kind == "delete":
+                    results[reference.path] = None
+                else:
+                    results[reference.path] = apply_write(
+                        current, data, merge=merge, update=kind == "update"
+                    )
+            for path, data in results.items():
+                if data is None:
+                    engine.delete(path)
+                else:
+                    engine.put(path, data)
+            engine.commit()
+        self._writes = []
+
+
+class TransactionConflict(Exception):
+    """A document read by a transaction changed before it committed"""
+
+
+class Transaction(WriteBatch):
+    """Transactions run one at a time, each holding the client's transaction lock.
+
+    Batched writes may still commit between a transaction's reads and its commit,
+    so the commit checks that everything the transaction read is unchanged and
+    raises TransactionConflict otherwise.
+    """
+
+    def __init__(self, client: "DocumentClient"):
+        super().__init__(client)
+        self._documents: dict[Path, Optional[dict]] = {}
+        self._queries: list[tuple[Query, list]] = []
+
+    def _read_document(self, path: Path, data: Optional[dict]):
+        self._documents.setdefault(path, data)
+
+    def _read_query(self, query: Query, rows: list):
+        self._queries.append((query, rows))
+
+    def _check_reads(self):
+        engine = self._client._engine
+        for path, data in self._documents.items():
+            if engine.get(path) != data:
+                raise TransactionConflict(f"Document changed: {'/'.join(path)}")
+        for query, rows in self._queries:
+            if query._run() != rows:
+                raise TransactionConflict("Query results changed")
+
+
+class DocumentClient:
+    def __init__(self, engine: StorageEngine, latency: float = 0.0):
+        self._engine = engine
+        # Held for each storage call, never during the artificial latency
+        self._lock = threading.RLock()
+        # Held by a running transaction, from its first read to its commit
+        self._transaction_lock = threading.RLock()
+        # Artificial delay per operation, in seconds
+        self.latency = latency
+        # Called with (operation, seconds) after every operation
+        self.on_operation: Optional[Callable[[str, float], None]] = None
+
+    @contextlib.contextmanager
+    def _operation(self, operation: str):
+        """Holds the client lock for one storage call.
+
+        The artificial latency is spent before taking the lock, so calls from
+        different threads overlap like network round trips do.
+        """
+        started = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            with self._lock:
+                yield
+        finally:
+            if self.on_operation is not None:
+                self.on_operation(operation, time.perf_counter() - started)
+
+    def collection(self, collection_id: str) -> CollectionReference:
+        return CollectionReference(self, (collection_id,))
+
+    def collections(self) -> list[CollectionReference]:
+        with self._lock:
+            return [self.collection(c) for c in self._engine.collections()]
+
+    def _get(self, reference: DocumentReference, transaction=None) -> DocumentSnapshot:
+        with self._operation("get"):
+            data = self._engine.get(reference.path)
+        if transaction is not None:
+            transaction._read_document(reference.path, data)
+        return DocumentSnapshot(reference, data)
+
+    def get_all(self, references: Iterable[DocumentReference]) -> Iterator[DocumentSnapshot]:
+        references = list(references)
+        with self._operation("get_all"):
+            snapshots = [
+                DocumentSnapshot(ref, self._engine.get(ref.path))
+                for ref in references
+            ]
+        return iter(snapshots)
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+
+    def transaction(self) -> Transaction:
+        return Transaction(self)
+
+    def run_transaction(self, func, *args, **kwargs):
+        """Runs func(transaction, *args, **kwargs) and commits its writes atomically.
+
+        func runs again when the commit finds a conflict, up to
+        MAX_TRANSACTION_ATTEMPTS times, like the Firestore client retries.
+        """
+        with self._transaction_lock:
+            for attempt in range(MAX_TRANSACTION_ATTEMPTS):
+                transaction = self.transaction()
+                result = func(transaction, *args, **kwargs)
+                try:
+                    transaction.commit()
+                    return result
+                except TransactionConflict:
+                    if attempt == MAX_TRANSACTION_ATTEMPTS - 1:
+                        raise
@@ -0,0 +1,41 @@
+"""In-process storage backend: documents live in dictionaries and are lost on exit."""
+
+from typing import Any, Iterable, Optional
+
+from db.backends.base import DocumentClient, Path, StorageEngine, matches
+
+
+class MemoryEngine(StorageEngine):
+    def __init__(self):
+        # parent collection path -> {document id: data}
+        self._collections: dict[Path, dict[str, dict]] = {}
+
+    def get(self, path: Path) -> Optional[dict]:
+        return self._collections.get(path[:-1], {}).get(path[-1])
+
+    def put(self, path: Path, data: dict):
+        self._collections.setdefault(path[:-1], {})[path[-1]] = data
+
+    def delete(self, path: Path):
+        documents = self._collections.get(path[:-1])
+        if documents is not None:
+            documents.pop(path[-1], None)
+            if not documents:
+                del self._collections[path[:-1]]
+
+    def scan(
+        self, parent: Path, filters: list[tuple[str, str, Any]]
+    ) -> Iterable[tuple[str, dict]]:
+        documents = self._collections.get(parent, {})
+        return [
+            (doc_id, data)
+            for doc_id, data in documents.items()
+            if matches(doc_id, data, filters)
+        ]
+
+    def collections(self) -> list[str]:
+        return sorted({path[0] for path in self._collections})
+
+
+def create_client(latency: float = 0.0) -> DocumentClient:
+    return DocumentClient(MemoryEngine(), latency=latency)
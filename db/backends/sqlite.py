@@ -0,0 +1,158 @@
+"""SQLite storage backend: documents are JSON rows, created_at is an indexed column."""
+
+import json
+import sqlite3
+from datetime import datetime
+from typing import Any, Iterable, Optional
+
+from db.backends.base import (
+    DocumentClient,
+    Path,
+    StorageEngine,
+    matches,
+    normalize,
+    split_field_path,
+)
+
+# Field stored in its own indexed column, so date range queries don't scan a collection
+INDEXED_FIELD = "created_at"
+_RANGE_OPERATORS = {"<", "<=", ">", ">=", "=="}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    parent TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL,
+    PRIMARY KEY (parent, id)
+);
+CREATE INDEX IF NOT EXISTS documents_created_at ON documents (parent, created_at);
+"""
+
+
+def _encode(value: Any):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__}")
+
+
+def _decode(value: dict):
+    if set(value) == {"$datetime"}:
+        return datetime.fromisoformat(value["$datetime"])
+    return value
+
+
+def _timestamp(value: Any) -> Optional[float]:
+    if isinstance(value, datetime):
+        return normalize(value).timestamp()
+    return None
+
+
+def _json_path(field_path: str) -> str:
+    parts = split_field_path(field_path)
+    if any('"' in part for part in parts):
+        raise NotImplementedError(f"Field path {field_path}")
+    return "$" + "".join(f'."{part}"' for part in parts)
+
+
+class SQLiteEngine(StorageEngine):
+    def __init__(self, path: str = ":memory:"):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, path: Path) -> Optional[dict]:
+        row = self._conn.execute(
+            "SELECT data FROM documents WHERE parent = ? AND id = ?",
+            ("/".join(path[:-1]), path[-1]),
+        ).fetchone()
+        return json.loads(row[0], object_hook=_decode) if row else None
+
+    def put(self, path: Path, data: dict):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO documents (parent, id, data, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (
+                "/".join(path[:-1]),
+                path[-1],
+                json.dumps(data, default=_encode),
+                _timestamp(data.get(INDEXED_FIELD)),
+            ),
+        )
+
+    def delete(self, path: Path):
+        self._conn.execute(
+            "DELETE FROM documents WHERE parent = ? AND id = ?",
+            ("/".join(path[:-1]), path[-1]),
+        )
+
+    def scan(
+        self, parent: Path, filters: list[tuple[str, str, Any]]
+    ) -> Iterable[tuple[str, dict]]:
+        sql = "SELECT id, data FROM documents WHERE parent = ?"
+        params: list[Any] = ["/".join(parent)]
+        for field_path, op, value in filters:
+            if field_path == INDEXED_FIELD and op in _RANGE_OPERATORS:
+                timestamp = _timestamp(value)
+                if timestamp is not None:
+                    sql += f" AND created_at {'=' if op == '==' else op} ?"
+                    params.append(timestamp)
+        for doc_id, raw in self._conn.execute(sql, params):
+            data = json.loads(raw, object_hook=_decode)
+            if matches(doc_id, data, filters):
+                yield doc_id, data
+
+    def aggregate(
+        self,
+        parent: Path,
+        filters: list[tuple[str, str, Any]],
+        required: list[str],
+        aggregations: list[tuple[str, Optional[str]]],
+    ) -> list[Any]:
+        """One SQL statement when every filter is a created_at range"""
+        if any(field_path != INDEXED_FIELD for field_path in required):
+            raise NotImplementedError("Only created_at can be required")
+
+        where = "parent = ?"
+        params: list[Any] = ["/".join(parent)]
+        if required:
+            where += " AND created_at IS NOT NULL"
+        for field_path, op, value in filters:
+            timestamp = _timestamp(value)
+            if (
+                field_path != INDEXED_FIELD
+                or op not in _RANGE_OPERATORS
+                or timestamp is None
+            ):
+                raise NotImplementedError(f"Filter on {field_path} {op}")
+            where += f" AND created_at {'=' if op == '==' else op} ?"
+            params.append(timestamp)
+
+        columns = []
+        column_params: list[Any] = []
+        for kind, field_path in aggregations:
+            if kind == "count":
+                columns.append("COUNT(*)")
+                continue
+            # Like Firestore, only numbers are summed and an empty sum is 0
+            json_path = _json_path(field_path)
+            columns.append(
+                "COALESCE(SUM(CASE WHEN json_type(data, ?) IN ('integer', 'real') "
+                "THEN json_extract(data, ?) END), 0)"
+            )
+            column_params += [json_path, json_path]
+
+        sql = f"SELECT {', '.join(columns)} FROM documents WHERE {where}"
+        return list(self._conn.execute(sql, column_params + params).fetchone())
+
+    def collections(self) -> list[str]:
+        rows = self._conn.execute("SELECT DISTINCT parent FROM documents")
+        return sorted({parent.split("/")[0] for (parent,) in rows})
+
+    def commit(self):
+        self._conn.commit()
+
+
+def create_client(path: str = ":memory:", latency: float = 0.0) -> DocumentClient:
+    return DocumentClient(SQLiteEngine(path), latency=latency)
@@ -0,0 +1,74 @@
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_WRITES = 500
+# Batches committed at the same time by one bulk delete
+BULK_DELETE_PARALLELISM = int(os.getenv("BULK_DELETE_PARALLELISM", "4"))
+
+# Shared by every bulk delete of the process, so concurrent deletes reuse the same
+# threads instead of starting a pool each
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=BULK_DELETE_PARALLELISM, thread_name_prefix="bulk-delete"
+            )
+        return _executor
+
+
+def delete_collection(
+    db, collection, on_progress: Optional[Callable[[int], None]] = None
+) -> int:
+    """Deletes every document of a collection in batches of 500 writes.
+
+    Pages are read with an empty field mask (references only) and up to
+    BULK_DELETE_PARALLELISM batches are committed concurrently while the next page
+    is read. Returns the number of deleted documents.
+    """
+    deleted = 0
+    in_flight = set()
+    last = None
+
+    def commit(snapshots) -> int:
+        batch = db.batch()
+        for snapshot in snapshots:
+            batch.delete(snapshot.reference)
+        batch.commit()
+        if on_progress is not None:
+            on_progress(len(snapshots))
+        return len(snapshots)
+
+    executor = _get_executor()
+    while True:
+        query = collection.select([]).limit(MAX_BATCH_WRITES)
+        if last is not None:
+            query = query.start_after(last)
+        snapshots = list(query.stream())
+        if not snapshots:
+            break
+        last = snapshots[-1]
+
+        if len(in_flight) >= BULK_DELETE_PARALLELISM:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            deleted += sum(future.result() for future in done)
+        in_flight.add(executor.submit(commit, snapshots))
+
+    deleted += sum(future.result() for future in in_flight)
+    return deleted
+
+
+def shutdown_executor():
+    """Waits for running deletes to commit their batches and stops the threads"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
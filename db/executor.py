@@ -0,0 +1,64 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator, Optional, TypeVar
+
+import tracing
+
+T = TypeVar("T")
+
+# Firestore calls are I/O bound (gRPC), so the pool is sized well above the CPU
+# count but still bounded, so a slow backend cannot spawn unlimited threads.
+FIRESTORE_MAX_WORKERS = int(os.getenv("FIRESTORE_MAX_WORKERS", "32"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=FIRESTORE_MAX_WORKERS, thread_name_prefix="firestore"
+        )
+    return _executor
+
+
+async def run_blocking(func: Callable[..., T], *args, **kwargs) -> T:
+    """Runs a blocking data-path call on the bounded executor.
+
+    The caller's context is copied so correlation IDs and other context
+    variables are still visible inside the worker thread. The call is profiled
+    when the request's trace asks for it.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, tracing.profiled, func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
+
+
+def iterate_in_thread(
+    async_iterator: AsyncIterator[T], loop: asyncio.AbstractEventLoop
+) -> Iterator[T]:
+    """Consumes an async iterator (e.g. a request body) from a worker thread.
+
+    Items are pulled from the event loop one at a time, so a slow consumer applies
+    backpressure instead of buffering the whole stream.
+    """
+
+    async def next_item():
+        return await async_iterator.__anext__()
+
+    while True:
+        try:
+            yield asyncio.run_coroutine_threadsafe(next_item(), loop).result()
+        except StopAsyncIteration:
+            return
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
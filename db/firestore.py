@@ -1,23 +1,172 @@
 import os
 import json
 import base64
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import firestore
+import threading
+import time
 from dotenv import load_dotenv
 
+import metrics
+import tracing
+
 load_dotenv()
 
-FIREBASE_CREDENTIALS_JSON = os.getenv("GOOGLE_SERVICE_ACCOUNT_B64")
+# firestore, memory or sqlite; the last two need no credentials or network access
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "expenses.sqlite3")
+# Artificial delay per storage call for the offline backends, to mimic a network hop
+STORAGE_LATENCY_MS = float(os.getenv("STORAGE_LATENCY_MS", "0"))
+
+# Field path of the document id, for order_by() and start_after() cursors
+DOCUMENT_ID = "__name__"
+
+db = None
+_db_lock = threading.Lock()
+
+
+def _client_module():
+    # Imported on first use, the Firestore client library takes a while to load
+    if STORAGE_BACKEND == "firestore":
+        from firebase_admin import firestore
+
+        return firestore
+    from db.backends import base
+
+    return base
+
+
+def __getattr__(name: str):
+    # Increment, DELETE_FIELD and SERVER_TIMESTAMP of the configured backend
+    if name in ("Increment", "DELETE_FIELD", "SERVER_TIMESTAMP"):
+        return getattr(_client_module(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _create_firestore_client():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    FIREBASE_CREDENTIALS_JSON = os.getenv("GOOGLE_SERVICE_ACCOUNT_B64")
+
+    decoded_credentials = base64.b64decode(FIREBASE_CREDENTIALS_JSON).decode("utf-8")
+
+    cred_dict = json.loads(decoded_credentials)
+    cred = credentials.Certificate(cred_dict)
+    firebase_admin.initialize_app(cred)
+
+    return _client_module().client()
+
+
+def _record_operation(operation: str, seconds: float):
+    metrics.firestore_operation_duration.observe(seconds, STORAGE_BACKEND, operation)
+    tracing.record_span(operation, seconds)
+
 
-decoded_credentials = base64.b64decode(FIREBASE_CREDENTIALS_JSON).decode("utf-8")
+# Firestore client RPCs, the streaming ones are timed until fully read
+_FIRESTORE_RPCS = ("get_document", "commit", "begin_transaction", "rollback")
+_FIRESTORE_STREAMING_RPCS = (
+    "batch_get_documents",
+    "run_query",
+    "run_aggregation_query",
+    "list_collection_ids",
+    "list_documents",
+)
 
-cred_dict = json.loads(decoded_credentials)
-cred = credentials.Certificate(cred_dict)
-firebase_admin.initialize_app(cred)
 
-db = firestore.client()
+def _timed_stream(operation: str, responses, started: float):
+    try:
+        yield from responses
+    finally:
+        _record_operation(operation, time.perf_counter() - started)
+
+
+def _timed_rpc(operation: str, rpc, streaming: bool):
+    def call(*args, **kwargs):
+        started = time.perf_counter()
+        if streaming:
+            return _timed_stream(operation, rpc(*args, **kwargs), started)
+        try:
+            return rpc(*args, **kwargs)
+        finally:
+            _record_operation(operation, time.perf_counter() - started)
+
+    return call
+
+
+def _instrument(client):
+    """Reports the duration of every storage call to metrics and the request trace"""
+    if STORAGE_BACKEND != "firestore":
+        client.on_operation = _record_operation
+        return
+    # Every client call goes through these methods of the generated API client
+    api = client._firestore_api
+    for name in _FIRESTORE_RPCS + _FIRESTORE_STREAMING_RPCS:
+        streaming = name in _FIRESTORE_STREAMING_RPCS
+        setattr(api, name, _timed_rpc(name, getattr(api, name), streaming))
+
+
+def _create_client():
+    latency = STORAGE_LATENCY_MS / 1000
+    if STORAGE_BACKEND == "firestore":
+        return _create_firestore_client()
+    if STORAGE_BACKEND == "memory":
+        from db.backends import memory
+
+        return memory.create_client(latency=latency)
+    if STORAGE_BACKEND == "sqlite":
+        from db.backends import sqlite
+
+        return sqlite.create_client(SQLITE_PATH, latency=latency)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
 
 
 def get_db():
+    """Returns the shared client of the configured backend, created on first use"""
+    global db
+    if db is None:
+        with _db_lock:
+            if db is None:
+                client = _create_client()
+                _instrument(client)
+                db = client
     return db
+
+
+def run_transaction(func, *args, **kwargs):
+    """Runs func(transaction, *args, **kwargs) in a Firestore transaction.
+
+    The call is retried by the client when the transaction is aborted by contention,
+    so func must only touch Firestore through the transaction it receives.
+    """
+    client = get_db()
+    if STORAGE_BACKEND == "firestore":
+        transactional = _client_module().transactional
+        return transactional(func)(client.transaction(), *args, **kwargs)
+    return client.run_transaction(func, *args, **kwargs)
+
+
+class AggregationUnsupported(Exception):
+    """The backend cannot aggregate this query, the documents must be read instead"""
+
+
+def count_and_sum(query, field_path: str) -> tuple[int, float]:
+    """count() and sum(field_path) of query, computed by the backend in one request.
+
+    Raises AggregationUnsupported when the client library or the backend has no
+    aggregation queries, or cannot run them for this query.
+    """
+    unsupported: tuple = (NotImplementedError,)
+    if STORAGE_BACKEND == "firestore":
+        from google.api_core.exceptions import Unimplemented
+
+        unsupported += (Unimplemented,)
+    try:
+        # sum() needs google-cloud-firestore 2.15
+        aggregation = query.count(alias="count").sum(field_path, alias="sum")
+    except AttributeError as e:
+        raise AggregationUnsupported(str(e)) from e
+    try:
+        (results,) = aggregation.get()
+    except unsupported as e:
+        raise AggregationUnsupported(str(e)) from e
+    values = {result.alias: result.value for result in results}
+    return int(values["count"]), values["sum"] or 0
@@ -1,13 +1,18 @@
 import contextvars
+import fcntl
 import json
 import logging
 import os
+import queue
+import tempfile
+import threading
 import time
 from datetime import datetime, timezone
 from typing import Optional
 from uuid import uuid4
 
-import pika
+import metrics
+import tracing
 
 correlation_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
     "correlation_id", default=None
@@ -30,11 +35,219 @@ def _rabbit_config():
         "exchange": os.getenv("RABBITMQ_EXCHANGE", "logs-exchange"),
         "queue": os.getenv("RABBITMQ_QUEUE", "logs-queue"),
         "routing_key": os.getenv("RABBITMQ_ROUTING_KEY", "logs.route"),
+        # In-memory buffer between emit() and the publisher thread
+        "buffer_size": int(os.getenv("RABBITMQ_BUFFER_SIZE", "10000")),
+        "batch_size": int(os.getenv("RABBITMQ_BATCH_SIZE", "100")),
+        # "drop" discards records when the buffer is full, "block" waits up to
+        # RABBITMQ_BLOCK_TIMEOUT seconds for room before dropping
+        "full_policy": os.getenv("RABBITMQ_FULL_POLICY", "drop"),
+        "block_timeout": float(os.getenv("RABBITMQ_BLOCK_TIMEOUT", "1")),
+        "reconnect_max_delay": float(os.getenv("RABBITMQ_RECONNECT_MAX_DELAY", "30")),
+        # Socket, connect and blocked-connection timeout, kept below CLOSE_TIMEOUT so
+        # a hung broker cannot hold the publisher thread past close()
+        "timeout": float(os.getenv("RABBITMQ_TIMEOUT", "3")),
+        # Records are spooled here while the broker is unreachable, in a directory
+        # per service and process, see claim_spool_directory
+        "spool_dir": os.getenv(
+            "RABBITMQ_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "log-spool")
+        ),
+        "spool_segment_bytes": int(
+            os.getenv("RABBITMQ_SPOOL_SEGMENT_BYTES", str(1024 * 1024))
+        ),
+        "spool_max_bytes": int(
+            os.getenv("RABBITMQ_SPOOL_MAX_BYTES", str(100 * 1024 * 1024))
+        ),
     }
 
 
+def claim_spool_directory(base: str):
+    """Returns a slot directory under base that no other process uses, and the
+    open lock file that holds it.
+
+    Slots are numbered and taken with an exclusive flock, so each worker of a
+    multi-process server spools on its own. The lock goes away with the process,
+    a restarted worker takes over a free slot and replays what is left in it.
+    """
+    os.makedirs(base, exist_ok=True)
+    slot = 0
+    while True:
+        lock_file = open(os.path.join(base, f"{slot}.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            slot += 1
+            continue
+        return os.path.join(base, str(slot)), lock_file
+
+
+class LogSpool:
+    """Append-only on-disk buffer of serialized log records.
+
+    Records are newline-delimited JSON in numbered segment files. Reading starts at
+    the oldest segment, the read position is persisted so a restart resumes the
+    replay instead of repeating it. When the spool grows past max_bytes the oldest
+    segments are dropped.
+
+    Record counts of the segments are saved in a small file whenever a segment is
+    full and on close, so opening the spool only reads segments it does not
+    cover, at most the one being written when the process stopped.
+    """
+
+    OFFSET_FILE = "head.offset"
+    SEGMENTS_FILE = "segments.meta"
+
+    def __init__(self, directory: str, segment_bytes: int, max_bytes: int):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        # [file name, records, bytes] per segment, oldest first
+        self.segments: list[list] = []
+        self._writer = None
+        self._read_offset = 0
+        self._read_records = 0
+
+        known = self._load_segments()
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".spool"):
+                size = os.path.getsize(self._path(name))
+                if known.get(name, (None, None))[1] == size:
+                    records = known[name][0]
+                else:
+                    with open(self._path(name), "rb") as f:
+                        records = f.read().count(b"\n")
+                self.segments.append([name, records, size])
+
+        offset_path = os.path.join(directory, self.OFFSET_FILE)
+        if os.path.exists(offset_path):
+            with open(offset_path) as f:
+                name, offset, records = f.read().split()
+            if self.segments and self.segments[0][0] == name:
+                self._read_offset, self._read_records = int(offset), int(records)
+
+    @property
+    def records(self) -> int:
+        return sum(segment[1] for segment in self.segments) - self._read_records
+
+    @property
+    def size(self) -> int:
+        return sum(segment[2] for segment in self.segments) - self._read_offset
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def append(self, bodies: list[bytes]):
+        for body in bodies:
+            if self._writer is None or self.segments[-1][2] >= self.segment_bytes:
+                self._open_segment()
+            self._writer.write(body + b"\n")
+            self.segments[-1][1] += 1
+            self.segments[-1][2] += len(body) + 1
+        self._writer.flush()
+
+        while self.size > self.max_bytes and len(self.segments) > 1:
+            name, records, _ = self.segments.pop(0)
+            self.dropped += records - self._read_records
+            os.remove(self._path(name))
+            self._read_offset = self._read_records = 0
+            self._save_offset()
+
+    def _load_segments(self) -> dict[str, tuple[int, int]]:
+        path = self._path(self.SEGMENTS_FILE)
+        if not os.path.exists(path):
+            return {}
+        known = {}
+        with open(path) as f:
+            for line in f:
+                name, records, size = line.split()
+                known[name] = (int(records), int(size))
+        return known
+
+    def _save_segments(self):
+        path = self._path(self.SEGMENTS_FILE)
+        with open(path + ".tmp", "w") as f:
+            for name, records, size in self.segments:
+                f.write(f"{name} {records} {size}\n")
+        os.replace(path + ".tmp", path)
+
+    def _open_segment(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._save_segments()
+        last = int(self.segments[-1][0].split(".")[0]) if self.segments else 0
+        name = f"{last + 1:012d}.spool"
+        self._writer = open(self._path(name), "ab")
+        self.segments.append([name, 0, 0])
+
+    def peek(self, limit: int) -> list[bytes]:
+        """Returns up to limit of the oldest records without consuming them"""
+        if not self.segments:
+            return []
+        if self._writer is not None:
+            self._writer.flush()
+        bodies = []
+        with open(self._path(self.segments[0][0]), "rb") as f:
+            f.seek(self._read_offset)
+            while len(bodies) < limit:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                bodies.append(line[:-1])
+        return bodies
+
+    def consume(self, bodies: list[bytes]):
+        """Marks records returned by peek() as delivered"""
+        if not bodies:
+            return
+        self._read_offset += sum(len(body) + 1 for body in bodies)
+        self._read_records += len(bodies)
+
+        name, records, _ = self.segments[0]
+        if self._read_records >= records:
+            if len(self.segments) == 1 and self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self.segments.pop(0)
+            os.remove(self._path(name))
+            self._read_offset = self._read_records = 0
+        self._save_offset()
+
+    def _save_offset(self):
+        path = self._path(self.OFFSET_FILE)
+        if not self.segments:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self.segments[0][0]} {self._read_offset} {self._read_records}")
+        os.replace(path + ".tmp", path)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._save_segments()
+
+
+# Seconds close() waits for the publisher thread to spool what is left
+CLOSE_TIMEOUT = 5
+
+
 class RabbitMQHandler(logging.Handler):
+    """Log handler that never talks to RabbitMQ on the caller's thread.
+
+    emit() serializes the record and puts it on a bounded queue. A publisher thread
+    owns the connection, publishes the queue in batches of one AMQP transaction each
+    and reconnects with exponential backoff. While the broker is unreachable records go
+    to a LogSpool on disk, which the same thread replays in order once it is back.
+    """
+
     def __init__(self, service_name: str):
+        # Imported here, so importing the app does not load the RabbitMQ client
+        import pika
+
         super().__init__()
         cfg = _rabbit_config()
         credentials = pika.PlainCredentials(cfg["user"], cfg["password"])
@@ -43,18 +256,47 @@ class RabbitMQHandler(logging.Handler):
             port=cfg["port"],
             credentials=credentials,
             heartbeat=0,
+            socket_timeout=cfg["timeout"],
+            stack_timeout=cfg["timeout"],
+            blocked_connection_timeout=cfg["timeout"],
         )
         self.exchange = cfg["exchange"]
         self.queue = cfg["queue"]
         self.routing_key = cfg["routing_key"]
         self.service_name = service_name
+        self.batch_size = cfg["batch_size"]
+        self.full_policy = cfg["full_policy"]
+        self.block_timeout = cfg["block_timeout"]
+        self.reconnect_max_delay = cfg["reconnect_max_delay"]
         self.connection = None
         self.channel = None
-        self._connect()
+        spool_dir, self._spool_lock = claim_spool_directory(
+            os.path.join(cfg["spool_dir"], service_name)
+        )
+        self.spool = LogSpool(
+            spool_dir,
+            cfg["spool_segment_bytes"],
+            cfg["spool_max_bytes"],
+        )
+
+        self.buffer: queue.Queue = queue.Queue(maxsize=cfg["buffer_size"])
+        self.queued = 0
+        self.published = 0
+        self.dropped = 0
+        self.spooled = 0
+        self._counter_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._publisher = threading.Thread(
+            target=self._run, name="rabbitmq-log-publisher", daemon=True
+        )
+        self._publisher.start()
+        metrics.registry.add_collector(self._collect_metrics)
 
     def _connect(self):
         if self.connection and getattr(self.connection, "is_open", False):
             return
+        import pika
+
         self.connection = pika.BlockingConnection(self.connection_params)
         self.channel = self.connection.channel()
         self.channel.exchange_declare(
@@ -64,39 +306,213 @@ class RabbitMQHandler(logging.Handler):
         self.channel.queue_bind(
             queue=self.queue, exchange=self.exchange, routing_key=self.routing_key
         )
+        # Publishes are held by the broker until tx_commit, one round trip per batch
+        self.channel.tx_select()
 
-    def emit(self, record: logging.LogRecord):
+    def _disconnect(self):
         try:
-            self._connect()
-            correlation_id = getattr(record, "correlation_id", None) or get_correlation_id()
-            url = getattr(record, "url", "") or getattr(record, "path", "")
-            timestamp = datetime.now(timezone.utc).isoformat()
-            payload = {
-                "timestamp": timestamp,
-                "level": record.levelname,
-                "message": record.getMessage(),
-                "service": self.service_name,
-                "correlation_id": correlation_id,
-                "url": url,
-                "method": getattr(record, "method", ""),
-                "status_code": getattr(record, "status_code", None),
-                "detail": getattr(record, "detail", None),
+            if self.connection and self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            pass
+        self.connection = None
+        self.channel = None
+
+    def _count(self, name: str, amount: int = 1):
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def stats(self) -> dict:
+        with self._counter_lock:
+            return {
+                "queued": self.queued,
+                "published": self.published,
+                "dropped": self.dropped,
+                "depth": self.buffer.qsize(),
+                "spooled": self.spooled,
+                "spool_records": self.spool.records,
+                "spool_bytes": self.spool.size,
+                "spool_dropped": self.spool.dropped,
             }
-            payload["formatted"] = (
-                f"{timestamp} {record.levelname} {url} "
-                f"Correlation:{correlation_id or '-'} [{self.service_name}] - {payload['message']}"
-            )
-            body = json.dumps(payload).encode("utf-8")
-            self.channel.basic_publish(
-                exchange=self.exchange,
-                routing_key=self.routing_key,
-                body=body,
-                properties=pika.BasicProperties(
-                    content_type="application/json", delivery_mode=2
-                ),
-            )
+
+    def _collect_metrics(self):
+        stats = self.stats()
+        labels = {"service": self.service_name}
+        return [
+            (
+                "rabbitmq_log_queue_depth",
+                "gauge",
+                "Log records waiting in memory for the publisher thread.",
+                [(labels, stats["depth"])],
+            ),
+            (
+                "rabbitmq_log_spool_records",
+                "gauge",
+                "Log records spooled on disk while the broker is unreachable.",
+                [(labels, stats["spool_records"])],
+            ),
+            (
+                "rabbitmq_log_records_total",
+                "counter",
+                "Log records by outcome.",
+                [
+                    ({**labels, "outcome": outcome}, stats[outcome])
+                    for outcome in ("queued", "published", "dropped", "spooled")
+                ],
+            ),
+        ]
+
+    def _serialize(self, record: logging.LogRecord) -> bytes:
+        # Runs on the caller's thread, so the correlation id context is still set
+        correlation_id = getattr(record, "correlation_id", None) or get_correlation_id()
+        url = getattr(record, "url", "") or getattr(record, "path", "")
+        timestamp = datetime.now(timezone.utc).isoformat()
+        payload = {
+            "timestamp": timestamp,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "service": self.service_name,
+            "correlation_id": correlation_id,
+            "url": url,
+            "method": getattr(record, "method", ""),
+            "status_code": getattr(record, "status_code", None),
+            "detail": getattr(record, "detail", None),
+            # Storage calls of the request, see tracing.Trace.summary
+            "trace": getattr(record, "trace", None),
+        }
+        payload["formatted"] = (
+            f"{timestamp} {record.levelname} {url} "
+            f"Correlation:{correlation_id or '-'} [{self.service_name}] - {payload['message']}"
+        )
+        return json.dumps(payload).encode("utf-8")
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            body = self._serialize(record)
         except Exception:
             self.handleError(record)
+            return
+
+        try:
+            if self.full_policy == "block":
+                self.buffer.put(body, timeout=self.block_timeout)
+            else:
+                self.buffer.put_nowait(body)
+        except queue.Full:
+            self._count("dropped")
+            return
+        self._count("queued")
+
+    def _next_batch(self, timeout: float) -> list[bytes]:
+        try:
+            if timeout:
+                batch = [self.buffer.get(timeout=timeout)]
+            else:
+                batch = [self.buffer.get_nowait()]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.buffer.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _publish(self, batch: list[bytes]) -> int:
+        """Publishes bodies in order in one transaction.
+
+        basic_publish does not wait for the broker, tx_commit returns once it has
+        taken the whole batch. Returns len(batch) on commit and 0 on any failure,
+        the batch is then published again as a whole.
+        """
+        try:
+            self._connect()
+        except Exception:
+            self._disconnect()
+            return 0
+
+        import pika
+
+        properties = pika.BasicProperties(
+            content_type="application/json", delivery_mode=2
+        )
+        try:
+            for body in batch:
+                self.channel.basic_publish(
+                    exchange=self.exchange,
+                    routing_key=self.routing_key,
+                    body=body,
+                    properties=properties,
+                )
+            self.channel.tx_commit()
+        except Exception:
+            self._disconnect()
+            return 0
+        return len(batch)
+
+    def _to_spool(self, bodies: list[bytes]):
+        self.spool.append(bodies)
+        self._count("spooled", len(bodies))
+
+    def _run(self):
+        try:
+            self._deliver()
+        finally:
+            # The thread owns the connection and the spool, so it closes them, also
+            # when close() stopped waiting for it
+            self._disconnect()
+            self.spool.close()
+            self._spool_lock.close()
+
+    def _deliver(self):
+        delay = 0.5
+        retry_at = 0.0
+
+        def failed():
+            nonlocal delay, retry_at
+            retry_at = time.monotonic() + delay
+            delay = min(delay * 2, self.reconnect_max_delay)
+
+        while True:
+            stopping = self._stopping.is_set()
+            draining = self.spool.records and time.monotonic() >= retry_at
+            batch = self._next_batch(timeout=0 if stopping or draining else 0.5)
+            if stopping:
+                # Whatever is left is kept on disk and replayed after a restart
+                if batch:
+                    self._to_spool(batch)
+                    continue
+                break
+
+            broker_down = time.monotonic() < retry_at
+            if batch:
+                # Records queue up behind the spool so delivery stays in order
+                if self.spool.records or broker_down:
+                    self._to_spool(batch)
+                else:
+                    published = self._publish(batch)
+                    self._count("published", published)
+                    if published < len(batch):
+                        self._to_spool(batch[published:])
+                        failed()
+                        continue
+                    delay = 0.5
+
+            if self.spool.records and not broker_down:
+                bodies = self.spool.peek(self.batch_size)
+                published = self._publish(bodies)
+                self.spool.consume(bodies[:published])
+                self._count("published", published)
+                if published < len(bodies):
+                    failed()
+                    continue
+                delay = 0.5
+
+    def close(self):
+        self._stopping.set()
+        self._publisher.join(timeout=CLOSE_TIMEOUT)
+        metrics.registry.remove_collector(self._collect_metrics)
+        super().close()
 
 
 def setup_logging(service_name: str) -> logging.Logger:
@@ -144,14 +560,35 @@ def get_logger() -> logging.Logger:
     return logging.getLogger()
 
 
+def shutdown_logging():
+    """Closes the handlers added by setup_logging, queued records are spooled"""
+    global _logger
+    if _logger is None:
+        return
+    for handler in list(_logger.handlers):
+        _logger.removeHandler(handler)
+        handler.close()
+    _logger = None
+
+
 def init_request_logging(app, service_name: str):
-    logger = setup_logging(service_name)
+    """Installs the correlation id and request log middleware.
+
+    The handlers are added by setup_logging, which the app's lifespan calls, so
+    installing the middleware at import time neither reads the log spool nor
+    starts the RabbitMQ publisher.
+    """
+    global _service_name
+    _service_name = service_name
+    # The same logger setup_logging configures later
+    logger = get_logger()
 
     @app.middleware("http")
     async def correlation_and_logging_middleware(request, call_next):
         cid = request.headers.get("X-Correlation-Id") or str(uuid4())
         correlation_id_var.set(cid)
         request.state.correlation_id = cid
+        trace = tracing.start_trace(cid, tracing.wants_profile(request.headers))
 
         start = time.perf_counter()
         try:
@@ -167,6 +604,7 @@ def init_request_logging(app, service_name: str):
                     "method": request.method,
                     "status_code": 500,
                     "detail": f"{elapsed*1000:.2f}ms",
+                    "trace": trace.summary(),
                 },
             )
             raise
@@ -182,6 +620,7 @@ def init_request_logging(app, service_name: str):
                 "method": request.method,
                 "status_code": response.status_code,
                 "detail": f"{elapsed*1000:.2f}ms",
+                "trace": trace.summary(),
             },
         )
         return response
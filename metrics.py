@@ -0,0 +1,242 @@
+"""
+In-process metrics in the Prometheus text format, served at /metrics.
+
+Recording never takes a lock: every thread counts into its own shard of each
+metric, and a scrape sums the shards. A scrape can miss increments made while it
+runs, they show up in the next one. When a thread ends, its shard is folded into
+a retired shard, so short-lived threads do not add up. Values that already live elsewhere (queue
+depths) are read by collectors at scrape time instead of being recorded.
+"""
+
+import bisect
+import threading
+import weakref
+from typing import Callable, Iterable, Iterator
+
+# Seconds, from sub-millisecond storage calls to slow report requests
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _ThreadToken:
+    """Lives in a thread's local storage, it is freed when the thread ends"""
+
+    __slots__ = ("__weakref__",)
+
+
+def _add(total: dict[tuple, list], shard: dict, size: int):
+    # A copy, another thread may add a label set meanwhile
+    for labels, cell in list(shard.items()):
+        sums = total.setdefault(labels, [0] * size)
+        for index, value in enumerate(cell):
+            sums[index] += value
+
+
+class _Metric:
+    type = ""
+    # Values per label set, see _merged
+    _size = 1
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: list[dict] = []
+        # Sums of the shards of threads that ended
+        self._retired: dict[tuple, list] = {}
+        # Reentrant, a thread holding it may free another thread's token
+        self._shards_lock = threading.RLock()
+
+    def _cells(self) -> dict:
+        try:
+            return self._local.cells
+        except AttributeError:
+            # Once per thread, the only time recording locks
+            cells: dict = {}
+            self._local.cells = cells
+            self._local.token = token = _ThreadToken()
+            finalizer = weakref.finalize(token, self._retire, cells)
+            finalizer.atexit = False
+            with self._shards_lock:
+                self._shards.append(cells)
+            return cells
+
+    def _retire(self, cells: dict):
+        # The thread has ended, so its cells no longer change
+        with self._shards_lock:
+            _add(self._retired, cells, self._size)
+            self._shards.remove(cells)
+
+    def _merged(self) -> dict[tuple, list]:
+        merged: dict[tuple, list] = {}
+        # Held throughout, so a shard retired meanwhile is not counted twice
+        with self._shards_lock:
+            _add(merged, self._retired, self._size)
+            for shard in list(self._shards):
+                _add(merged, shard, self._size)
+        return merged
+
+    def _header(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        cells = self._cells()
+        cell = cells.get(labels)
+        if cell is None:
+            cell = cells[labels] = [0]
+        cell[0] += amount
+
+    def collect(self) -> list[str]:
+        lines = self._header()
+        for labels, (value,) in sorted(self._merged().items()):
+            suffix = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}{suffix} {_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """Goes up and down through inc() and dec(), each thread keeps its net change"""
+
+    type = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # One count per bucket, one for +Inf, then the sum
+        self._size = len(self.buckets) + 2
+
+    def observe(self, value: float, *labels):
+        cells = self._cells()
+        cell = cells.get(labels)
+        if cell is None:
+            cell = cells[labels] = [0] * self._size
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def collect(self) -> list[str]:
+        lines = self._header()
+        bounds = self.buckets + (float("inf"),)
+        for labels, cell in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, cell):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_labels(self.labelnames, labels, le)} "
+                    f"{cumulative}"
+                )
+            suffix = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {_number(cell[-1])}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+# A collector returns (name, type, help, samples), samples are (labels, value)
+Collector = Callable[[], Iterable[tuple[str, str, str, Iterable[tuple[dict, float]]]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors: list[Collector] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector):
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector: Collector):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def _collected(self) -> Iterator[str]:
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, metric_type, documentation, samples in families:
+                yield f"# HELP {name} {documentation}"
+                yield f"# TYPE {name} {metric_type}"
+                for labels, value in samples:
+                    names, values = tuple(labels), tuple(labels.values())
+                    yield f"{name}{_labels(names, values)} {_number(value)}"
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        lines.extend(self._collected())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(
+    Counter(
+        "http_requests_total",
+        "HTTP requests by method, route template and status code.",
+        ("method", "route", "status"),
+    )
+)
+http_request_duration = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time from receiving a request to the end of its response.",
+        ("method", "route"),
+    )
+)
+http_requests_in_flight = registry.register(
+    Gauge("http_requests_in_flight", "Requests being handled right now.")
+)
+firestore_operation_duration = registry.register(
+    Histogram(
+        "firestore_operation_duration_seconds",
+        "Storage backend calls by operation, _count is the number of calls.",
+        ("backend", "operation"),
+    )
+)
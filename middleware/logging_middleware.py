@@ -1,25 +1,27 @@
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
-from services.request_statistics_service import RequestStatisticsService
+from routers.dependencies import get_statistics_buffer
 
 
 class LoggingMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app):
-        super().__init__(app)
-        self.statistics_service = RequestStatisticsService()
-
     async def dispatch(self, request: Request, call_next):
         # Log the request path
         path = request.url.path
         method = request.method
 
-        # Skip logging for statistics endpoints themselves to avoid recursion
-        if "/statistics" not in path and path != "/docs" and path != "/openapi.json":
+        response = await call_next(request)
+
+        # Calls are counted per route template, as in MetricsMiddleware, so ids in
+        # the path add no statistics documents. The router sets it on the scope.
+        route = request.scope.get("route")
+
+        # Skip logging for statistics endpoints themselves to avoid recursion, for
+        # metrics scrapes and for paths no route matched
+        if route is not None and "/statistics" not in path and path not in ("/docs", "/openapi.json", "/metrics"):
             try:
-                # Save the call to statistics
-                self.statistics_service.save_call(path)
+                # Count the call in memory, it is flushed to Firestore in the background
+                get_statistics_buffer.get().record(route.path)
             except Exception as e:
                 print(f"Error logging request: {e}")
 
-        response = await call_next(request)
         return response
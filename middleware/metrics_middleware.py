@@ -0,0 +1,44 @@
+import time
+
+import metrics
+
+# Label of requests no route matched, so unknown paths add no new series
+UNMATCHED_ROUTE = "unmatched"
+
+
+class MetricsMiddleware:
+    """Records request counts, latency and in-flight requests per route template.
+
+    Plain ASGI instead of BaseHTTPMiddleware, so it adds no task or stream per
+    request. The route is read from the scope after the router has matched it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics.http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.http_requests_in_flight.dec()
+            route = scope.get("route")
+            template = getattr(route, "path", UNMATCHED_ROUTE)
+            method = scope["method"]
+            metrics.http_requests.inc(method, template, status_code)
+            metrics.http_request_duration.observe(
+                time.perf_counter() - started, method, template
+            )
@@ -0,0 +1,113 @@
+"""
+Backfills the endpoint field on call statistics documents written before it existed.
+
+    python -m migrations.backfill_statistics_endpoints [--batch-size 499] [--restart]
+
+The checkpoint (last processed document id) is committed in the same batch as the
+updates, so an interrupted run resumes right after the last committed document.
+When the scan finishes the schema_version marker is raised and later runs exit
+without touching the collection.
+"""
+
+import argparse
+import time
+
+from db.firestore import DELETE_FIELD, DOCUMENT_ID, SERVER_TIMESTAMP
+from services.request_statistics_service import (
+    MAX_BATCH_WRITES,
+    META_COLLECTION,
+    STATISTICS_SCHEMA_DOCUMENT,
+    STATISTICS_SCHEMA_VERSION,
+    STATISTICS_SUMMARY_DOCUMENT,
+    RequestStatisticsService,
+)
+
+
+# One write in every batch is reserved for the checkpoint
+PAGE_SIZE = MAX_BATCH_WRITES - 1
+
+
+def endpoint_from_document_name(document_name: str) -> str:
+    # soa-expenseService-expenses -> /expenses
+    return "/" + document_name.replace("soa-expenseService-", "").replace("_", "/")
+
+
+def run(batch_size: int = PAGE_SIZE, restart: bool = False) -> dict:
+    statistics_service = RequestStatisticsService()
+    db = statistics_service.db
+    marker_ref = db.collection(META_COLLECTION).document(STATISTICS_SCHEMA_DOCUMENT)
+    marker = marker_ref.get().to_dict() or {}
+
+    if marker.get("schema_version", 1) >= STATISTICS_SCHEMA_VERSION and not restart:
+        print(f"Statistics schema already at version {marker['schema_version']}")
+        return marker
+
+    checkpoint = None if restart else marker.get("checkpoint")
+    scanned = 0 if restart else marker.get("scanned", 0)
+    updated = 0 if restart else marker.get("updated", 0)
+    if checkpoint:
+        print(f"Resuming after {checkpoint} ({scanned} scanned, {updated} updated)")
+
+    collection = db.collection(statistics_service.collection_name)
+    started = time.perf_counter()
+
+    while True:
+        query = collection.order_by(DOCUMENT_ID).limit(batch_size)
+        if checkpoint:
+            query = query.start_after({DOCUMENT_ID: checkpoint})
+
+        documents = list(query.stream())
+        if not documents:
+            break
+
+        batch = db.batch()
+        for doc in documents:
+            if "endpoint" not in doc.to_dict():
+                batch.update(
+                    doc.reference, {"endpoint": endpoint_from_document_name(doc.id)}
+                )
+                updated += 1
+        scanned += len(documents)
+        checkpoint = documents[-1].id
+
+        batch.set(
+            marker_ref,
+            {"checkpoint": checkpoint, "scanned": scanned, "updated": updated},
+            merge=True,
+        )
+        batch.commit()
+
+        elapsed = time.perf_counter() - started
+        print(
+            f"{scanned} scanned, {updated} updated, last {checkpoint} "
+            f"({elapsed:.1f}s)"
+        )
+
+    marker_ref.set(
+        {
+            "schema_version": STATISTICS_SCHEMA_VERSION,
+            "checkpoint": DELETE_FIELD,
+            "scanned": scanned,
+            "updated": updated,
+            "migrated_at": SERVER_TIMESTAMP,
+        },
+        merge=True,
+    )
+    # The summary skipped documents without an endpoint, rebuild it on the next read
+    db.collection(META_COLLECTION).document(STATISTICS_SUMMARY_DOCUMENT).delete()
+    print(f"Done: {scanned} scanned, {updated} updated")
+    return {"scanned": scanned, "updated": updated}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=PAGE_SIZE)
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore the checkpoint and rescan"
+    )
+    args = parser.parse_args()
+    run(min(args.batch_size, PAGE_SIZE), args.restart)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Converts expense documents to the item layout selected by EXPENSE_ITEM_ENCODING.
+
+    python -m migrations.convert_expense_items USER_ID [USER_ID ...]
+    python -m migrations.convert_expense_items --all [--batch-size 500]
+    python -m migrations.convert_expense_items --all --encoding columnar
+
+Documents from before items were keyed by item_id are converted as well.
+
+Each page is read and rewritten in one transaction, so edits made while the
+migration runs are not lost. Converted documents are skipped, an interrupted run
+can simply be started again. Item updates also convert a document on the way.
+"""
+
+import argparse
+import time
+
+from db.bulk import MAX_BATCH_WRITES
+from db.firestore import DOCUMENT_ID, run_transaction
+from migrations.rebuild_rollups import NON_USER_COLLECTIONS
+from services.expense_codec import (
+    ITEM_ENCODING,
+    SCHEMA_VERSIONS,
+    decode_expense,
+    encode_expense,
+    schema_version,
+)
+from services.expense_service import ExpenseService
+
+
+def convert_user(
+    expense_service: ExpenseService,
+    user_id: str,
+    batch_size: int = MAX_BATCH_WRITES,
+    encoding: str = ITEM_ENCODING,
+) -> dict:
+    version = SCHEMA_VERSIONS[encoding]
+    collection = expense_service.expenses_collection(user_id)
+    scanned = 0
+    converted = 0
+    last_id = None
+
+    while True:
+        query = collection.order_by(DOCUMENT_ID).limit(batch_size)
+        if last_id:
+            query = query.start_after({DOCUMENT_ID: last_id})
+
+        def convert_page(transaction, query=query):
+            documents = list(query.stream(transaction=transaction))
+            count = 0
+            for doc in documents:
+                data = doc.to_dict()
+                if schema_version(data) != version:
+                    expense = decode_expense(doc.id, data)
+                    transaction.set(doc.reference, encode_expense(expense, version))
+                    count += 1
+            return [doc.id for doc in documents], count
+
+        document_ids, count = run_transaction(convert_page)
+        if not document_ids:
+            break
+        scanned += len(document_ids)
+        converted += count
+        last_id = document_ids[-1]
+
+    return {"scanned": scanned, "converted": converted}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("user_ids", nargs="*")
+    parser.add_argument(
+        "--all", action="store_true", help="convert every user in the database"
+    )
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_WRITES)
+    parser.add_argument(
+        "--encoding", choices=list(SCHEMA_VERSIONS), default=ITEM_ENCODING
+    )
+    args = parser.parse_args()
+
+    expense_service = ExpenseService()
+    user_ids = args.user_ids
+    if args.all:
+        user_ids = [
+            collection.id
+            for collection in expense_service.db.collections()
+            if collection.id not in NON_USER_COLLECTIONS
+        ]
+    if not user_ids:
+        parser.error("pass user ids or --all")
+
+    for index, user_id in enumerate(user_ids, start=1):
+        started = time.perf_counter()
+        result = convert_user(expense_service, user_id, args.batch_size, args.encoding)
+        elapsed = time.perf_counter() - started
+        print(
+            f"[{index}/{len(user_ids)}] {user_id}: {result['converted']} of "
+            f"{result['scanned']} expenses converted ({elapsed:.1f}s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
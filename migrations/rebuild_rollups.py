@@ -0,0 +1,63 @@
+"""
+Rebuilds the daily and monthly spending rollups from the stored expenses.
+
+    python -m migrations.rebuild_rollups USER_ID [USER_ID ...]
+    python -m migrations.rebuild_rollups --all
+
+Reports only read rollups once this has run for a user. Writes for a user should be
+paused while it is rebuilt, changes made during the rebuild are overwritten.
+"""
+
+import argparse
+import time
+
+from services.expense_service import ExpenseService
+from services.request_statistics_service import META_COLLECTION
+
+# Top-level collections that do not belong to a user
+NON_USER_COLLECTIONS = {"reports", META_COLLECTION}
+
+
+def rebuild_user(expense_service: ExpenseService, user_id: str) -> dict:
+    rollup_service = expense_service.rollup_service
+    expenses = expense_service.iter_expenses(user_id, None, None)
+    days, months = rollup_service.build(expenses)
+    rollup_service.replace(user_id, days, months)
+    return {
+        "expenses": sum(rollup.expense_count for rollup in days.values()),
+        "days": len(days),
+        "months": len(months),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("user_ids", nargs="*")
+    parser.add_argument(
+        "--all", action="store_true", help="rebuild every user in the database"
+    )
+    args = parser.parse_args()
+
+    expense_service = ExpenseService()
+    user_ids = args.user_ids
+    if args.all:
+        user_ids = [
+            collection.id
+            for collection in expense_service.db.collections()
+            if collection.id not in NON_USER_COLLECTIONS
+        ]
+    if not user_ids:
+        parser.error("pass user ids or --all")
+
+    for index, user_id in enumerate(user_ids, start=1):
+        started = time.perf_counter()
+        result = rebuild_user(expense_service, user_id)
+        elapsed = time.perf_counter() - started
+        print(
+            f"[{index}/{len(user_ids)}] {user_id}: {result['expenses']} expenses, "
+            f"{result['days']} days, {result['months']} months ({elapsed:.1f}s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+from datetime import date
+from typing import Optional
+from pydantic import BaseModel
+
+
+class SpendPoint(BaseModel):
+    # YYYY-MM-DD for days and weeks (the Monday), YYYY-MM for months
+    period: str
+    total: float
+    item_count: int
+
+
+class AveragePoint(BaseModel):
+    # Last day of the window
+    period: str
+    average: float
+
+
+class ItemTotal(BaseModel):
+    item_name: str
+    total: float
+    quantity: int
+    count: int
+
+
+class Analytics(BaseModel):
+    date_from: Optional[date]
+    date_to: Optional[date]
+    expense_count: int
+    item_count: int
+    total: float
+    # Of the spend per item (price * quantity), keyed p50, p90, ...
+    percentiles: dict[str, float]
+    daily: list[SpendPoint]
+    weekly: list[SpendPoint]
+    monthly: list[SpendPoint]
+    # Trailing average of daily spend, days without expenses count as 0
+    moving_average: list[AveragePoint]
+    # Item names with the highest total spend first
+    items: list[ItemTotal]
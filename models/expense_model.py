@@ -1,10 +1,14 @@
 from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel, field_serializer
 
+from models.datetime_format import format_datetime
 from models.item_model import Item
 
 
 class ExpenseResponse(BaseModel):
+    # Document id, only set on expenses read back from Firestore
+    expense_id: Optional[str] = None
     description: str
     items: list[Item]
     total_price: float
@@ -13,9 +17,14 @@ class ExpenseResponse(BaseModel):
 
     @field_serializer("created_at", "updated_at", mode="plain", when_used="json")
     def serialize_datetime(self, value: datetime) -> str:
-        return value.strftime("%Y/%m/%d %H:%M:%S")
+        return format_datetime(value)
 
 
 class ExpenseRequest(BaseModel):
     description: str
     items: list[Item]
+
+
+class ExpenseImport(ExpenseRequest):
+    # Original date of imported history, defaults to the time of the import
+    created_at: Optional[datetime] = None
@@ -0,0 +1,31 @@
+from datetime import datetime
+from enum import Enum
+from typing import Any, Optional
+from pydantic import BaseModel, field_serializer
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+class Job(BaseModel):
+    job_id: str
+    user_id: str
+    kind: str
+    status: JobStatus = JobStatus.queued
+    # Number of documents handled so far
+    processed: int = 0
+    result: Optional[dict[str, Any]] = None
+    error: Optional[str] = None
+    # Set by a cancel while running, the job stops at its next progress report
+    cancel_requested: bool = False
+    created_at: datetime
+    updated_at: datetime
+
+    @field_serializer("created_at", "updated_at", mode="plain", when_used="json")
+    def serialize_datetime(self, value: datetime) -> str:
+        return value.strftime("%Y/%m/%d %H:%M:%S")
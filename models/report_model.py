@@ -2,18 +2,28 @@ from datetime import date, datetime
 from typing import Optional
 from pydantic import BaseModel, field_serializer
 
-from models.expense_model import ExpenseResponse
+from models.datetime_format import format_datetime
 from models.item_model import Item
 
 
 class Report(BaseModel):
     date_from: Optional[date]
     date_to: Optional[date]
-    expenses: list[ExpenseResponse]
+    # Expenses are referenced by id, see ReportService.get_report_expenses. Only
+    # the first REPORT_EXPENSE_IDS_PER_PAGE ids, expense_count counts them all.
+    expense_ids: list[str]
+    expense_count: int
     most_expensive_items: list[Item]
     total_price: float
     created_at: datetime
 
     @field_serializer("created_at", mode="plain", when_used="json")
     def serialize_datetime(self, value: datetime) -> str:
-        return value.strftime("%Y/%m/%d %H:%M:%S")
+        return format_datetime(value)
+
+
+class Summary(BaseModel):
+    date_from: Optional[date]
+    date_to: Optional[date]
+    expense_count: int
+    total_price: float
@@ -0,0 +1,17 @@
+from datetime import datetime
+from pydantic import BaseModel
+
+from models.item_model import Item
+
+
+class Rollup(BaseModel):
+    # YYYY-MM-DD for daily rollups, YYYY-MM for monthly rollups
+    period: str
+    period_start: datetime
+    total_price: float = 0
+    expense_count: int = 0
+    item_count: int = 0
+    max_item_price: float = 0
+    most_expensive_items: list[Item] = []
+    # Only kept on daily rollups
+    expense_ids: list[str] = []
@@ -1,9 +1,36 @@
+import hashlib
+import os
+import time
 from fastapi import HTTPException, status, Header
-from typing import Optional
+from typing import Dict, Optional
+from services.cache import TTLCache
 from services.jwt_service import JWTService
 
 jwt_service = JWTService()
 
+# Verified access token payloads keyed by SHA-256 of the token, so repeated calls
+# with the same token skip signature verification. Entries never outlive the exp
+# claim, tokens without one are kept for at most JWT_CACHE_MAX_TTL seconds.
+JWT_CACHE_MAX_TTL = float(os.getenv("JWT_CACHE_MAX_TTL", "300"))
+token_cache = TTLCache(max_entries=int(os.getenv("JWT_CACHE_SIZE", "10000")))
+
+
+def verify_access_token(token: str) -> Optional[Dict]:
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+    payload = token_cache.get(key)
+    if payload is not None:
+        return payload
+
+    payload = jwt_service.verify_token(token, token_type="access")
+    if payload:
+        ttl = JWT_CACHE_MAX_TTL
+        if isinstance(payload.get("exp"), (int, float)):
+            ttl = min(ttl, payload["exp"] - time.time())
+        if ttl > 0:
+            token_cache.set(key, payload, ttl=ttl)
+    return payload
+
+
 async def verify_jwt_token(
     authorization: Optional[str] = Header(None, alias="Authorization")
 ) -> dict:
@@ -35,7 +62,7 @@ async def verify_jwt_token(
     token = parts[1]
     
     # Verify token
-    payload = jwt_service.verify_token(token, token_type="access")
+    payload = verify_access_token(token)
     
     if not payload:
         raise HTTPException(
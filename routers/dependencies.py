@@ -0,0 +1,75 @@
+"""
+Shared service instances, created on first use instead of at import time.
+
+Handlers receive them through Depends(), so importing the app neither connects to
+the storage backend nor builds any service. Each provider returns one instance
+for the whole process.
+"""
+
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+from db import bulk
+from services.analytics_service import AnalyticsService
+from services.call_statistics_buffer import CallStatisticsBuffer
+from services.expense_service import ExpenseService
+from services.job_service import JobService
+from services.report_service import ReportService
+from services.request_statistics_service import RequestStatisticsService
+
+T = TypeVar("T")
+
+# Reentrant, since a provider may call other providers while holding it
+_lock = threading.RLock()
+
+
+class SharedInstance(Generic[T]):
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self.instance: Optional[T] = None
+
+    def get(self) -> T:
+        if self.instance is None:
+            with _lock:
+                if self.instance is None:
+                    self.instance = self._factory()
+        return self.instance
+
+    async def __call__(self) -> T:
+        # Async, so FastAPI resolves the dependency without a threadpool hop
+        return self.get()
+
+
+get_expense_service = SharedInstance(ExpenseService)
+get_report_service = SharedInstance(
+    lambda: ReportService(expense_service=get_expense_service.get())
+)
+get_analytics_service = SharedInstance(
+    lambda: AnalyticsService(expense_service=get_expense_service.get())
+)
+get_job_service = SharedInstance(JobService)
+get_statistics_service = SharedInstance(RequestStatisticsService)
+get_statistics_buffer = SharedInstance(
+    lambda: CallStatisticsBuffer(get_statistics_service.get())
+)
+
+
+def warm_up():
+    """Builds the services and makes one cheap read, so the first request finds
+    an open connection to the storage backend"""
+    try:
+        get_expense_service.get()
+        get_report_service.get()
+        get_statistics_service.get().get_last_called_endpoint()
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+
+
+def shutdown():
+    """Flushes and stops whatever was created"""
+    if get_statistics_buffer.instance is not None:
+        get_statistics_buffer.instance.close()
+    if get_job_service.instance is not None:
+        get_job_service.instance.shutdown()
+    # After the jobs, which may still be deleting
+    bulk.shutdown_executor()
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Response
+
+import metrics
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Returns the metrics registry in the Prometheus text format
+    """
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
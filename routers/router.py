@@ -1,41 +1,171 @@
+import asyncio
+import hashlib
 from datetime import date
-from fastapi import APIRouter, Path, status, Query, HTTPException, Body, Depends
-from models.expense_model import ExpenseRequest
+from typing import Literal, Optional
+from fastapi import APIRouter, Path, status, Query, HTTPException, Body, Depends, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from models.analytics_model import Analytics
+from models.expense_model import ExpenseRequest, ExpenseResponse
+from models.report_model import Report, Summary
 from models.item_model import Item
+from services.analytics_service import AnalyticsService
 from services.expense_service import ExpenseService
 from services.report_service import ReportService
+from services.job_service import JobLimitExceeded, JobService
+from services.import_parser import IMPORT_PARSERS
 from routers.auth_dependency import verify_jwt_token
+from routers.dependencies import (
+    get_analytics_service,
+    get_expense_service,
+    get_job_service,
+    get_report_service,
+)
+from db.executor import iterate_in_thread, run_blocking
 
 router = APIRouter(prefix="/{user_id}/expenses", tags=["expenses"])
 
-expense_service = ExpenseService()
-report_service = ReportService()
+# Upper bound for the limit query parameter of paginated listings
+MAX_PAGE_SIZE = 1000
+# Upper bounds for the analytics top and window query parameters
+MAX_ANALYTICS_TOP = 1000
+MAX_ANALYTICS_WINDOW = 366
+
+# Expense lists are serialized by pydantic-core straight to JSON bytes. This skips
+# FastAPI's response validation and jsonable_encoder, the expenses were already
+# validated when they were read from the store.
+expense_list = TypeAdapter(list[ExpenseResponse])
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match uses weak comparison, so a W/ prefix is ignored"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def submit_job(
+    response: Response, job_service: JobService, user_id: str, kind: str, func
+):
+    """Queues a background job, answers 202 with it or 429 over the user's limit"""
+    try:
+        job = job_service.submit(user_id, kind, func)
+    except JobLimitExceeded as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    response.status_code = status.HTTP_202_ACCEPTED
+    return job
 
 
 @router.post("/create", status_code=status.HTTP_201_CREATED)
 async def create_expense(
     expense: ExpenseRequest, 
     user_id: str = Path(...),
+    expense_service: ExpenseService = Depends(get_expense_service),
     current_user: dict = Depends(verify_jwt_token)
 ):
     if current_user["user_id"] != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
     print(user_id, expense)
-    expense_id = expense_service.create_expense(user_id, expense)
+    try:
+        expense_id = await run_blocking(
+            expense_service.create_expense, user_id, expense
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     return {"message": "Expense created successfully", "expense_id": expense_id}
 
 
-@router.get("/", status_code=status.HTTP_200_OK)
+@router.post("/import", status_code=status.HTTP_200_OK)
+async def import_expenses(
+    request: Request,
+    user_id: str = Path(...),
+    expense_service: ExpenseService = Depends(get_expense_service),
+    current_user: dict = Depends(verify_jwt_token)
+):
+    """
+    Bulk import of expenses, the body is streamed and committed in batches.
+    Content-Type: application/json (array), application/x-ndjson or text/csv.
+    Invalid rows are reported in errors and do not abort the import.
+    """
+    if current_user["user_id"] != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    parser = IMPORT_PARSERS.get(content_type)
+    if parser is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Content-Type must be one of: {', '.join(IMPORT_PARSERS)}",
+        )
+
+    chunks = iterate_in_thread(request.stream(), asyncio.get_running_loop())
+    return await run_blocking(expense_service.import_expenses, user_id, parser(chunks))
+
+
+@router.get("/", status_code=status.HTTP_200_OK, response_model=list[ExpenseResponse])
 async def get_expense(
+    request: Request,
     user_id: str = Path(...), 
     date_from: date = Query(None), 
     date_to: date = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    start_after: Optional[str] = Query(None),
+    stream: bool = Query(False),
+    expense_service: ExpenseService = Depends(get_expense_service),
     current_user: dict = Depends(verify_jwt_token)
 ):
+    """
+    Returns expenses ordered by created_at.
+    With limit, the X-Next-Cursor header holds the start_after value of the next page.
+    With stream=true, expenses are streamed as NDJSON, one expense per line.
+    The ETag changes whenever the user's expenses change, a request with a matching
+    If-None-Match header gets 304 Not Modified without running the query.
+    """
     if current_user["user_id"] != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
-    expenses = expense_service.get_expenses_in_date_range(user_id, date_from, date_to)
-    return expenses
+
+    # Read before the query, so a concurrent change can only make the ETag older
+    # than the body, never newer
+    version = await run_blocking(expense_service.get_version, user_id)
+    query = sorted(request.query_params.multi_items())
+    digest = hashlib.sha256(f"{user_id}:{version}:{query}".encode()).hexdigest()
+    etag = f'"{digest[:32]}"'
+    headers = {"ETag": etag}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    def load_page():
+        expenses = expense_service.get_expenses_in_date_range(
+            user_id, date_from, date_to, limit, start_after
+        )
+        return expenses, expense_list.dump_json(expenses)
+
+    try:
+        if stream:
+            expenses = await run_blocking(
+                expense_service.iter_expenses,
+                user_id,
+                date_from,
+                date_to,
+                limit,
+                start_after,
+            )
+            return StreamingResponse(
+                (expense.model_dump_json() + "\n" for expense in expenses),
+                media_type="application/x-ndjson",
+                headers=headers,
+            )
+
+        expenses, body = await run_blocking(load_page)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if limit is not None and len(expenses) == limit:
+        headers["X-Next-Cursor"] = expenses[-1].expense_id
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @router.put("/{expense_id}/item/{item_id}/update", status_code=status.HTTP_200_OK)
@@ -44,12 +174,15 @@ async def update_item_by_id(
     expense_id: str = Path(...),
     item_id: str = Path(...),
     item: Item = Body(...),
+    expense_service: ExpenseService = Depends(get_expense_service),
     current_user: dict = Depends(verify_jwt_token)
 ):
     if current_user["user_id"] != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
     try:
-        return expense_service.update_item_by_id(user_id, expense_id, item_id, item)
+        return await run_blocking(
+            expense_service.update_item_by_id, user_id, expense_id, item_id, item
+        )
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
@@ -59,13 +192,17 @@ async def update_expense_description_by_id(
     user_id: str = Path(...),
     expense_id: str = Query(...),
     description: str = Body(..., embed=True),
+    expense_service: ExpenseService = Depends(get_expense_service),
     current_user: dict = Depends(verify_jwt_token)
 ):
     if current_user["user_id"] != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
     try:
-        return expense_service.update_expense_description_by_id(
-            user_id, expense_id, description
+        return await run_blocking(
+            expense_service.update_expense_description_by_id,
+            user_id,
+            expense_id,
+            description,
         )
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
@@ -73,83 +210,233 @@ async def update_expense_description_by_id(
 
 @router.post("/report/create", status_code=status.HTTP_201_CREATED)
 async def create_report(
+    response: Response,
     user_id: str = Path(...), 
     date_from: date = Query(None), 
     date_to: date = Query(None),
+    mode: Literal["sync", "async"] = Query("sync"),
+    report_service: ReportService = Depends(get_report_service),
+    job_service: JobService = Depends(get_job_service),
     current_user: dict = Depends(verify_jwt_token)
 ):
+    """
+    Aggregates the expenses of the range into a new report.
+    mode=async returns 202 with a job, poll it at /{user_id}/expenses/jobs/{job_id}.
+    The finished job holds the report id in its result.
+    """
     if current_user["user_id"] != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    if mode == "async":
+        return submit_job(
+            response,
+            job_service,
+            user_id,
+            "create-report",
+            lambda progress: {
+                "report_id": report_service.create_report(
+                    user_id, date_from, date_to, progress, parallel=True
+                )
+            },
+        )
     try:
-        report_id = report_service.create_report(user_id, date_from, date_to)
+        report_id = await run_blocking(
+            report_service.create_report, user_id, date_from, date_to
+        )
         return {"message": "Report successfuly created", "report id": report_id}
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
+@router.get("/summary", response_model=Summary)
+async def get_summary(
+    user_id: str = Path(...),
+    date_from: date = Query(None),
+    date_to: date = Query(None),
+    report_service: ReportService = Depends(get_report_service),
+    current_user: dict = Depends(verify_jwt_token)
+):
+    """
+    Returns the number of expenses of the range and their total price, computed by
+    the storage backend with count() and sum() aggregations.
+    """
+    if current_user["user_id"] != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    try:
+        return await run_blocking(
+            report_service.get_summary, user_id, date_from, date_to
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.get("/analytics", response_model=Analytics)
+async def get_analytics(
+    user_id: str = Path(...),
+    date_from: date = Query(None),
+    date_to: date = Query(None),
+    top: int = Query(20, ge=1, le=MAX_ANALYTICS_TOP),
+    window: int = Query(7, ge=1, le=MAX_ANALYTICS_WINDOW),
+    analytics_service: AnalyticsService = Depends(get_analytics_service),
+    current_user: dict = Depends(verify_jwt_token)
+):
+    """
+    Spending analytics of the range: daily, weekly and monthly spend, percentiles
+    of the spend per item, a moving average of daily spend over window days and
+    the top item names by total spend.
+    """
+    if current_user["user_id"] != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    try:
+        return await run_blocking(
+            analytics_service.get_analytics, user_id, date_from, date_to, top, window
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
 @router.get("/reports")
 async def get_all_report_ids(
     user_id: str = Path(...),
+    report_service: ReportService = Depends(get_report_service),
     current_user: dict = Depends(verify_jwt_token)
 ):
     if current_user["user_id"] != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
     try:
-        return report_service.get_all_report_ids(user_id)
+        return await run_blocking(report_service.get_all_report_ids, user_id)
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
-@router.get("/report")
+@router.get("/report", response_model=Report)
 async def get_report_by_id(
+    request: Request,
     user_id: str = Path(...), 
     report_id: str = Query(...),
+    report_service: ReportService = Depends(get_report_service),
+    current_user: dict = Depends(verify_jwt_token)
+):
+    """
+    Returns a report. Responses carry a strong ETag, a request with a matching
+    If-None-Match header gets 304 Not Modified.
+    """
+    if current_user["user_id"] != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    cached = report_service.cached_report_body(user_id, report_id)
+    try:
+        body, etag = cached or await run_blocking(
+            report_service.get_report_body, user_id, report_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/report/expenses", response_model=list[ExpenseResponse])
+async def get_report_expenses(
+    user_id: str = Path(...),
+    report_id: str = Query(...),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    report_service: ReportService = Depends(get_report_service),
     current_user: dict = Depends(verify_jwt_token)
 ):
+    """
+    Returns one page of the expenses a report was built from.
+    The X-Next-Offset header holds the offset of the next page, if there is one.
+    """
     if current_user["user_id"] != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    def load_page():
+        expenses, expense_count = report_service.get_report_expenses(
+            user_id, report_id, limit, offset
+        )
+        return expense_list.dump_json(expenses), expense_count
+
     try:
-        return report_service.get_report_by_id(user_id, report_id)
+        body, expense_count = await run_blocking(load_page)
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
 
+    headers = {}
+    if offset + limit < expense_count:
+        headers["X-Next-Offset"] = str(offset + limit)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 
 @router.delete("/report/delete/{report_id}")
 async def delete_report_by_id(
     user_id: str = Path(...), 
     report_id: str = Path(...),
+    report_service: ReportService = Depends(get_report_service),
     current_user: dict = Depends(verify_jwt_token)
 ):
     if current_user["user_id"] != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
     try:
-        return report_service.delete_report_by_id(user_id, report_id)
+        return await run_blocking(report_service.delete_report_by_id, user_id, report_id)
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
 
 
 @router.delete("/report/delete-all")
 async def delete_all_reports(
+    response: Response,
     user_id: str = Path(...),
+    mode: Literal["sync", "async"] = Query("sync"),
+    report_service: ReportService = Depends(get_report_service),
+    job_service: JobService = Depends(get_job_service),
     current_user: dict = Depends(verify_jwt_token)
 ):
+    """
+    Deletes all reports of the user in batched writes.
+    mode=async returns 202 with a job, poll it at /{user_id}/expenses/jobs/{job_id}.
+    """
     if current_user["user_id"] != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    if mode == "async":
+        return submit_job(
+            response,
+            job_service,
+            user_id,
+            "delete-all-reports",
+            lambda progress: report_service.delete_all(user_id, progress),
+        )
     try:
-        return report_service.delete_all(user_id)
+        return await run_blocking(report_service.delete_all, user_id)
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
 
 
 @router.delete("/expense/delete-all", status_code=status.HTTP_200_OK)
 async def delete_all_expenses(
+    response: Response,
     user_id: str = Path(...),
+    mode: Literal["sync", "async"] = Query("sync"),
+    expense_service: ExpenseService = Depends(get_expense_service),
+    job_service: JobService = Depends(get_job_service),
     current_user: dict = Depends(verify_jwt_token)
 ):
+    """
+    Deletes all expenses of the user in batched writes.
+    mode=async returns 202 with a job, poll it at /{user_id}/expenses/jobs/{job_id}.
+    """
     if current_user["user_id"] != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    if mode == "async":
+        return submit_job(
+            response,
+            job_service,
+            user_id,
+            "delete-all-expenses",
+            lambda progress: expense_service.delete_all(user_id, progress),
+        )
     try:
-        return expense_service.delete_all(user_id)
+        return await run_blocking(expense_service.delete_all, user_id)
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
 
@@ -158,11 +445,50 @@ async def delete_all_expenses(
 async def delete_expense_by_id(
     user_id: str = Path(...), 
     expense_id: str = Path(...),
+    expense_service: ExpenseService = Depends(get_expense_service),
+    current_user: dict = Depends(verify_jwt_token)
+):
+    if current_user["user_id"] != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    try:
+        return await run_blocking(expense_service.delete_by_id, user_id, expense_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+
+@router.get("/jobs/{job_id}", status_code=status.HTTP_200_OK)
+async def get_job(
+    user_id: str = Path(...),
+    job_id: str = Path(...),
+    job_service: JobService = Depends(get_job_service),
+    current_user: dict = Depends(verify_jwt_token)
+):
+    """
+    Returns the status and progress of a background job
+    """
+    if current_user["user_id"] != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    try:
+        return job_service.get(user_id, job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+
+@router.post("/jobs/{job_id}/cancel", status_code=status.HTTP_200_OK)
+async def cancel_job(
+    user_id: str = Path(...),
+    job_id: str = Path(...),
+    job_service: JobService = Depends(get_job_service),
     current_user: dict = Depends(verify_jwt_token)
 ):
+    """
+    Cancels a background job. Queued jobs are cancelled at once, running ones get
+    cancel_requested and stop at their next progress report. Finished jobs are
+    returned unchanged.
+    """
     if current_user["user_id"] != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
     try:
-        return expense_service.delete_by_id(user_id, expense_id)
+        return job_service.cancel(user_id, job_id)
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
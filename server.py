@@ -1,16 +1,51 @@
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
+from routers import dependencies
 from routers.router import router
 from routers.statistika_router import router as statistics_router
 from middleware.logging_middleware import LoggingMiddleware
+from middleware.metrics_middleware import MetricsMiddleware
+from routers.metrics_router import router as metrics_router
+from db.executor import shutdown_executor
+from logging_utils import init_request_logging, setup_logging, shutdown_logging
+from services.report_aggregation import shutdown_process_pool
+import threading
 import uvicorn
 import os
 
+# Builds the services and opens the storage connection in the background at
+# startup, instead of on the first request
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+
+SERVICE_NAME = os.getenv("SERVICE_NAME", "expense-service")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Starts the RabbitMQ log publisher, request logs before this are not shipped
+    setup_logging(SERVICE_NAME)
+    if WARMUP_ON_STARTUP:
+        warm_up = threading.Thread(target=dependencies.warm_up, daemon=True)
+        warm_up.start()
+    print(f"Started in {(time.perf_counter() - IMPORT_STARTED) * 1000:.0f} ms")
+    yield
+    dependencies.shutdown()
+    shutdown_executor()
+    shutdown_process_pool()
+    shutdown_logging()
+
+
 app = FastAPI(
     title="Expense Tracker Service",
     description="API for managing expenses and tracking API call statistics",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Add logging middleware
@@ -38,8 +73,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Correlation ids, request logs and storage traces (tracing.py)
+init_request_logging(app, SERVICE_NAME)
+
+# Added last so it is the outermost middleware and times everything else
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(router)
 app.include_router(statistics_router)
+app.include_router(metrics_router)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,38 @@
+from datetime import date
+from typing import Optional
+from models.analytics_model import Analytics
+from services.expense_service import ExpenseService
+
+
+class AnalyticsService:
+    def __init__(self, expense_service: Optional[ExpenseService] = None):
+        self.expense_service = expense_service or ExpenseService()
+
+    def get_analytics(
+        self,
+        user_id: Optional[str],
+        date_from: Optional[date],
+        date_to: Optional[date],
+        top: int = 20,
+        window: int = 7,
+    ) -> Analytics:
+        """Spend series, percentiles and item totals over the items of the range.
+
+        top limits the item names returned, window is the moving average length
+        in days.
+        """
+        # Imported on first use, numpy would add about 50 ms to every cold start
+        from services import spend_analytics
+
+        documents = self.expense_service.iter_expense_documents(
+            user_id, date_from, date_to, fields=spend_analytics.FIELDS
+        )
+        columns = spend_analytics.build_columns(documents)
+        if len(columns.prices) == 0:
+            raise ValueError("No expenses found")
+
+        return Analytics(
+            date_from=date_from,
+            date_to=date_to,
+            **spend_analytics.summarize(columns, top, window),
+        )
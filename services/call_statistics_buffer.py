@@ -0,0 +1,98 @@
+import os
+import threading
+from datetime import datetime
+from typing import Optional
+
+from services.request_statistics_service import RequestStatisticsService
+
+
+class CallStatisticsBuffer:
+    """Write-behind aggregator for API call counts.
+
+    Calls are counted in memory and flushed to Firestore by a background thread,
+    either every flush_interval seconds or as soon as max_pending calls are buffered.
+    """
+
+    def __init__(
+        self,
+        statistics_service: RequestStatisticsService,
+        flush_interval: Optional[float] = None,
+        max_pending: Optional[int] = None,
+    ):
+        self.statistics_service = statistics_service
+        self.flush_interval = flush_interval or float(
+            os.getenv("STATISTICS_FLUSH_INTERVAL", "5")
+        )
+        self.max_pending = max_pending or int(
+            os.getenv("STATISTICS_FLUSH_THRESHOLD", "500")
+        )
+        self._lock = threading.Lock()
+        self._pending: dict[str, tuple[int, datetime]] = {}
+        self._pending_calls = 0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, called_service: str):
+        endpoint = self.statistics_service.normalize_endpoint(called_service)
+        now = datetime.now()
+        with self._lock:
+            count, _ = self._pending.get(endpoint, (0, now))
+            self._pending[endpoint] = (count + 1, now)
+            self._pending_calls += 1
+            threshold_reached = self._pending_calls >= self.max_pending
+            if self._thread is None:
+                self._start()
+
+        if threshold_reached:
+            self._wakeup.set()
+
+    def _start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="call-statistics-flush", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Writes buffered deltas to Firestore, returns the number of calls flushed"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            flushed, self._pending_calls = self._pending_calls, 0
+
+        if not pending:
+            return 0
+
+        try:
+            self.statistics_service.record_calls(pending)
+        except Exception as e:
+            print(f"Error flushing call statistics: {e}")
+            self._restore(pending, flushed)
+            return 0
+        return flushed
+
+    def _restore(self, pending: dict[str, tuple[int, datetime]], calls: int):
+        # Merge failed deltas back so they are retried on the next flush
+        with self._lock:
+            for endpoint, (count, last_call) in pending.items():
+                buffered_count, buffered_last = self._pending.get(
+                    endpoint, (0, last_call)
+                )
+                self._pending[endpoint] = (
+                    buffered_count + count,
+                    max(buffered_last, last_call),
+                )
+            self._pending_calls += calls
+
+    def close(self):
+        """Stops the flush thread and drains everything still buffered"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
@@ -0,0 +1,155 @@
+"""
+Storage layout of expense documents, told apart by their schema_version field.
+
+Version 2 (default) keys items by item_id, so a single item can be read and
+updated through its field path without rewriting the others:
+
+    items: { item_id: { item_name, item_price, item_quantity, position } }
+
+Version 3 is the compact columnar layout, parallel arrays without repeated keys.
+Smaller documents, but an item update rewrites the whole items field:
+
+    items: { ids: [...], names: [...], prices: [...], quantities: [...] }
+
+Version 1 documents store items as a list of dicts. New documents use the layout
+selected by EXPENSE_ITEM_ENCODING, migrations/convert_expense_items.py rewrites
+existing ones. All layouts are decoded.
+"""
+
+import os
+from typing import Optional
+
+from pydantic import TypeAdapter
+
+from models.expense_model import ExpenseResponse
+from models.item_model import Item
+
+LIST_SCHEMA_VERSION = 1
+MAP_SCHEMA_VERSION = 2
+COLUMNAR_SCHEMA_VERSION = 3
+
+SCHEMA_VERSIONS = {"map": MAP_SCHEMA_VERSION, "columnar": COLUMNAR_SCHEMA_VERSION}
+# map or columnar
+ITEM_ENCODING = os.getenv("EXPENSE_ITEM_ENCODING", "map")
+EXPENSE_SCHEMA_VERSION = SCHEMA_VERSIONS[ITEM_ENCODING]
+
+
+def schema_version(data: dict) -> int:
+    return data.get("schema_version", LIST_SCHEMA_VERSION)
+
+
+def item_field_path(item_id: str, field: Optional[str] = None) -> str:
+    """Field path of an item, or of one of its fields, for update()"""
+    quoted = item_id.replace("\\", "\\\\").replace("`", "\\`")
+    path = f"items.`{quoted}`"
+    return f"{path}.{field}" if field else path
+
+
+def encode_item(item: Item, position: int) -> dict:
+    return {
+        "item_name": item.item_name,
+        "item_price": item.item_price,
+        "item_quantity": item.item_quantity,
+        "position": position,
+    }
+
+
+def encode_items(items: list[Item], version: int = EXPENSE_SCHEMA_VERSION):
+    if version == COLUMNAR_SCHEMA_VERSION:
+        return {
+            "ids": [item.item_id for item in items],
+            "names": [item.item_name for item in items],
+            "prices": [item.item_price for item in items],
+            "quantities": [item.item_quantity for item in items],
+        }
+    return {
+        item.item_id: encode_item(item, position) for position, item in enumerate(items)
+    }
+
+
+def encode_expense(
+    expense: ExpenseResponse, version: int = EXPENSE_SCHEMA_VERSION
+) -> dict:
+    data = expense.model_dump(exclude={"expense_id", "items"})
+    data["items"] = encode_items(expense.items, version)
+    data["schema_version"] = version
+    return data
+
+
+def _item_dicts(data: dict) -> list[dict]:
+    items = data["items"]
+    version = schema_version(data)
+    if version == COLUMNAR_SCHEMA_VERSION:
+        return [
+            {"item_id": i, "item_name": n, "item_price": p, "item_quantity": q}
+            for i, n, p, q in zip(
+                items["ids"], items["names"], items["prices"], items["quantities"]
+            )
+        ]
+    if version == MAP_SCHEMA_VERSION:
+        ordered = sorted(items.items(), key=lambda entry: entry[1]["position"])
+        return [{"item_id": item_id, **item} for item_id, item in ordered]
+    # Version 1, Item gives items written before item_id existed a new one
+    return items
+
+
+# Validating plain dicts in one call is faster than building models one by one,
+# and faster than model_construct, which runs in Python
+_items_adapter = TypeAdapter(list[Item])
+
+
+def decode_items(data: dict) -> list[Item]:
+    """Items of a stored expense document, in their original order"""
+    return _items_adapter.validate_python(_item_dicts(data))
+
+
+def item_columns(data: dict) -> tuple[list[str], list[float], list[int]]:
+    """Names, prices and quantities of the items, unvalidated and in no set order.
+
+    Cheaper than decode_items for analytics, columnar documents are returned as
+    stored.
+    """
+    items = data["items"]
+    if schema_version(data) == COLUMNAR_SCHEMA_VERSION:
+        return items["names"], items["prices"], items["quantities"]
+    values = items.values() if isinstance(items, dict) else items
+    return (
+        [item["item_name"] for item in values],
+        [item["item_price"] for item in values],
+        [item["item_quantity"] for item in values],
+    )
+
+
+def find_item(data: dict, item_id: str) -> Optional[Item]:
+    """Looks up one item, without decoding the others in the map layout"""
+    if schema_version(data) == MAP_SCHEMA_VERSION:
+        item = data["items"].get(item_id)
+        return Item(item_id=item_id, **item) if item is not None else None
+    return next((item for item in decode_items(data) if item.item_id == item_id), None)
+
+
+def item_update(data: dict, expense: ExpenseResponse, item: Item) -> Optional[dict]:
+    """Field updates that store item as changed in expense.
+
+    Returns None for version 1 documents, which must be rewritten as a whole.
+    """
+    version = schema_version(data)
+    if version == MAP_SCHEMA_VERSION:
+        position = data["items"][item.item_id]["position"]
+        return {item_field_path(item.item_id): encode_item(item, position)}
+    if version == COLUMNAR_SCHEMA_VERSION:
+        return {"items": encode_items(expense.items, version)}
+    return None
+
+
+def decode_expense(expense_id: Optional[str], data: dict) -> ExpenseResponse:
+    return ExpenseResponse.model_validate(
+        {
+            "expense_id": expense_id,
+            "description": data["description"],
+            "items": _item_dicts(data),
+            "total_price": data["total_price"],
+            "created_at": data["created_at"],
+            "updated_at": data["updated_at"],
+        }
+    )
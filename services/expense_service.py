@@ -1,28 +1,54 @@
-from typing import Optional
-from db.firestore import get_db
-from datetime import date, datetime
-from models.expense_model import ExpenseRequest, ExpenseResponse
+import time
+from typing import Callable, Iterable, Iterator, Optional, Union
+from db import firestore
+from db.bulk import MAX_BATCH_WRITES, delete_collection
+from db.firestore import (
+    AggregationUnsupported,
+    count_and_sum,
+    get_db,
+    run_transaction,
+)
+from datetime import date, datetime, timezone
+from models.expense_model import ExpenseImport, ExpenseRequest, ExpenseResponse
 from models.item_model import Item
+from services import expense_codec
+from services.rollup_service import RollupService
+
+# Row errors returned by an import, the failed count covers all of them
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+# Item ids are map keys in the stored document, Firestore caps those at 1500 bytes
+MAX_ITEM_ID_BYTES = 1500
 
 
 class ExpenseService:
     def __init__(self):
         self.db = get_db()
+        self.rollup_service = RollupService()
 
-    def create_expense(self, user_id: str, expense: ExpenseRequest) -> str:
-        doc_ref = (
-            self.db.collection(user_id)
-            .document("expenses")
-            .collection("expenses")
-            .document()
-        )
+    def prepare_expense(
+        self, expense: ExpenseRequest, created_at: Optional[datetime] = None
+    ) -> ExpenseResponse:
+        """Validates an expense request and builds the document to store"""
         if expense.description == "":
             raise ValueError("Description can not be empty")
 
         if len(expense.items) == 0:
             raise ValueError("Items can not be empty")
 
+        item_ids = set()
         for item in expense.items:
+            if item.item_id == "":
+                raise ValueError("Item id can not be empty")
+            if item.item_id.startswith("__") and item.item_id.endswith("__"):
+                raise ValueError(f"Item id {item.item_id} is reserved")
+            if len(item.item_id.encode()) > MAX_ITEM_ID_BYTES:
+                raise ValueError(
+                    f"Item id can not be longer than {MAX_ITEM_ID_BYTES} bytes"
+                )
+            if item.item_id in item_ids:
+                raise ValueError(f"Duplicate item id {item.item_id}")
+            item_ids.add(item.item_id)
             if item.item_name == "":
                 raise ValueError("Item name can not be empty")
             if item.item_price <= 0:
@@ -34,25 +60,150 @@ class ExpenseService:
         for item in expense.items:
             total_price += item.item_price * item.item_quantity
 
-        expense = ExpenseResponse(
+        now = datetime.now()
+        if created_at is not None and created_at.tzinfo is not None:
+            # Stored datetimes are naive UTC, like datetime.now() on the server
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+        return ExpenseResponse(
             description=expense.description,
             items=expense.items,
             total_price=total_price,
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
+            created_at=created_at or now,
+            updated_at=now,
+        )
+
+    def create_expense(self, user_id: str, expense: ExpenseRequest) -> str:
+        doc_ref = (
+            self.db.collection(user_id)
+            .document("expenses")
+            .collection("expenses")
+            .document()
         )
+        expense = self.prepare_expense(expense)
+
+        expense_data = expense_codec.encode_expense(expense)
+        expense.expense_id = doc_ref.id
+
+        def create(transaction):
+            self.rollup_service.apply(transaction, user_id, added=expense)
+            transaction.set(doc_ref, expense_data)
+            self._bump_version(transaction, user_id)
 
         print(date.today())
-        doc_ref.set(expense.model_dump())
+        run_transaction(create)
         return doc_ref.id
 
-    def get_expenses_in_date_range(
-        self, user_id: Optional[str], date_from: Optional[date], date_to: Optional[date]
-    ) -> list[ExpenseResponse]:
+    def import_expenses(
+        self, user_id: str, rows: Iterable[tuple[int, Union[dict, ValueError]]]
+    ) -> dict:
+        """Validates and stores imported rows, committing them in batched writes.
+
+        rows yields (row number, parsed row or parse error). Invalid rows are
+        reported and skipped, they never abort the rest of the import.
+        """
+        started = time.perf_counter()
+        imported = 0
+        failed = 0
+        errors: list[dict] = []
+        pending: list[ExpenseResponse] = []
+        days: set[date] = set()
+        months: set[tuple[int, int]] = set()
+
+        def flush():
+            nonlocal imported
+            if pending:
+                self._commit_import(user_id, pending)
+                imported += len(pending)
+                pending.clear()
+                days.clear()
+                months.clear()
+
+        for row_number, row in rows:
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                request = ExpenseImport.model_validate(row)
+                expense = self.prepare_expense(request, request.created_at)
+            except ValueError as e:
+                failed += 1
+                if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+                    errors.append({"row": row_number, "error": str(e)})
+                continue
+
+            # Each batch also rewrites the rollup of every day and month it touches,
+            # and bumps the data version
+            day = expense.created_at.date()
+            month = (day.year, day.month)
+            writes = len(pending) + 2 + len(days | {day}) + len(months | {month})
+            if writes > MAX_BATCH_WRITES:
+                flush()
+
+            expense.expense_id = self.expenses_collection(user_id).document().id
+            pending.append(expense)
+            days.add(day)
+            months.add(month)
+
+        flush()
+
+        elapsed = time.perf_counter() - started
+        rows_per_second = (imported + failed) / elapsed if elapsed else 0
+        return {
+            "imported": imported,
+            "failed": failed,
+            "errors": errors,
+            "elapsed_ms": round(elapsed * 1000, 2),
+            "rows_per_second": round(rows_per_second, 1),
+        }
+
+    def _commit_import(self, user_id: str, expenses: list[ExpenseResponse]):
+        collection = self.expenses_collection(user_id)
+        days, months = self.rollup_service.build(expenses)
+
+        def commit(transaction):
+            self.rollup_service.merge(transaction, user_id, days, months)
+            for expense in expenses:
+                transaction.set(
+                    collection.document(expense.expense_id),
+                    expense_codec.encode_expense(expense),
+                )
+            self._bump_version(transaction, user_id)
+
+        run_transaction(commit)
+
+    def _version_ref(self, user_id: str):
+        return self.db.collection(user_id).document("expenses")
+
+    def _bump_version(self, writer, user_id: str):
+        # In the same batch or transaction as the change it announces
+        writer.set(
+            self._version_ref(user_id), {"version": firestore.Increment(1)}, merge=True
+        )
+
+    def get_version(self, user_id: str) -> int:
+        """Returns the data version of the user, raised by every change to expenses"""
+        return (self._version_ref(user_id).get().to_dict() or {}).get("version", 0)
+
+    def expenses_collection(self, user_id: str):
+        return self.db.collection(user_id).document("expenses").collection("expenses")
+
+    def decode_expense(self, doc) -> ExpenseResponse:
+        # to_dict() deserializes the whole document, so call it once
+        return expense_codec.decode_expense(doc.id, doc.to_dict())
+
+    def _range_query(
+        self,
+        user_id: Optional[str],
+        date_from: Optional[date],
+        date_to: Optional[date],
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+    ):
         if user_id is None:
             raise ValueError("User ID is required")
 
-        query = self.db.collection(user_id).document("expenses").collection("expenses")
+        collection = self.expenses_collection(user_id)
+        query = collection
 
         if date_from is not None:
             date_from_dt = datetime.combine(date_from, datetime.min.time())
@@ -62,82 +213,144 @@ class ExpenseService:
             date_to_dt = datetime.combine(date_to, datetime.max.time())
             query = query.where("created_at", "<=", date_to_dt)
 
-        expenses_docs = query.stream()
-
-        expenses: list[ExpenseResponse] = []
-        for exp in expenses_docs:
-            expense = ExpenseResponse(
-                description=exp.to_dict()["description"],
-                items=exp.to_dict()["items"],
-                total_price=exp.to_dict()["total_price"],
-                created_at=exp.to_dict()["created_at"],
-                updated_at=exp.to_dict()["updated_at"],
-            )
-            expenses.append(expense)
+        query = query.order_by("created_at")
+
+        if start_after is not None:
+            cursor = collection.document(start_after).get()
+            if not cursor.exists:
+                raise ValueError(f"Invalid cursor, expense {start_after} not found")
+            query = query.start_after(cursor)
+
+        if limit is not None:
+            query = query.limit(limit)
+
+        return query
+
+    def iter_expenses(
+        self,
+        user_id: Optional[str],
+        date_from: Optional[date],
+        date_to: Optional[date],
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+    ) -> Iterator[ExpenseResponse]:
+        """Returns an iterator over expenses ordered by created_at.
+
+        Expenses are decoded as Firestore streams them, start_after is the id of the
+        last expense of the previous page. Arguments and the cursor are checked
+        before the iterator is returned.
+        """
+        query = self._range_query(user_id, date_from, date_to, limit, start_after)
+        return (self.decode_expense(doc) for doc in query.stream())
+
+    def iter_expense_documents(
+        self,
+        user_id: Optional[str],
+        date_from: Optional[date],
+        date_to: Optional[date],
+        fields: Optional[list[str]] = None,
+    ) -> Iterator[tuple[str, dict]]:
+        """Same range as iter_expenses as undecoded (expense_id, document) pairs.
+
+        fields limits the documents to those top-level fields.
+        """
+        query = self._range_query(user_id, date_from, date_to)
+        if fields is not None:
+            query = query.select(fields)
+        return ((doc.id, doc.to_dict()) for doc in query.stream())
+
+    def count_and_total(
+        self, user_id: Optional[str], date_from: Optional[date], date_to: Optional[date]
+    ) -> tuple[int, float]:
+        """Number of expenses of the range and the sum of their total_price.
+
+        One aggregation query on the backend, the documents are only read when it
+        has no aggregation support.
+        """
+        query = self._range_query(user_id, date_from, date_to)
+        try:
+            return count_and_sum(query, "total_price")
+        except AggregationUnsupported:
+            pass
+
+        count = 0
+        total_price = 0
+        for _, data in self.iter_expense_documents(
+            user_id, date_from, date_to, fields=["total_price"]
+        ):
+            count += 1
+            total_price += data.get("total_price", 0)
+        return count, total_price
 
-        return expenses
+    def get_expenses_in_date_range(
+        self,
+        user_id: Optional[str],
+        date_from: Optional[date],
+        date_to: Optional[date],
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+    ) -> list[ExpenseResponse]:
+        return list(
+            self.iter_expenses(user_id, date_from, date_to, limit, start_after)
+        )
 
     def update_item_by_id(
         self, user_id: str, expense_id: str, item_id: str, item: Item
     ):
-        doc_ref = (
-            self.db.collection(user_id)
-            .document("expenses")
-            .collection("expenses")
-            .document(expense_id)
-        )
-
-        doc = doc_ref.get()
-        if not doc.exists:
-            raise ValueError(f"Expense with id {expense_id} not found")
-
-        expense_data = doc.to_dict()
-
-        items = []
-        for item_dict in expense_data["items"]:
-            if "item_id" not in item_dict:
-                import uuid
-
-                item_dict["item_id"] = str(uuid.uuid4())
-            item_obj = Item(
-                item_id=item_dict["item_id"],
-                item_name=item_dict["item_name"],
-                item_price=item_dict["item_price"],
-                item_quantity=item_dict["item_quantity"],
+        """Rewrites one item and applies the price difference to total_price.
+
+        Runs in a transaction, so concurrent edits of the same expense are not lost.
+        Only the items and the totals are written, see expense_codec.item_update.
+        Documents still in the list layout are converted on the way.
+        """
+        doc_ref = self.expenses_collection(user_id).document(expense_id)
+
+        def update(transaction):
+            doc = doc_ref.get(transaction=transaction)
+            if not doc.exists:
+                raise ValueError(f"Expense with id {expense_id} not found")
+
+            expense_data = doc.to_dict()
+            stored = expense_codec.find_item(expense_data, item_id)
+            if stored is None:
+                raise ValueError(f"Item with id {item_id} not found in expense")
+
+            updated = Item(
+                item_id=item_id,
+                item_name=item.item_name,
+                item_price=item.item_price,
+                item_quantity=item.item_quantity,
+            )
+            delta = (
+                updated.item_price * updated.item_quantity
+                - stored.item_price * stored.item_quantity
+            )
+            now = datetime.now()
+
+            previous = expense_codec.decode_expense(expense_id, expense_data)
+            expense = previous.model_copy(
+                update={
+                    "items": [
+                        updated if i.item_id == item_id else i for i in previous.items
+                    ],
+                    "total_price": previous.total_price + delta,
+                    "updated_at": now,
+                }
             )
-            items.append(item_obj)
-
-        expense = ExpenseResponse(
-            description=expense_data["description"],
-            items=items,
-            total_price=expense_data["total_price"],
-            created_at=expense_data["created_at"],
-            updated_at=expense_data["updated_at"],
-        )
-
-        item_found = False
-        for i, existing_item in enumerate(expense.items):
-            if existing_item.item_id == item_id:
-                expense.items[i] = Item(
-                    item_id=item_id,
-                    item_name=item.item_name,
-                    item_price=item.item_price,
-                    item_quantity=item.item_quantity,
-                )
-                item_found = True
-                break
-
-        if not item_found:
-            raise ValueError(f"Item with id {item_id} not found in expense")
-
-        total_price = 0
-        for item in expense.items:
-            total_price += item.item_price * item.item_quantity
-
-        expense.total_price = total_price
-        expense.updated_at = datetime.now()
 
-        doc_ref.set(expense.model_dump())
+            self.rollup_service.apply(
+                transaction, user_id, removed=previous, added=expense
+            )
+            fields = expense_codec.item_update(expense_data, expense, updated)
+            if fields is not None:
+                fields["total_price"] = firestore.Increment(delta)
+                fields["updated_at"] = now
+                transaction.update(doc_ref, fields)
+            else:
+                transaction.set(doc_ref, expense_codec.encode_expense(expense))
+            self._bump_version(transaction, user_id)
+
+        run_transaction(update)
         return {"message": "Item updated successfully"}
 
     def update_expense_description_by_id(
@@ -149,32 +362,42 @@ class ExpenseService:
             .collection("expenses")
             .document(expense_id)
         )
-        doc_ref.update({"description": description})
+        batch = self.db.batch()
+        batch.update(doc_ref, {"description": description})
+        self._bump_version(batch, user_id)
+        batch.commit()
         return {"message": "Expense description updated successfully"}
 
-    def delete_all(self, user_id: str) -> dict:
-        query = (
-            self.db.collection(user_id)
-            .document("expenses")
-            .collection("expenses")
-            .stream()
+    def delete_all(
+        self, user_id: str, on_progress: Optional[Callable[[int], None]] = None
+    ) -> dict:
+        deleted = delete_collection(
+            self.db, self.expenses_collection(user_id), on_progress
         )
-
-        for doc in query:
-            doc.reference.delete()
-
-        return {"message": "All expenses deleted successfully"}
+        self.rollup_service.delete_all(user_id)
+        batch = self.db.batch()
+        self._bump_version(batch, user_id)
+        batch.commit()
+        return {"message": "All expenses deleted successfully", "deleted": deleted}
 
     def delete_by_id(self, user_id: str, expense_id: str) -> dict:
-        query = (
+        doc_ref = (
             self.db.collection(user_id)
             .document("expenses")
             .collection("expenses")
             .document(expense_id)
         )
 
-        if query.get() is None:
-            raise ValueError(f"Expense with id {expense_id} not found")
+        def delete(transaction):
+            doc = doc_ref.get(transaction=transaction)
+            if not doc.exists:
+                raise ValueError(f"Expense with id {expense_id} not found")
+
+            self.rollup_service.apply(
+                transaction, user_id, removed=self.decode_expense(doc)
+            )
+            transaction.delete(doc_ref)
+            self._bump_version(transaction, user_id)
 
-        query.delete()
+        run_transaction(delete)
         return {"message": "Expense deleted successfully"}
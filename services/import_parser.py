@@ -0,0 +1,198 @@
+import codecs
+import csv
+import json
+import re
+from typing import Iterable, Iterator, Optional, Union
+
+# Parsed row or the error that made it unusable, keyed by its row number
+ParsedRow = tuple[int, Union[dict, ValueError]]
+
+CSV_COLUMNS = ["description", "item_name", "item_price", "item_quantity"]
+
+# Longest element of a JSON array import, a longer one ends the import with an
+# error instead of buffering the rest of the body
+MAX_ELEMENT_CHARS = 1024 * 1024
+
+_LITERALS = ("true", "false", "null", "NaN", "Infinity", "-Infinity")
+# Rest of a number cut after its decimal point or exponent sign, e.g. "1." or "1e+"
+_NUMBER_TAIL = re.compile(r"\.|[eE][-+]?")
+# Rest of a \uXXXX escape, the decoder reports it as invalid when it ends the text
+_ESCAPE_TAIL = re.compile(r"u[0-9a-fA-F]{0,4}")
+
+
+def _decode(chunks: Iterable[bytes]) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    buffer = ""
+    for text in _decode(chunks):
+        lines = (buffer + text).splitlines(keepends=True)
+        # A trailing \r is held back, the \n of a \r\n may be in the next chunk
+        buffer = lines.pop() if not lines[-1].endswith("\n") else ""
+        yield from lines
+    if buffer:
+        yield buffer
+
+
+def parse_ndjson(chunks: Iterable[bytes]) -> Iterator[ParsedRow]:
+    """One JSON expense per line, blank lines are skipped"""
+    for row_number, line in enumerate(_lines(chunks), start=1):
+        if not line.strip():
+            continue
+        try:
+            yield row_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, ValueError(f"Invalid JSON: {e.msg}")
+
+
+def _truncated(text: str, error: json.JSONDecodeError) -> bool:
+    """True when more text could still complete the element, False when the
+    buffered text already has a syntax error"""
+    tail = text[error.pos :]
+    if not tail or error.msg.startswith("Unterminated string"):
+        return True
+    if error.msg == "Expecting value":
+        return any(literal.startswith(tail) for literal in _LITERALS)
+    if error.msg == "Invalid \\uXXXX escape":
+        return _ESCAPE_TAIL.fullmatch(tail) is not None
+    if error.msg == "Expecting ',' delimiter":
+        return _NUMBER_TAIL.fullmatch(tail) is not None
+    return False
+
+
+def parse_json_array(chunks: Iterable[bytes]) -> Iterator[ParsedRow]:
+    """A top-level JSON array of expenses, decoded element by element"""
+    decoder = json.JSONDecoder()
+    pieces = _decode(chunks)
+    buffer, pos = "", 0
+    # Characters of the body before buffer, for error offsets
+    offset = 0
+    state = "start"
+    row_number = 0
+
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos == len(buffer):
+            try:
+                offset += len(buffer)
+                buffer, pos = next(pieces), 0
+            except StopIteration:
+                if state != "done":
+                    yield row_number + 1, ValueError("Unexpected end of JSON array")
+                return
+            continue
+
+        char = buffer[pos]
+        if state == "start":
+            if char != "[":
+                yield 1, ValueError("Expected a JSON array")
+                return
+            pos += 1
+            state = "first"
+        elif state in ("first", "next"):
+            if char == "]" and state == "first":
+                pos += 1
+                state = "done"
+                continue
+            try:
+                value, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if not _truncated(buffer, e):
+                    yield row_number + 1, ValueError(
+                        f"Invalid JSON: {e.msg} at character {offset + e.pos}"
+                    )
+                    return
+                # The element continues in the next chunks. They are collected
+                # until the unparsed text has doubled, so retries stay linear.
+                carried = len(buffer) - pos
+                if carried > MAX_ELEMENT_CHARS:
+                    yield row_number + 1, ValueError(
+                        f"Expense larger than {MAX_ELEMENT_CHARS} characters"
+                    )
+                    return
+                pending, size = [buffer[pos:]], carried
+                try:
+                    while size < 2 * carried or len(pending) == 1:
+                        pending.append(next(pieces))
+                        size += len(pending[-1])
+                except StopIteration:
+                    if len(pending) == 1:
+                        yield row_number + 1, ValueError("Unexpected end of JSON array")
+                        return
+                offset += pos
+                buffer, pos = "".join(pending), 0
+                continue
+            row_number += 1
+            state = "separator"
+            yield row_number, value
+        elif state == "separator":
+            if char not in ",]":
+                yield row_number + 1, ValueError("Expected ',' or ']'")
+                return
+            pos += 1
+            state = "next" if char == "," else "done"
+        else:
+            yield row_number + 1, ValueError("Unexpected data after JSON array")
+            return
+
+
+def parse_csv(chunks: Iterable[bytes]) -> Iterator[ParsedRow]:
+    """One item per row with a header of description, item_name, item_price,
+    item_quantity and optional created_at and expense_key columns.
+
+    Consecutive rows sharing an expense_key form one expense, rows without one are
+    an expense each. Errors refer to the first row of the expense.
+    """
+    reader = csv.DictReader(_lines(chunks))
+    missing = [c for c in CSV_COLUMNS if c not in (reader.fieldnames or [])]
+    if missing:
+        yield 1, ValueError(f"Missing CSV columns: {', '.join(missing)}")
+        return
+
+    current_key = None
+    current: Optional[tuple[int, dict]] = None
+
+    for row in reader:
+        if not any(row.values()):
+            continue
+        key = row.get("expense_key") or None
+        item = {
+            "item_name": row["item_name"],
+            "item_price": row["item_price"],
+            "item_quantity": row["item_quantity"] or 1,
+        }
+
+        if current is not None and key is not None and key == current_key:
+            current[1]["items"].append(item)
+            continue
+
+        if current is not None:
+            yield current
+        current_key = key
+        current = (
+            reader.line_num,
+            {
+                "description": row["description"],
+                "created_at": row.get("created_at") or None,
+                "items": [item],
+            },
+        )
+
+    if current is not None:
+        yield current
+
+
+IMPORT_PARSERS = {
+    "application/json": parse_json_array,
+    "application/x-ndjson": parse_ndjson,
+    "text/csv": parse_csv,
+}
@@ -0,0 +1,144 @@
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Optional
+from models.job_model import Job, JobStatus
+
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "4"))
+# Queued and running jobs one user may have, further submits are refused
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "2"))
+# Finished jobs kept for status polling, oldest are dropped first
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "1000"))
+
+FINISHED_STATUSES = (JobStatus.done, JobStatus.failed, JobStatus.cancelled)
+
+
+class JobLimitExceeded(ValueError):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobService:
+    """In-process background jobs with progress reporting and cancellation.
+
+    Jobs run on their own bounded pool, so long deletes and reports never take
+    threads from the request data path. Job state lives in this process only.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: dict[str, Job] = {}
+        self._futures: dict[str, Future] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=JOB_MAX_WORKERS, thread_name_prefix="jobs"
+        )
+
+    def submit(
+        self, user_id: str, kind: str, func: Callable[[Callable[[int], None]], dict]
+    ) -> Job:
+        """Queues func(progress) and returns the job, progress(n) reports n more documents.
+
+        progress raises JobCancelled once the job is cancelled, so func stops at its
+        next report. Raises JobLimitExceeded when the user has JOB_MAX_PER_USER
+        unfinished jobs.
+        """
+        now = datetime.now()
+        job = Job(
+            job_id=str(uuid.uuid4()),
+            user_id=user_id,
+            kind=kind,
+            created_at=now,
+            updated_at=now,
+        )
+        with self._lock:
+            active = sum(
+                1
+                for other in self._jobs.values()
+                if other.user_id == user_id and other.status not in FINISHED_STATUSES
+            )
+            if active >= JOB_MAX_PER_USER:
+                raise JobLimitExceeded(
+                    f"User already has {active} unfinished jobs, the limit is "
+                    f"{JOB_MAX_PER_USER}"
+                )
+            self._jobs[job.job_id] = job
+            self._evict_finished()
+            self._futures[job.job_id] = self._executor.submit(
+                self._run, job.job_id, func
+            )
+        return job.model_copy()
+
+    def _run(self, job_id: str, func: Callable[[Callable[[int], None]], dict]):
+        def progress(processed: int):
+            with self._lock:
+                job = self._jobs[job_id]
+                if job.cancel_requested:
+                    raise JobCancelled()
+                job.processed += processed
+                job.updated_at = datetime.now()
+
+        try:
+            # Cancelled between leaving the queue and starting
+            progress(0)
+            self._update(job_id, status=JobStatus.running)
+            result = func(progress)
+        except JobCancelled:
+            self._update(job_id, status=JobStatus.cancelled)
+        except Exception as e:
+            self._update(job_id, status=JobStatus.failed, error=str(e))
+        else:
+            self._update(job_id, status=JobStatus.done, result=result)
+        finally:
+            with self._lock:
+                self._futures.pop(job_id, None)
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.updated_at = datetime.now()
+
+    def _evict_finished(self):
+        finished = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.status in FINISHED_STATUSES
+        ]
+        for job_id in finished[: max(0, len(finished) - JOB_RETENTION)]:
+            del self._jobs[job_id]
+
+    def _find(self, user_id: str, job_id: str) -> Job:
+        job: Optional[Job] = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            raise ValueError(f"Job with id {job_id} not found")
+        return job
+
+    def get(self, user_id: str, job_id: str) -> Job:
+        with self._lock:
+            return self._find(user_id, job_id).model_copy()
+
+    def cancel(self, user_id: str, job_id: str) -> Job:
+        """Cancels a queued job at once and a running one at its next progress report.
+
+        Finished jobs are returned unchanged.
+        """
+        with self._lock:
+            job = self._find(user_id, job_id)
+            if job.status not in FINISHED_STATUSES:
+                future = self._futures.get(job_id)
+                if future is not None and future.cancel():
+                    self._futures.pop(job_id)
+                    job.status = JobStatus.cancelled
+                else:
+                    job.cancel_requested = True
+                job.updated_at = datetime.now()
+            return job.model_copy()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,20 +1,64 @@
+import hashlib
+import os
 from datetime import date, datetime
-from typing import Optional
+from typing import Callable, Optional
+from db.bulk import delete_collection
 from db.firestore import get_db
 from models.expense_model import ExpenseResponse
 from models.item_model import Item
-from models.report_model import Report
+from models.report_model import Report, Summary
+from services.cache import TTLCache
 from services.expense_service import ExpenseService
+from services.report_aggregation import aggregate_expenses
+from services.rollup_service import merge_most_expensive
+
+# Version 2 stores expense ids instead of embedding full expenses, version 3 keeps
+# only the first page of them in the report document
+REPORT_FORMAT_VERSION = 3
+
+# Expense ids per page. The first page is stored in the report document, the others
+# in its expense_ids subcollection, so no document nears the 1 MiB limit.
+REPORT_EXPENSE_IDS_PER_PAGE = int(os.getenv("REPORT_EXPENSE_IDS_PER_PAGE", "10000"))
+# Pages written per batch, a commit request is capped at 10 MiB
+REPORT_PAGES_PER_BATCH = 20
+EXPENSE_ID_PAGES = "expense_ids"
+
+# Reports never change after they are written, so serialized bodies are cached
+# by (user_id, report_id) until the report is deleted. The TTL only bounds how
+# long other instances keep serving a report deleted elsewhere.
+_report_cache = TTLCache(
+    max_entries=int(os.getenv("REPORT_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("REPORT_CACHE_TTL", "300")),
+    max_bytes=int(os.getenv("REPORT_CACHE_BYTES", str(32 * 1024 * 1024))),
+    sizeof=lambda entry: len(entry[0]),
+)
+
+
+def _page_id(page: int) -> str:
+    # Zero-padded, so pages are listed in order
+    return f"{page:06d}"
 
 
 class ReportService:
-    def __init__(self):
+    def __init__(self, expense_service: Optional[ExpenseService] = None):
         self.db = get_db()
-        self.expense_service = ExpenseService()
+        self.expense_service = expense_service or ExpenseService()
+        self.rollup_service = self.expense_service.rollup_service
 
     def create_report(
-        self, user_id: Optional[str], date_from: Optional[date], date_to: Optional[date]
+        self,
+        user_id: Optional[str],
+        date_from: Optional[date],
+        date_to: Optional[date],
+        on_progress: Optional[Callable[[int], None]] = None,
+        parallel: bool = False,
     ) -> str:
+        """Aggregates the range and writes the report, returns its id.
+
+        on_progress(n) reports n more expenses read. It is called once more before
+        the report is written, so a job cancelled meanwhile writes nothing.
+        parallel aggregates on the process pool, see report_aggregation.
+        """
         if user_id is None:
             raise ValueError("User ID is required")
 
@@ -25,36 +69,33 @@ class ReportService:
             .document()
         )
 
-        expenses: list[ExpenseResponse] = (
-            self.expense_service.get_expenses_in_date_range(user_id, date_from, date_to)
-        )
-
-        total_expenses_price = 0
-        most_expensive_items: list[Item] = []
-        max_price = 0
+        if self.rollup_service.is_enabled(user_id):
+            total_expenses_price, expense_ids, most_expensive_items = (
+                self._aggregate_rollups(user_id, date_from, date_to, on_progress)
+            )
+        else:
+            total_expenses_price, expense_ids, _, most_expensive_items = (
+                aggregate_expenses(
+                    self.expense_service.iter_expense_documents(
+                        user_id, date_from, date_to
+                    ),
+                    on_progress,
+                    parallel,
+                )
+            )
 
-        if len(expenses) == 0:
+        if len(expense_ids) == 0:
             raise ValueError("No expenses found")
 
-        for expense in expenses:
-            total_expenses_price += expense.total_price
-
-            for item in expense.items:
-                if item.item_price >= max_price:
-                    max_price = item.item_price
-
-        for expense in expenses:
-            for item in expense.items:
-                if item.item_price >= max_price:
-                    most_expensive_items.append(item)
-
         if date_to is None:
             date_to = date.today()
 
+        page_size = REPORT_EXPENSE_IDS_PER_PAGE
         report = Report(
             date_from=date_from,
             date_to=date_to,
-            expenses=expenses,
+            expense_ids=expense_ids[:page_size],
+            expense_count=len(expense_ids),
             most_expensive_items=most_expensive_items,
             total_price=total_expenses_price,
             created_at=datetime.now(),
@@ -70,9 +111,67 @@ class ReportService:
                 report_dict["date_to"], datetime.min.time()
             )
 
+        report_dict["format_version"] = REPORT_FORMAT_VERSION
+        report_dict["expense_ids_per_page"] = page_size
+        report_dict["expense_id_pages"] = -(-len(expense_ids) // page_size) - 1
+        if on_progress:
+            on_progress(0)
+        # The report document is written last, so a report is never read before
+        # all of its pages exist
+        self._write_expense_id_pages(doc_ref, expense_ids, page_size)
         doc_ref.set(report_dict)
         return doc_ref.id
 
+    def _write_expense_id_pages(self, doc_ref, expense_ids: list[str], page_size: int):
+        pages = doc_ref.collection(EXPENSE_ID_PAGES)
+        starts = range(page_size, len(expense_ids), page_size)
+        for batch_start in range(0, len(starts), REPORT_PAGES_PER_BATCH):
+            batch = self.db.batch()
+            for start in starts[batch_start : batch_start + REPORT_PAGES_PER_BATCH]:
+                batch.set(
+                    pages.document(_page_id(start // page_size)),
+                    {"expense_ids": expense_ids[start : start + page_size]},
+                )
+            batch.commit()
+
+    def _aggregate_rollups(
+        self,
+        user_id: str,
+        date_from: Optional[date],
+        date_to: Optional[date],
+        on_progress: Optional[Callable[[int], None]] = None,
+    ) -> tuple[float, list[str], list[Item]]:
+        """Same aggregates as report_aggregation, read from one rollup per day"""
+        total_price = 0
+        expense_ids: list[str] = []
+        most_expensive_items: list[Item] = []
+        max_price = 0
+
+        for rollup in self.rollup_service.daily_rollups(user_id, date_from, date_to):
+            total_price += rollup.total_price
+            expense_ids.extend(rollup.expense_ids)
+            max_price, most_expensive_items = merge_most_expensive(
+                max_price, most_expensive_items, rollup.most_expensive_items
+            )
+            if on_progress:
+                on_progress(len(rollup.expense_ids))
+
+        return total_price, expense_ids, most_expensive_items
+
+    def get_summary(
+        self, user_id: Optional[str], date_from: Optional[date], date_to: Optional[date]
+    ) -> Summary:
+        """Expense count and total spend of the range, without building a report"""
+        expense_count, total_price = self.expense_service.count_and_total(
+            user_id, date_from, date_to
+        )
+        return Summary(
+            date_from=date_from,
+            date_to=date_to,
+            expense_count=expense_count,
+            total_price=total_price,
+        )
+
     def get_all_report_ids(self, user_id: Optional[str]) -> list[str]:
         if user_id is None:
             raise ValueError("User ID is required")
@@ -88,24 +187,33 @@ class ReportService:
 
         return reports
 
-    def get_report_by_id(self, user_id: str, report_id: str):
-        query = (
+    def _report_ref(self, user_id: str, report_id: str):
+        return (
             self.db.collection(user_id)
             .document("reports")
             .collection("reports")
             .document(report_id)
         )
 
-        doc_ref = query.get()
-        report = doc_ref.to_dict()
+    def _get_report_data(self, user_id: str, report_id: str) -> dict:
+        report = self._report_ref(user_id, report_id).get().to_dict()
 
         if report is None:
             raise ValueError("Report not found, check if report id is correct")
 
+        return report
+
+    def get_report_by_id(self, user_id: str, report_id: str) -> Report:
+        report = self._get_report_data(user_id, report_id)
+
+        # Reports written before format version 2 embed the full expenses
+        legacy_expenses = report.get("expenses", [])
+
         report = Report(
             date_from=report["date_from"],
             date_to=report["date_to"],
-            expenses=report["expenses"],
+            expense_ids=report.get("expense_ids", []),
+            expense_count=report.get("expense_count", len(legacy_expenses)),
             most_expensive_items=report["most_expensive_items"],
             total_price=report["total_price"],
             created_at=report["created_at"],
@@ -113,6 +221,82 @@ class ReportService:
 
         return report
 
+    def cached_report_body(
+        self, user_id: str, report_id: str
+    ) -> Optional[tuple[bytes, str]]:
+        """Returns (JSON body, ETag) of an already cached report, without any read"""
+        return _report_cache.get((user_id, report_id))
+
+    def get_report_body(self, user_id: str, report_id: str) -> tuple[bytes, str]:
+        """Returns the serialized report and its strong ETag"""
+        entry = _report_cache.get((user_id, report_id))
+        if entry is None:
+            body = self.get_report_by_id(user_id, report_id).model_dump_json().encode()
+            entry = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+            _report_cache.set((user_id, report_id), entry)
+        return entry
+
+    def get_report_expenses(
+        self, user_id: str, report_id: str, limit: int, offset: int = 0
+    ) -> tuple[list[ExpenseResponse], int]:
+        """Expands one page of the expenses a report was built from.
+
+        Returns the page and the number of expenses referenced by the report.
+        """
+        report = self._get_report_data(user_id, report_id)
+
+        if "expense_ids" not in report:
+            legacy_expenses = report.get("expenses", [])
+            return [
+                ExpenseResponse(**expense)
+                for expense in legacy_expenses[offset : offset + limit]
+            ], len(legacy_expenses)
+
+        expense_ids = self._expense_id_range(
+            user_id, report_id, report, offset, limit
+        )
+        expenses = self.expense_service.expenses_collection(user_id)
+        snapshots = self.db.get_all([expenses.document(i) for i in expense_ids])
+
+        # get_all returns documents in arbitrary order, expenses deleted since the
+        # report was created are skipped
+        found = {
+            snapshot.id: self.expense_service.decode_expense(snapshot)
+            for snapshot in snapshots
+            if snapshot.exists
+        }
+        return [found[i] for i in expense_ids if i in found], report.get(
+            "expense_count", len(report["expense_ids"])
+        )
+
+    def _expense_id_range(
+        self, user_id: str, report_id: str, report: dict, offset: int, limit: int
+    ) -> list[str]:
+        """Expense ids offset to offset + limit, read from the pages they are on"""
+        first_page = report["expense_ids"]
+        if not report.get("expense_id_pages"):
+            return first_page[offset : offset + limit]
+
+        page_size = report["expense_ids_per_page"]
+        last_page = report["expense_id_pages"]
+        first = offset // page_size
+        last = min((offset + limit - 1) // page_size, last_page)
+        if first > last_page:
+            return []
+
+        pages = self._report_ref(user_id, report_id).collection(EXPENSE_ID_PAGES)
+        refs = [pages.document(_page_id(n)) for n in range(max(first, 1), last + 1)]
+        stored = {
+            snapshot.id: snapshot.to_dict()["expense_ids"]
+            for snapshot in self.db.get_all(refs)
+            if snapshot.exists
+        }
+        expense_ids = list(first_page) if first == 0 else []
+        for n in range(max(first, 1), last + 1):
+            expense_ids.extend(stored.get(_page_id(n), []))
+        start = offset - first * page_size
+        return expense_ids[start : start + limit]
+
     def delete_report_by_id(self, user_id: str, report_id: str):
         query = (
             self.db.collection(user_id)
@@ -126,14 +310,19 @@ class ReportService:
                 "Report not found, check if report id is correct and user id is correct"
             )
 
+        delete_collection(self.db, query.collection(EXPENSE_ID_PAGES))
         query.delete()
+        _report_cache.invalidate((user_id, report_id))
         return {"message": "Report deleted successfully"}
 
-    def delete_all(self, user_id: str):
+    def delete_all(
+        self, user_id: str, on_progress: Optional[Callable[[int], None]] = None
+    ):
         query = self.db.collection(user_id).document("reports").collection("reports")
 
-        docs = query.stream()
-        for doc in docs:
-            doc.reference.delete()
-
-        return {"message": "All reports deleted successfully"}
+        # Subcollections are not deleted with their document
+        for report in query.where("expense_id_pages", ">", 0).select([]).stream():
+            delete_collection(self.db, report.reference.collection(EXPENSE_ID_PAGES))
+        deleted = delete_collection(self.db, query, on_progress)
+        _report_cache.invalidate_matching(lambda key: key[0] == user_id)
+        return {"message": "All reports deleted successfully", "deleted": deleted}
@@ -1,66 +1,179 @@
-from datetime import datetime
-from db.firestore import get_db
+import os
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+from db.bulk import MAX_BATCH_WRITES
+from db import firestore
+from db.firestore import get_db, run_transaction
 from models.request_model import CallRequest
+from services.cache import TTLCache
+
+# Bumped by migrations that rewrite statistics documents, see migrations/
+STATISTICS_SCHEMA_VERSION = 2
+META_COLLECTION = "_meta"
+STATISTICS_SCHEMA_DOCUMENT = "statistics_schema"
+STATISTICS_SUMMARY_DOCUMENT = "statistics_summary"
+
+STATISTICS_TOP_N = int(os.getenv("STATISTICS_TOP_N", "10"))
+STATISTICS_TABLE = "statistics_table"
+# Route templates start with it, see normalize_endpoint
+USER_ID_SEGMENT = "{user_id}"
+
+# Shared by every service instance in the process, so a flush from the middleware
+# is immediately visible to the statistics router
+_summary_cache = TTLCache(
+    max_entries=2, ttl=float(os.getenv("STATISTICS_CACHE_TTL", "5"))
+)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Firestore stores naive datetimes as UTC and returns them timezone-aware
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
 
 
 class RequestStatisticsService:
     def __init__(self):
         self.db = get_db()
         self.collection_name = "reports"
-        self._fix_missing_endpoints()
-
-    def _fix_missing_endpoints(self):
-        """Rekonstruiraj endpoint polje v starim dokumentih"""
-        try:
-            documents = self.db.collection(self.collection_name).stream()
-            for doc in documents:
-                data = doc.to_dict()
-                if "endpoint" not in data:
-                    # Rekonstruiraj endpoint iz imena dokumenta
-                    doc_name = doc.id
-                    # soa-expenseService-expenses -> /expenses
-                    endpoint = "/" + doc_name.replace("soa-expenseService-", "").replace("_", "/")
-                    doc.reference.update({"endpoint": endpoint})
-        except Exception as e:
-            print(f"Error fixing endpoints: {e}")
 
-    def save_call(self, called_service: str) -> str:
+    def normalize_endpoint(self, called_service: str) -> str:
         # Extract endpoint without user ID
-        # Pattern: /{userID}/{resource}/{action}
+        # Pattern: /{userID}/{resource}/{action}, or the route template
+        # /{user_id}/{resource}/{action} recorded by the middleware
         # We want only: /{resource}/{action}
         parts = called_service.split("/")
 
         # Remove empty strings and user ID (first UUID-like part)
-        meaningful_parts = [p for p in parts if p and not self._is_uuid(p)]
-        endpoint_clean = "/" + "/".join(meaningful_parts) if meaningful_parts else "/"
-
-        endpoint_name = endpoint_clean.lstrip("/").replace("/", "_")
-        document_name = f"soa-expenseService-{endpoint_name}"
+        meaningful_parts = [
+            p for p in parts if p and p != USER_ID_SEGMENT and not self._is_uuid(p)
+        ]
+        return "/" + "/".join(meaningful_parts) if meaningful_parts else "/"
 
-        doc_ref = self.db.collection(self.collection_name).document(document_name)
+    def _document_name(self, endpoint: str) -> str:
+        endpoint_name = endpoint.lstrip("/").replace("/", "_")
+        return f"soa-expenseService-{endpoint_name}"
 
-        doc = doc_ref.get()
+    def _summary_ref(self):
+        return self.db.collection(META_COLLECTION).document(STATISTICS_SUMMARY_DOCUMENT)
 
-        if doc.exists:
-            # Increment the count and update last call time
-            current_count = doc.get("count") or 0
-            doc_ref.update(
-                {
-                    "count": current_count + 1,
-                    "last_call": datetime.now(),
-                }
+    def save_call(self, called_service: str) -> str:
+        endpoint = self.normalize_endpoint(called_service)
+        self.record_calls({endpoint: (1, datetime.now())})
+        return self._document_name(endpoint)
+
+    def record_calls(self, calls: dict[str, tuple[int, datetime]]):
+        """Applies call counts per endpoint and refreshes the summary document"""
+        # One write per transaction is reserved for the summary document
+        pending = list(calls.items())
+        chunk_size = MAX_BATCH_WRITES - 1
+        for start in range(0, len(pending), chunk_size):
+            summary = run_transaction(
+                self._apply_calls, dict(pending[start : start + chunk_size])
             )
+            _summary_cache.set(STATISTICS_SUMMARY_DOCUMENT, summary)
+        _summary_cache.invalidate(STATISTICS_TABLE)
+
+    def _apply_calls(self, transaction, calls: dict[str, tuple[int, datetime]]) -> dict:
+        summary_ref = self._summary_ref()
+        snapshot = summary_ref.get(transaction=transaction)
+        if snapshot.exists:
+            rows = self._summary_rows(snapshot.to_dict())
         else:
-            # Create new document with count 1
-            doc_ref.set(
+            rows = self._scan_rows(transaction)
+
+        # Counts only grow, so an endpoint outside the top N can only enter it
+        # when it is called. Reading the called endpoints is enough to keep the
+        # summary exact, and every read comes before the first write.
+        table = {row["endpoint"]: row for row in rows}
+        doc_refs = {
+            endpoint: self.db.collection(self.collection_name).document(
+                self._document_name(endpoint)
+            )
+            for endpoint in calls
+        }
+        for endpoint, doc_ref in doc_refs.items():
+            data = doc_ref.get(transaction=transaction).to_dict() or {}
+            table[endpoint] = {
+                "endpoint": endpoint,
+                "call_count": data.get("count", 0),
+                "last_call": data.get("last_call"),
+            }
+
+        for endpoint, (count, last_call) in calls.items():
+            row = table[endpoint]
+            row["call_count"] += count
+            if row["last_call"] is None or _as_utc(last_call) > _as_utc(
+                row["last_call"]
+            ):
+                row["last_call"] = last_call
+            transaction.set(
+                doc_refs[endpoint],
                 {
-                    "endpoint": endpoint_clean,
-                    "count": 1,
-                    "last_call": datetime.now(),
-                }
+                    "endpoint": endpoint,
+                    "count": row["call_count"],
+                    "last_call": row["last_call"],
+                },
+                merge=True,
             )
 
-        return document_name
+        summary = self._build_summary(table.values())
+        transaction.set(summary_ref, summary)
+        return summary
+
+    def _summary_rows(self, summary: dict) -> list[dict]:
+        rows = list(summary.get("top", []))
+        last_called = summary.get("last_called")
+        if last_called and all(
+            row["endpoint"] != last_called["endpoint"] for row in rows
+        ):
+            rows.append(last_called)
+        return rows
+
+    def _scan_rows(self, transaction=None) -> list[dict]:
+        """Reads every statistics document, only used to bootstrap the summary"""
+        rows = []
+        for doc in self.db.collection(self.collection_name).stream(
+            transaction=transaction
+        ):
+            data = doc.to_dict()
+            if data.get("endpoint"):
+                rows.append(
+                    {
+                        "endpoint": data["endpoint"],
+                        "call_count": data.get("count", 0),
+                        "last_call": data.get("last_call"),
+                    }
+                )
+        return rows
+
+    def _build_summary(self, rows: Iterable[dict]) -> dict:
+        table = sorted(rows, key=lambda row: row["call_count"], reverse=True)
+        called = [row for row in table if row["last_call"]]
+        last_called = (
+            max(called, key=lambda row: _as_utc(row["last_call"])) if called else None
+        )
+        # The full table is served from the statistics documents, so the summary
+        # stays the same size however many endpoints are counted
+        return {
+            "last_called": last_called,
+            "top": table[:STATISTICS_TOP_N],
+            "updated_at": datetime.now(),
+        }
+
+    def _get_summary(self) -> dict:
+        summary: Optional[dict] = _summary_cache.get(STATISTICS_SUMMARY_DOCUMENT)
+        if summary is None:
+            snapshot = self._summary_ref().get()
+            if snapshot.exists:
+                summary = snapshot.to_dict()
+            else:
+                summary = self._build_summary(self._scan_rows())
+                try:
+                    # create() so a summary written concurrently by a flush wins
+                    self._summary_ref().create(summary)
+                except Exception:
+                    pass
+            _summary_cache.set(STATISTICS_SUMMARY_DOCUMENT, summary)
+        return summary
 
     def _is_uuid(self, value: str) -> bool:
         """Check if string looks like UUID"""
@@ -71,61 +184,36 @@ class RequestStatisticsService:
 
     def get_last_called_endpoint(self) -> dict:
         """Returns the last called endpoint"""
-        documents = self.db.collection(self.collection_name).stream()
+        last_called = self._get_summary().get("last_called")
 
-        last_endpoint = None
-        last_time = None
-
-        for doc in documents:
-            data = doc.to_dict()
-            time = data.get("last_call")
-
-            if time and (last_time is None or time > last_time):
-                last_time = time
-                last_endpoint = data.get("endpoint")
-
-        if last_endpoint:
+        if last_called:
+            last_time = last_called["last_call"]
             return {
-                "endpoint": last_endpoint,
+                "endpoint": last_called["endpoint"],
                 "time": last_time.strftime("%Y/%m/%d %H:%M:%S") if last_time else None,
             }
         return {"error": "No data"}
 
     def get_most_called_endpoint(self) -> dict:
         """Returns the most frequently called endpoint"""
-        documents = self.db.collection(self.collection_name).stream()
-
-        most_called = None
-        max_calls = 0
-
-        for doc in documents:
-            data = doc.to_dict()
-            call_count = data.get("count", 0)
+        top = self._get_summary().get("top", [])
 
-            if call_count > max_calls:
-                max_calls = call_count
-                most_called = data.get("endpoint")
-
-        if most_called:
-            return {"endpoint": most_called, "call_count": max_calls}
+        if top and top[0]["call_count"] > 0:
+            return {"endpoint": top[0]["endpoint"], "call_count": top[0]["call_count"]}
         return {"error": "No data"}
 
     def get_all_calls_statistics(self) -> list:
-        """Returns statistics for all calls"""
-        documents = self.db.collection(self.collection_name).stream()
-
-        statistics = []
-
-        for doc in documents:
-            data = doc.to_dict()
-            statistics.append(
-                {
-                    "endpoint": data.get("endpoint"),
-                    "call_count": data.get("count", 0),
-                }
+        """Returns statistics for all calls, sorted by call count in descending order"""
+        statistics: Optional[list] = _summary_cache.get(STATISTICS_TABLE)
+        if statistics is None:
+            query = self.db.collection(self.collection_name).order_by(
+                "count", direction="DESCENDING"
             )
-
-        # Sort by call count in descending order
-        statistics.sort(key=lambda x: x["call_count"], reverse=True)
+            statistics = [
+                {"endpoint": data["endpoint"], "call_count": data["count"]}
+                for data in (doc.to_dict() for doc in query.stream())
+                if data.get("endpoint")
+            ]
+            _summary_cache.set(STATISTICS_TABLE, statistics)
 
         return statistics if statistics else [{"error": "No data"}]
@@ -0,0 +1,335 @@
+from datetime import date, datetime
+from typing import Iterable, Iterator, Optional
+from db.bulk import MAX_BATCH_WRITES, delete_collection
+from db import firestore
+from db.firestore import get_db
+from models.expense_model import ExpenseResponse
+from models.item_model import Item
+from models.rollup_model import Rollup
+from services.expense_codec import decode_items
+
+# Raised when the rollup layout changes, see migrations/rebuild_rollups.py
+ROLLUPS_VERSION = 1
+
+
+def merge_most_expensive(
+    max_price: float, most_expensive_items: list[Item], items: Iterable[Item]
+) -> tuple[float, list[Item]]:
+    """Folds items into the running max price and the items sharing it"""
+    for item in items:
+        if item.item_price > max_price:
+            max_price = item.item_price
+            most_expensive_items = [item]
+        elif item.item_price == max_price:
+            most_expensive_items.append(item)
+    return max_price, most_expensive_items
+
+
+def _day_key(day: date) -> str:
+    return day.isoformat()
+
+
+def _month_key(day: date) -> str:
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _next_month_start(day: date) -> date:
+    if day.month == 12:
+        return date(day.year + 1, 1, 1)
+    return date(day.year, day.month + 1, 1)
+
+
+def _start_of(day: date) -> datetime:
+    return datetime.combine(day, datetime.min.time())
+
+
+class RollupService:
+    """Per-user daily and monthly spending rollups.
+
+    user_id/rollups/daily/{YYYY-MM-DD} and user_id/rollups/monthly/{YYYY-MM} hold the
+    total spend, expense count, item count and max-priced items of their period.
+    ExpenseService keeps them current inside the same transaction as the expense
+    write, reports read them once user_id/rollups carries the rollups version.
+    """
+
+    def __init__(self):
+        self.db = get_db()
+
+    def _rollups_ref(self, user_id: str):
+        return self.db.collection(user_id).document("rollups")
+
+    def daily_collection(self, user_id: str):
+        return self._rollups_ref(user_id).collection("daily")
+
+    def monthly_collection(self, user_id: str):
+        return self._rollups_ref(user_id).collection("monthly")
+
+    def is_enabled(self, user_id: str) -> bool:
+        """True once the rollups of the user were rebuilt with the current version"""
+        marker = self._rollups_ref(user_id).get()
+        return marker.exists and marker.to_dict().get("version", 0) >= ROLLUPS_VERSION
+
+    def _decode(self, doc) -> Rollup:
+        return Rollup(**doc.to_dict())
+
+    def _empty_day(self, day: date) -> Rollup:
+        return Rollup(period=_day_key(day), period_start=_start_of(day))
+
+    def _empty_month(self, day: date) -> Rollup:
+        return Rollup(period=_month_key(day), period_start=_start_of(_month_start(day)))
+
+    def _add(self, rollup: Rollup, expense: ExpenseResponse, keep_ids: bool):
+        rollup.total_price += expense.total_price
+        rollup.expense_count += 1
+        rollup.item_count += len(expense.items)
+        if keep_ids:
+            rollup.expense_ids.append(expense.expense_id)
+        rollup.max_item_price, rollup.most_expensive_items = merge_most_expensive(
+            rollup.max_item_price, rollup.most_expensive_items, expense.items
+        )
+
+    def _subtract(self, rollup: Rollup, expense: ExpenseResponse, keep_ids: bool) -> bool:
+        """Removes the totals of expense, returns True if the max items must be recomputed"""
+        rollup.total_price -= expense.total_price
+        rollup.expense_count -= 1
+        rollup.item_count -= len(expense.items)
+        if keep_ids:
+            rollup.expense_ids.remove(expense.expense_id)
+        return any(item.item_price >= rollup.max_item_price for item in expense.items)
+
+    def _day_items(
+        self, transaction, user_id: str, day: date, exclude_id: str
+    ) -> list[Item]:
+        query = (
+            self.db.collection(user_id)
+            .document("expenses")
+            .collection("expenses")
+            .where("created_at", ">=", _start_of(day))
+            .where("created_at", "<=", datetime.combine(day, datetime.max.time()))
+        )
+        items: list[Item] = []
+        for doc in query.stream(transaction=transaction):
+            if doc.id != exclude_id:
+                items.extend(decode_items(doc.to_dict()))
+        return items
+
+    def _month_days(
+        self, transaction, user_id: str, day: date, changed: dict[str, Rollup]
+    ) -> list[Rollup]:
+        query = (
+            self.daily_collection(user_id)
+            .where("period_start", ">=", _start_of(_month_start(day)))
+            .where("period_start", "<", _start_of(_next_month_start(day)))
+        )
+        days = {doc.id: self._decode(doc) for doc in query.stream(transaction=transaction)}
+        days.update(changed)
+        return [rollup for rollup in days.values() if rollup.expense_count > 0]
+
+    def apply(
+        self,
+        transaction,
+        user_id: str,
+        removed: Optional[ExpenseResponse] = None,
+        added: Optional[ExpenseResponse] = None,
+    ):
+        """Applies an expense change to the daily and monthly rollups.
+
+        removed is the stored state of the expense before the change, added the state
+        after it. All reads happen before any write, so call this after the caller's
+        own transaction reads and before its writes.
+        """
+        changes = [e for e in (removed, added) if e is not None]
+        days = sorted({e.created_at.date() for e in changes})
+
+        new_days: dict[str, Rollup] = {}
+        removed_days: set[str] = set()
+        recompute_months: set[str] = set()
+
+        for day in days:
+            key = _day_key(day)
+            snapshot = self.daily_collection(user_id).document(key).get(
+                transaction=transaction
+            )
+            rollup = self._decode(snapshot) if snapshot.exists else self._empty_day(day)
+
+            day_removed = removed if removed and removed.created_at.date() == day else None
+            day_added = added if added and added.created_at.date() == day else None
+
+            # Expenses written before the rollups existed are not part of them
+            if day_removed and day_removed.expense_id not in rollup.expense_ids:
+                day_removed = None
+
+            recompute = False
+            if day_removed:
+                removed_days.add(key)
+                recompute = self._subtract(rollup, day_removed, keep_ids=True)
+            if day_added:
+                self._add(rollup, day_added, keep_ids=True)
+
+            if recompute:
+                items = self._day_items(
+                    transaction, user_id, day, exclude_id=day_removed.expense_id
+                )
+                if day_added:
+                    items.extend(day_added.items)
+                rollup.max_item_price, rollup.most_expensive_items = (
+                    merge_most_expensive(0, [], items)
+                )
+                recompute_months.add(_month_key(day))
+
+            new_days[key] = rollup
+
+        new_months: dict[str, Rollup] = {}
+        for day in days:
+            key = _month_key(day)
+            if key in new_months:
+                continue
+            snapshot = self.monthly_collection(user_id).document(key).get(
+                transaction=transaction
+            )
+            rollup = (
+                self._decode(snapshot) if snapshot.exists else self._empty_month(day)
+            )
+
+            for change_day in days:
+                if _month_key(change_day) != key:
+                    continue
+                if removed and removed.created_at.date() == change_day and (
+                    _day_key(change_day) in removed_days
+                ):
+                    self._subtract(rollup, removed, keep_ids=False)
+                if added and added.created_at.date() == change_day:
+                    self._add(rollup, added, keep_ids=False)
+
+            if key in recompute_months:
+                month_days = self._month_days(
+                    transaction,
+                    user_id,
+                    day,
+                    {k: v for k, v in new_days.items() if k.startswith(key)},
+                )
+                rollup.max_item_price, rollup.most_expensive_items = 0, []
+                for day_rollup in month_days:
+                    rollup.max_item_price, rollup.most_expensive_items = (
+                        merge_most_expensive(
+                            rollup.max_item_price,
+                            rollup.most_expensive_items,
+                            day_rollup.most_expensive_items,
+                        )
+                    )
+
+            new_months[key] = rollup
+
+        for key, rollup in new_days.items():
+            self._write(transaction, self.daily_collection(user_id), key, rollup, True)
+        for key, rollup in new_months.items():
+            self._write(
+                transaction, self.monthly_collection(user_id), key, rollup, False
+            )
+
+    def _write(self, writer, collection, key: str, rollup: Rollup, keep_ids: bool):
+        doc_ref = collection.document(key)
+        if rollup.expense_count <= 0:
+            writer.delete(doc_ref)
+            return
+        writer.set(
+            doc_ref,
+            rollup.model_dump(exclude=None if keep_ids else {"expense_ids"}),
+        )
+
+    def merge(
+        self,
+        transaction,
+        user_id: str,
+        days: dict[str, Rollup],
+        months: dict[str, Rollup],
+    ):
+        """Adds rollups computed with build() to the stored ones within transaction"""
+        changes = [(self.daily_collection(user_id), days, True)]
+        changes.append((self.monthly_collection(user_id), months, False))
+
+        merged = []
+        for collection, rollups, keep_ids in changes:
+            for key, rollup in rollups.items():
+                snapshot = collection.document(key).get(transaction=transaction)
+                if snapshot.exists:
+                    stored = self._decode(snapshot)
+                    stored.total_price += rollup.total_price
+                    stored.expense_count += rollup.expense_count
+                    stored.item_count += rollup.item_count
+                    stored.expense_ids.extend(rollup.expense_ids)
+                    stored.max_item_price, stored.most_expensive_items = (
+                        merge_most_expensive(
+                            stored.max_item_price,
+                            stored.most_expensive_items,
+                            rollup.most_expensive_items,
+                        )
+                    )
+                    rollup = stored
+                merged.append((collection, key, rollup, keep_ids))
+
+        for collection, key, rollup, keep_ids in merged:
+            self._write(transaction, collection, key, rollup, keep_ids)
+
+    def daily_rollups(
+        self, user_id: str, date_from: Optional[date], date_to: Optional[date]
+    ) -> Iterator[Rollup]:
+        """Streams the daily rollups of the range ordered by day"""
+        query = self.daily_collection(user_id)
+        if date_from is not None:
+            query = query.where("period_start", ">=", _start_of(date_from))
+        if date_to is not None:
+            query = query.where("period_start", "<=", _start_of(date_to))
+        query = query.order_by("period_start")
+        return (self._decode(doc) for doc in query.stream())
+
+    def build(
+        self, expenses: Iterable[ExpenseResponse]
+    ) -> tuple[dict[str, Rollup], dict[str, Rollup]]:
+        """Computes daily and monthly rollups from scratch"""
+        days: dict[str, Rollup] = {}
+        months: dict[str, Rollup] = {}
+        for expense in expenses:
+            day = expense.created_at.date()
+            self._add(
+                days.setdefault(_day_key(day), self._empty_day(day)),
+                expense,
+                keep_ids=True,
+            )
+            self._add(
+                months.setdefault(_month_key(day), self._empty_month(day)),
+                expense,
+                keep_ids=False,
+            )
+        return days, months
+
+    def delete_all(self, user_id: str):
+        """Deletes every daily and monthly rollup of the user, the version marker stays"""
+        delete_collection(self.db, self.daily_collection(user_id))
+        delete_collection(self.db, self.monthly_collection(user_id))
+
+    def replace(
+        self, user_id: str, days: dict[str, Rollup], months: dict[str, Rollup]
+    ):
+        """Replaces all rollups of the user and marks them as current"""
+        self.delete_all(user_id)
+
+        writes = [(self.daily_collection(user_id), k, r, True) for k, r in days.items()]
+        writes += [
+            (self.monthly_collection(user_id), k, r, False) for k, r in months.items()
+        ]
+        for start in range(0, len(writes), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for collection, key, rollup, keep_ids in writes[
+                start : start + MAX_BATCH_WRITES
+            ]:
+                self._write(batch, collection, key, rollup, keep_ids)
+            batch.commit()
+
+        self._rollups_ref(user_id).set(
+            {"version": ROLLUPS_VERSION, "rebuilt_at": firestore.SERVER_TIMESTAMP}
+        )
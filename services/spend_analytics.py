@@ -0,0 +1,134 @@
+"""
+Vectorized spending analytics over the items of a date range.
+
+Items are loaded once into column arrays (price, quantity, day and an integer
+code per item name), every aggregate is then a NumPy grouping over them:
+np.bincount over offsets from the first period or the name codes, with no Python
+loop over items. bincount adds weights in input order, so sums match a sequential loop.
+"""
+
+from datetime import date
+from typing import Iterable, NamedTuple
+
+import numpy as np
+
+from services.expense_codec import item_columns
+
+PERCENTILES = (50, 90, 95, 99)
+# Top-level fields read from expense documents
+FIELDS = ["created_at", "items", "schema_version"]
+
+# date.toordinal() of numpy's day 0
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class ItemColumns(NamedTuple):
+    prices: np.ndarray
+    quantities: np.ndarray
+    # datetime64[D], the day of the expense the item belongs to
+    days: np.ndarray
+    # Index into names
+    name_codes: np.ndarray
+    names: list[str]
+    expense_count: int
+
+
+def build_columns(documents: Iterable[tuple[str, dict]]) -> ItemColumns:
+    """Columns of the items of (expense_id, document) pairs"""
+    codes: dict[str, int] = {}
+    prices: list[float] = []
+    quantities: list[int] = []
+    days: list[int] = []
+    name_codes: list[int] = []
+    expense_count = 0
+
+    for _, data in documents:
+        names, item_prices, item_quantities = item_columns(data)
+        prices.extend(item_prices)
+        quantities.extend(item_quantities)
+        days.extend([data["created_at"].toordinal()] * len(names))
+        name_codes.extend([codes.setdefault(name, len(codes)) for name in names])
+        expense_count += 1
+
+    return ItemColumns(
+        prices=np.array(prices, dtype=np.float64),
+        quantities=np.array(quantities, dtype=np.int64),
+        days=(np.array(days, dtype=np.int64) - _EPOCH_ORDINAL).astype(
+            "datetime64[D]"
+        ),
+        name_codes=np.array(name_codes, dtype=np.int64),
+        # Insertion ordered, so names[code] is the name
+        names=list(codes),
+        expense_count=expense_count,
+    )
+
+
+def _series(periods: np.ndarray, spend: np.ndarray) -> list[dict]:
+    # Periods span a few thousand units at most, so counting by offset from the
+    # first one is cheaper than sorting them with np.unique
+    first = periods.min()
+    offsets = (periods - first).astype(np.int64)
+    counts = np.bincount(offsets)
+    totals = np.bincount(offsets, weights=spend)
+    (present,) = np.nonzero(counts)
+    return [
+        {"period": str(first + offset), "total": total, "item_count": count}
+        for offset, total, count in zip(
+            present.tolist(), totals[present].tolist(), counts[present].tolist()
+        )
+    ]
+
+
+def _moving_average(days: np.ndarray, spend: np.ndarray, window: int) -> list[dict]:
+    first = days.min()
+    offsets = (days - first).astype(np.int64)
+    # Every day from the first to the last, days without items are 0
+    daily = np.bincount(offsets, weights=spend)
+    if len(daily) < window:
+        return []
+    averages = np.convolve(daily, np.ones(window), mode="valid") / window
+    periods = first + np.arange(window - 1, len(daily))
+    return [
+        {"period": str(period), "average": average}
+        for period, average in zip(periods, averages.tolist())
+    ]
+
+
+def summarize(columns: ItemColumns, top: int, window: int) -> dict:
+    """Totals, period series, percentiles, moving average and top item names"""
+    spend = columns.prices * columns.quantities
+    days = columns.days
+    day_numbers = days.astype(np.int64)
+    # 1970-01-01 was a Thursday, weeks start on the Monday before
+    mondays = (day_numbers - (day_numbers + 3) % 7).astype("datetime64[D]")
+
+    count = len(columns.names)
+    totals = np.bincount(columns.name_codes, weights=spend, minlength=count)
+    quantities = np.bincount(
+        columns.name_codes, weights=columns.quantities, minlength=count
+    )
+    counts = np.bincount(columns.name_codes, minlength=count)
+    # Stable, so ties keep the order names were first seen in
+    ranked = np.argsort(-totals, kind="stable")[:top]
+
+    percentiles = np.percentile(spend, PERCENTILES).tolist()
+
+    return {
+        "expense_count": columns.expense_count,
+        "item_count": len(spend),
+        "total": float(totals.sum()),
+        "percentiles": {f"p{p}": v for p, v in zip(PERCENTILES, percentiles)},
+        "daily": _series(days, spend),
+        "weekly": _series(mondays, spend),
+        "monthly": _series(days.astype("datetime64[M]"), spend),
+        "moving_average": _moving_average(days, spend, window),
+        "items": [
+            {
+                "item_name": columns.names[code],
+                "total": float(totals[code]),
+                "quantity": int(quantities[code]),
+                "count": int(counts[code]),
+            }
+            for code in ranked.tolist()
+        ],
+    }
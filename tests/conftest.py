@@ -0,0 +1,17 @@
+import os
+
+# Read by db.firestore on import, the tests run on the offline backend
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import pytest
+
+from db import firestore
+from db.backends import memory
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A new empty memory client as the shared client of db.firestore"""
+    client = memory.create_client()
+    monkeypatch.setattr(firestore, "db", client)
+    return client
@@ -0,0 +1,33 @@
+from db import bulk
+
+
+def fill(db, name: str, count: int):
+    collection = db.collection(name)
+    for start in range(0, count, bulk.MAX_BATCH_WRITES):
+        batch = db.batch()
+        for n in range(start, min(start + bulk.MAX_BATCH_WRITES, count)):
+            batch.set(collection.document(f"{n:05d}"), {"n": n})
+        batch.commit()
+    return collection
+
+
+def test_delete_collection_deletes_every_page(db):
+    collection = fill(db, "docs", 1234)
+    progress = []
+
+    assert bulk.delete_collection(db, collection, progress.append) == 1234
+    assert sorted(progress) == [234, 500, 500]
+    assert list(collection.stream()) == []
+
+
+def test_deletes_share_one_executor(db):
+    bulk.delete_collection(db, fill(db, "a", 10))
+    executor = bulk._executor
+    bulk.delete_collection(db, fill(db, "b", 10))
+
+    assert bulk._executor is executor
+    bulk.shutdown_executor()
+    assert bulk._executor is None
+    # Created again on the next delete
+    assert bulk.delete_collection(db, fill(db, "c", 10)) == 10
+    bulk.shutdown_executor()
@@ -0,0 +1,91 @@
+from datetime import datetime
+
+import pytest
+
+from models.expense_model import ExpenseResponse
+from models.item_model import Item
+from services import expense_codec
+from services.expense_codec import (
+    COLUMNAR_SCHEMA_VERSION,
+    LIST_SCHEMA_VERSION,
+    MAP_SCHEMA_VERSION,
+)
+
+VERSIONS = [LIST_SCHEMA_VERSION, MAP_SCHEMA_VERSION, COLUMNAR_SCHEMA_VERSION]
+
+
+def make_expense() -> ExpenseResponse:
+    items = [
+        Item(item_id="b", item_name="bread", item_price=2.5, item_quantity=2),
+        Item(item_id="a.`x`", item_name="apples", item_price=4.0, item_quantity=1),
+        Item(item_id="c", item_name="cheese", item_price=9.75, item_quantity=3),
+    ]
+    return ExpenseResponse(
+        expense_id="e1",
+        description="groceries",
+        items=items,
+        total_price=sum(i.item_price * i.item_quantity for i in items),
+        created_at=datetime(2024, 3, 1, 12, 30),
+        updated_at=datetime(2024, 3, 2, 8, 0),
+    )
+
+
+def encode(expense: ExpenseResponse, version: int) -> dict:
+    if version == LIST_SCHEMA_VERSION:
+        # Only written by older releases, items as a plain list
+        return expense.model_dump(exclude={"expense_id"})
+    return expense_codec.encode_expense(expense, version)
+
+
+@pytest.mark.parametrize("version", VERSIONS)
+def test_round_trip(version):
+    expense = make_expense()
+    data = encode(expense, version)
+
+    assert expense_codec.schema_version(data) == version
+    assert expense_codec.decode_expense("e1", data) == expense
+    assert expense_codec.decode_items(data) == expense.items
+
+
+@pytest.mark.parametrize("version", VERSIONS)
+def test_find_item(version):
+    expense = make_expense()
+    data = encode(expense, version)
+
+    assert expense_codec.find_item(data, "a.`x`") == expense.items[1]
+    assert expense_codec.find_item(data, "missing") is None
+
+
+@pytest.mark.parametrize("version", VERSIONS)
+def test_item_columns(version):
+    expense = make_expense()
+    names, prices, quantities = expense_codec.item_columns(encode(expense, version))
+
+    assert sorted(zip(names, prices, quantities)) == sorted(
+        (i.item_name, i.item_price, i.item_quantity) for i in expense.items
+    )
+
+
+def test_item_update_map_rewrites_one_item():
+    expense = make_expense()
+    data = encode(expense, MAP_SCHEMA_VERSION)
+    item = expense.items[2].model_copy(update={"item_price": 1.0})
+
+    update = expense_codec.item_update(data, expense, item)
+
+    assert update == {
+        "items.`c`": expense_codec.encode_item(item, position=2),
+    }
+
+
+def test_item_update_list_needs_rewrite():
+    expense = make_expense()
+    data = encode(expense, LIST_SCHEMA_VERSION)
+
+    assert expense_codec.item_update(data, expense, expense.items[0]) is None
+
+
+def test_item_field_path_quotes_backticks():
+    assert expense_codec.item_field_path("a.`x`", "item_price") == (
+        "items.`a.\\`x\\``.item_price"
+    )
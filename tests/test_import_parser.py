@@ -0,0 +1,223 @@
+import json
+
+import pytest
+
+from services import import_parser
+from services.import_parser import (
+    IMPORT_PARSERS,
+    parse_csv,
+    parse_json_array,
+    parse_ndjson,
+)
+
+EXPENSES = [
+    {
+        "description": "café",
+        "items": [{"item_name": "espresso", "item_price": 2.2, "item_quantity": 2}],
+    },
+    {
+        "description": "groceries",
+        "created_at": "2024-03-01T12:00:00",
+        "items": [
+            {"item_name": "bread", "item_price": 2.5, "item_quantity": 1},
+            {"item_name": "cheese", "item_price": 9.75, "item_quantity": 3},
+        ],
+    },
+]
+
+
+def chunked(text: str, size: int) -> list[bytes]:
+    """The body split every size bytes, also inside multi-byte characters"""
+    body = text.encode()
+    return [body[start : start + size] for start in range(0, len(body), size)]
+
+
+def rows(parser, text: str, size: int = 3) -> list:
+    return [
+        (number, str(row) if isinstance(row, ValueError) else row)
+        for number, row in parser(chunked(text, size))
+    ]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 4096])
+def test_ndjson(size):
+    text = "\n".join(json.dumps(e, ensure_ascii=False) for e in EXPENSES) + "\n"
+
+    assert rows(parse_ndjson, text, size) == list(enumerate(EXPENSES, start=1))
+
+
+def test_ndjson_skips_blank_lines_and_reports_invalid_ones():
+    text = f'{json.dumps(EXPENSES[0])}\n\n{{"description": \n{json.dumps(EXPENSES[1])}'
+
+    result = rows(parse_ndjson, text)
+
+    assert result[0] == (1, EXPENSES[0])
+    assert result[1][0] == 3 and result[1][1].startswith("Invalid JSON")
+    assert result[2] == (4, EXPENSES[1])
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 4096])
+def test_json_array(size):
+    text = json.dumps(EXPENSES, ensure_ascii=False, indent=2)
+
+    assert rows(parse_json_array, text, size) == list(enumerate(EXPENSES, start=1))
+
+
+@pytest.mark.parametrize("text", ["[]", " [ ] ", "[\n]\n"])
+def test_json_array_empty(text):
+    assert rows(parse_json_array, text) == []
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"description": "x"}', [(1, "Expected a JSON array")]),
+        ("[", [(1, "Unexpected end of JSON array")]),
+        ('[{"a": 1}', [(1, {"a": 1}), (2, "Unexpected end of JSON array")]),
+        ('[{"a": 1} {"a": 2}]', [(1, {"a": 1}), (2, "Expected ',' or ']'")]),
+        ('[{"a": 1}] {}', [(1, {"a": 1}), (2, "Unexpected data after JSON array")]),
+    ],
+)
+def test_json_array_malformed(text, expected):
+    assert rows(parse_json_array, text) == expected
+
+
+def test_json_array_invalid_element():
+    assert rows(parse_json_array, '[{"a": 1}, {"a": }]') == [
+        (1, {"a": 1}),
+        (2, "Invalid JSON: Expecting value at character 17"),
+    ]
+
+
+# Values whose text can be cut where the decoder fails before the end of the buffer
+TRICKY = [
+    {"a": True, "b": False, "c": None, "d": -1.5e3, "e": 2e-2, "f": 10},
+    {"escaped": 'é \U0001f600 "quoted" \\ \n', "long": "x" * 50},
+]
+
+
+TRICKY_BODY = json.dumps(TRICKY).encode()
+
+
+@pytest.mark.parametrize("cut", range(1, len(TRICKY_BODY)))
+def test_json_array_split_anywhere(cut):
+    body = TRICKY_BODY
+
+    parsed = list(parse_json_array([body[:cut], body[cut:]]))
+
+    assert parsed == [(1, TRICKY[0]), (2, TRICKY[1])]
+
+
+def test_json_array_syntax_error_does_not_read_the_rest():
+    read = []
+
+    def chunks():
+        for chunk in (b'[{"a": 1}, {"a" 1}, ', b'{"a": 2}', b"]"):
+            read.append(chunk)
+            yield chunk
+
+    result = [
+        (number, str(row) if isinstance(row, ValueError) else row)
+        for number, row in parse_json_array(chunks())
+    ]
+
+    assert result == [
+        (1, {"a": 1}),
+        (2, "Invalid JSON: Expecting ':' delimiter at character 16"),
+    ]
+    assert len(read) == 1
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '[{"a": "abc',
+        '[{"a": tr',
+        '[{"a": -',
+        '[{"a": 1.',
+        '[{"a": 1e+',
+        '[{"a": "\\u00',
+        '[{"a": {"b": [1, 2',
+    ],
+)
+def test_json_array_truncated_element(text):
+    assert rows(parse_json_array, text) == [(1, "Unexpected end of JSON array")]
+
+
+def test_json_array_oversized_element(monkeypatch):
+    monkeypatch.setattr(import_parser, "MAX_ELEMENT_CHARS", 50)
+    text = json.dumps([{"a": 1}, {"a": "x" * 200}, {"a": 2}])
+
+    assert rows(parse_json_array, text, 10) == [
+        (1, {"a": 1}),
+        (2, "Expense larger than 50 characters"),
+    ]
+
+
+def test_json_array_syntax_error_in_long_element(monkeypatch):
+    monkeypatch.setattr(import_parser, "MAX_ELEMENT_CHARS", 50)
+    text = '[{"a": "' + "x" * 30 + '" "b": "' + "y" * 200 + '"}]'
+
+    # Reported as soon as it is buffered, not as an oversized element
+    assert rows(parse_json_array, text, 10) == [
+        (1, "Invalid JSON: Expecting ',' delimiter at character 40"),
+    ]
+
+
+@pytest.mark.parametrize("size", [1, 2, 5])
+def test_crlf_split_between_chunks(size):
+    text = "description,item_name,item_price,item_quantity\r\n" + "".join(
+        f"e{n},i,1,1\r\n" for n in range(3)
+    )
+
+    assert [number for number, _ in rows(parse_csv, text, size)] == [2, 3, 4]
+
+
+def test_csv_groups_rows_by_expense_key():
+    text = (
+        "description,item_name,item_price,item_quantity,created_at,expense_key\n"
+        "groceries,bread,2.5,1,2024-03-01T12:00:00,g\n"
+        "groceries,cheese,9.75,3,2024-03-01T12:00:00,g\n"
+        ",,,,,\n"
+        "café,espresso,2.2,,,\n"
+    )
+
+    assert rows(parse_csv, text) == [
+        (
+            2,
+            {
+                "description": "groceries",
+                "created_at": "2024-03-01T12:00:00",
+                "items": [
+                    {"item_name": "bread", "item_price": "2.5", "item_quantity": "1"},
+                    {"item_name": "cheese", "item_price": "9.75", "item_quantity": "3"},
+                ],
+            },
+        ),
+        (
+            5,
+            {
+                "description": "café",
+                "created_at": None,
+                "items": [
+                    {"item_name": "espresso", "item_price": "2.2", "item_quantity": 1}
+                ],
+            },
+        ),
+    ]
+
+
+def test_csv_missing_columns():
+    text = "description,item_name\nlunch,soup\n"
+
+    assert rows(parse_csv, text) == [
+        (1, "Missing CSV columns: item_price, item_quantity")
+    ]
+
+
+def test_parsers_by_content_type():
+    assert set(IMPORT_PARSERS) == {
+        "application/json",
+        "application/x-ndjson",
+        "text/csv",
+    }
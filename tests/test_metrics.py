@@ -0,0 +1,42 @@
+import threading
+
+import metrics
+
+
+def run_threads(target, count: int):
+    for _ in range(count):
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+
+
+def test_shards_of_ended_threads_are_retired():
+    counter = metrics.Counter("test_requests_total", "Requests.", ("route",))
+    histogram = metrics.Histogram("test_seconds", "Latency.", buckets=(0.1, 1))
+
+    def record():
+        counter.inc("/a")
+        counter.inc("/b", amount=2)
+        histogram.observe(0.5)
+
+    run_threads(record, 200)
+    record()
+
+    # Only the shard of the thread still running is kept
+    assert len(counter._shards) == 1
+    assert len(histogram._shards) == 1
+    assert counter.collect()[2:] == [
+        'test_requests_total{route="/a"} 201',
+        'test_requests_total{route="/b"} 402',
+    ]
+    assert 'test_seconds_bucket{le="+Inf"} 201' in histogram.collect()
+
+
+def test_gauge_keeps_the_net_change_of_ended_threads():
+    gauge = metrics.Gauge("test_in_flight", "In flight.")
+
+    run_threads(gauge.inc, 10)
+    run_threads(gauge.dec, 4)
+
+    assert gauge._shards == []
+    assert gauge.collect()[2:] == ["test_in_flight 6"]
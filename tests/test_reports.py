@@ -0,0 +1,83 @@
+import pytest
+
+from services import report_service as report_module
+from services.expense_service import ExpenseService
+from services.report_service import EXPENSE_ID_PAGES, ReportService
+
+USER_ID = "report-user"
+
+
+@pytest.fixture
+def report_service(db, monkeypatch):
+    monkeypatch.setattr(report_module, "REPORT_EXPENSE_IDS_PER_PAGE", 3)
+    expense_service = ExpenseService()
+    rows = (
+        (
+            number,
+            {
+                "description": f"expense {number}",
+                "created_at": f"2024-02-{number:02d}T10:00:00",
+                "items": [{"item_name": "a", "item_price": 1.0, "item_quantity": 1}],
+            },
+        )
+        for number in range(1, 11)
+    )
+    expense_service.import_expenses(USER_ID, rows)
+    return ReportService(expense_service)
+
+
+def pages(report_service, report_id: str) -> dict:
+    collection = report_service._report_ref(USER_ID, report_id).collection(
+        EXPENSE_ID_PAGES
+    )
+    return {doc.id: doc.to_dict()["expense_ids"] for doc in collection.stream()}
+
+
+def test_expense_ids_beyond_the_first_page_are_stored_in_pages(report_service):
+    report_id = report_service.create_report(USER_ID, None, None)
+
+    report = report_service._get_report_data(USER_ID, report_id)
+    assert report["expense_count"] == 10
+    assert len(report["expense_ids"]) == 3
+    assert report["expense_id_pages"] == 3
+    stored = pages(report_service, report_id)
+    assert sorted(stored) == ["000001", "000002", "000003"]
+    assert [len(stored[page]) for page in sorted(stored)] == [3, 3, 1]
+    assert report_service.get_report_by_id(USER_ID, report_id).expense_count == 10
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 7, 100])
+def test_report_expenses_page_through_every_expense(report_service, limit):
+    report_id = report_service.create_report(USER_ID, None, None)
+    expected = [
+        e.expense_id
+        for e in report_service.expense_service.iter_expenses(USER_ID, None, None)
+    ]
+
+    expense_ids = []
+    offset = 0
+    while True:
+        page, expense_count = report_service.get_report_expenses(
+            USER_ID, report_id, limit, offset
+        )
+        assert expense_count == 10
+        expense_ids.extend(expense.expense_id for expense in page)
+        offset += limit
+        if offset >= expense_count:
+            break
+
+    assert expense_ids == expected
+    assert report_service.get_report_expenses(USER_ID, report_id, 5, 10)[0] == []
+
+
+def test_deleting_reports_deletes_their_pages(report_service):
+    first = report_service.create_report(USER_ID, None, None)
+    second = report_service.create_report(USER_ID, None, None)
+
+    report_service.delete_report_by_id(USER_ID, first)
+    assert pages(report_service, first) == {}
+    assert len(pages(report_service, second)) == 3
+
+    report_service.delete_all(USER_ID)
+    assert pages(report_service, second) == {}
+    assert report_service.get_all_report_ids(USER_ID) == []
@@ -0,0 +1,144 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from models.expense_model import ExpenseRequest
+from models.item_model import Item
+from services.expense_service import ExpenseService
+
+USER_ID = "rollup-user"
+
+
+@pytest.fixture
+def expense_service(db):
+    return ExpenseService()
+
+
+def import_rows(days: list[str]):
+    for number, day in enumerate(days, start=1):
+        yield number, {
+            "description": f"expense {number}",
+            "created_at": f"{day}T{number % 24:02d}:00:00",
+            "items": [
+                {"item_name": "a", "item_price": float(number), "item_quantity": 1},
+                {"item_name": "b", "item_price": 7.0, "item_quantity": 2},
+            ],
+        }
+
+
+def stored(collection) -> dict:
+    return {doc.id: doc.to_dict() for doc in collection.stream()}
+
+
+def comparable(rollups: dict) -> dict:
+    result = {}
+    for key, rollup in rollups.items():
+        result[key] = {
+            "total_price": pytest.approx(rollup["total_price"]),
+            "expense_count": rollup["expense_count"],
+            "item_count": rollup["item_count"],
+            "max_item_price": rollup["max_item_price"],
+            "most_expensive_items": sorted(
+                item["item_id"] for item in rollup["most_expensive_items"]
+            ),
+            "expense_ids": sorted(rollup.get("expense_ids", [])),
+        }
+    return result
+
+
+def rebuilt(expense_service: ExpenseService) -> tuple[dict, dict]:
+    rollup_service = expense_service.rollup_service
+    days, months = rollup_service.build(
+        expense_service.iter_expenses(USER_ID, None, None)
+    )
+    return (
+        {key: rollup.model_dump() for key, rollup in days.items()},
+        {
+            key: rollup.model_dump(exclude={"expense_ids"})
+            for key, rollup in months.items()
+        },
+    )
+
+
+def assert_matches_rebuild(expense_service: ExpenseService):
+    rollup_service = expense_service.rollup_service
+    days, months = rebuilt(expense_service)
+
+    assert comparable(stored(rollup_service.daily_collection(USER_ID))) == (
+        comparable(days)
+    )
+    assert comparable(stored(rollup_service.monthly_collection(USER_ID))) == (
+        comparable(months)
+    )
+
+
+def test_import_merges_into_existing_rollups(expense_service):
+    days = ["2024-01-30", "2024-01-31", "2024-02-01", "2024-02-01", "2024-03-15"]
+    expense_service.import_expenses(USER_ID, import_rows(days))
+    expense_service.import_expenses(USER_ID, import_rows(days[1:4]))
+
+    assert_matches_rebuild(expense_service)
+
+
+def test_create_update_and_delete_apply_to_rollups(expense_service):
+    expense_service.import_expenses(
+        USER_ID, import_rows(["2024-01-31", "2024-01-31", "2024-02-01"])
+    )
+    created_id = expense_service.create_expense(
+        USER_ID,
+        ExpenseRequest(
+            description="today",
+            items=[Item(item_name="c", item_price=3.0, item_quantity=1)],
+        ),
+    )
+    assert_matches_rebuild(expense_service)
+
+    expenses = expense_service.get_expenses_in_date_range(USER_ID, None, None)
+    most_expensive = max(expenses, key=lambda e: max(i.item_price for i in e.items))
+    item = max(most_expensive.items, key=lambda i: i.item_price)
+
+    # Lowering the max price of a day recomputes its most expensive items
+    expense_service.update_item_by_id(
+        USER_ID,
+        most_expensive.expense_id,
+        item.item_id,
+        Item(item_name="cheaper", item_price=0.5, item_quantity=4),
+    )
+    assert_matches_rebuild(expense_service)
+
+    expense_service.delete_by_id(USER_ID, expenses[0].expense_id)
+    expense_service.delete_by_id(USER_ID, created_id)
+    assert_matches_rebuild(expense_service)
+
+
+def test_deleting_the_last_expense_of_a_day_removes_its_rollups(expense_service):
+    expense_service.import_expenses(USER_ID, import_rows(["2024-05-05"]))
+    (expense,) = expense_service.get_expenses_in_date_range(USER_ID, None, None)
+
+    expense_service.delete_by_id(USER_ID, expense.expense_id)
+
+    rollup_service = expense_service.rollup_service
+    assert stored(rollup_service.daily_collection(USER_ID)) == {}
+    assert stored(rollup_service.monthly_collection(USER_ID)) == {}
+
+
+def test_replace_writes_what_build_computes(expense_service):
+    expense_service.import_expenses(
+        USER_ID, import_rows(["2024-01-01", "2024-06-30", "2024-06-30"])
+    )
+    rollup_service = expense_service.rollup_service
+    days, months = rollup_service.build(
+        expense_service.iter_expenses(USER_ID, None, None)
+    )
+
+    rollup_service.replace(USER_ID, days, months)
+
+    assert rollup_service.is_enabled(USER_ID)
+    assert_matches_rebuild(expense_service)
+    assert set(stored(rollup_service.daily_collection(USER_ID))) == {
+        "2024-01-01",
+        "2024-06-30",
+    }
+    # Stored naive datetimes are UTC and read back timezone-aware, as on Firestore
+    month = stored(rollup_service.monthly_collection(USER_ID))["2024-06"]
+    assert month["period_start"] == datetime(2024, 6, 1, tzinfo=timezone.utc)
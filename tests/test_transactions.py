@@ -0,0 +1,95 @@
+import pytest
+
+from db.backends.base import MAX_TRANSACTION_ATTEMPTS, TransactionConflict
+
+
+def test_commit_applies_writes(db):
+    ref = db.collection("counters").document("a")
+
+    def increment(transaction):
+        value = (ref.get(transaction=transaction).to_dict() or {}).get("value", 0)
+        transaction.set(ref, {"value": value + 1})
+        return value + 1
+
+    assert db.run_transaction(increment) == 1
+    assert db.run_transaction(increment) == 2
+    assert ref.get().to_dict() == {"value": 2}
+
+
+def test_conflicting_document_write_is_retried(db):
+    ref = db.collection("counters").document("a")
+    ref.set({"value": 10})
+    attempts = []
+
+    def increment(transaction):
+        value = ref.get(transaction=transaction).to_dict()["value"]
+        if not attempts:
+            # A write outside the transaction after its read
+            batch = db.batch()
+            batch.set(ref, {"value": 100})
+            batch.commit()
+        attempts.append(value)
+        transaction.set(ref, {"value": value + 1})
+
+    db.run_transaction(increment)
+
+    assert attempts == [10, 100]
+    assert ref.get().to_dict() == {"value": 101}
+
+
+def test_conflicting_query_write_is_retried(db):
+    collection = db.collection("items")
+    collection.document("a").set({"price": 1})
+    attempts = []
+
+    def total(transaction):
+        prices = [
+            doc.to_dict()["price"]
+            for doc in collection.where("price", ">", 0).stream(transaction=transaction)
+        ]
+        if not attempts:
+            collection.document("b").set({"price": 2})
+        attempts.append(sum(prices))
+        transaction.set(db.collection("totals").document("items"), {"sum": sum(prices)})
+
+    db.run_transaction(total)
+
+    assert attempts == [1, 3]
+    assert db.collection("totals").document("items").get().to_dict() == {"sum": 3}
+
+
+def test_conflict_is_raised_after_the_last_attempt(db):
+    ref = db.collection("counters").document("a")
+    ref.set({"value": 0})
+    other = db.collection("counters").document("b")
+    attempts = 0
+
+    def always_conflicting(transaction):
+        nonlocal attempts
+        attempts += 1
+        value = ref.get(transaction=transaction).to_dict()["value"]
+        ref.set({"value": value + 1})
+        transaction.set(other, {"value": value})
+
+    with pytest.raises(TransactionConflict):
+        db.run_transaction(always_conflicting)
+
+    assert attempts == MAX_TRANSACTION_ATTEMPTS
+    # Nothing of a failed transaction is written
+    assert not other.get().exists
+
+
+def test_failed_write_leaves_documents_unchanged(db):
+    existing = db.collection("docs").document("existing")
+    existing.set({"value": 1})
+    fresh = db.collection("docs").document("fresh")
+
+    def create_both(transaction):
+        transaction.set(fresh, {"value": 2})
+        transaction.create(existing, {"value": 3})
+
+    with pytest.raises(ValueError):
+        db.run_transaction(create_both)
+
+    assert existing.get().to_dict() == {"value": 1}
+    assert not fresh.get().exists
@@ -0,0 +1,150 @@
+"""
+Per-request traces of storage calls, with an optional profile.
+
+init_request_logging starts a trace for every request under its correlation id.
+Storage calls report their duration to it (db/firestore.py), and the request log
+record carries the number and total time of the calls per operation. The
+record is written once the response starts, so calls made while a streamed body
+is sent are not part of it.
+
+Profiled requests also keep every call as a timed span and run the blocking data
+path (the run_blocking calls, where services and storage calls run) under
+cProfile. cProfile only sees the thread it is enabled on, so code on the event
+loop is not part of the profile. A request is profiled when it sends the
+X-Profile header, or when it is sampled at TRACE_SAMPLE_RATE.
+"""
+
+import contextvars
+import cProfile
+import os
+import pstats
+import random
+import threading
+import time
+from typing import Callable, Mapping, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Share of requests profiled without the header, 0 to 1
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+# false ignores the header, so only sampling profiles requests
+TRACE_PROFILE_HEADER = os.getenv("TRACE_PROFILE_HEADER", "true").lower() == "true"
+# Spans kept per request, later calls are only counted
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
+# Functions of the profile in the log record, by cumulative time
+TRACE_PROFILE_TOP = int(os.getenv("TRACE_PROFILE_TOP", "25"))
+
+PROFILE_HEADER = "X-Profile"
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+class Trace:
+    def __init__(self, correlation_id: Optional[str], profile: bool):
+        self.correlation_id = correlation_id
+        self.profile = profile
+        self.started = time.perf_counter()
+        # Calls and seconds per operation
+        self._totals: dict[str, list] = {}
+        # (operation, start, duration) in seconds, start relative to the request
+        self._spans: list[tuple[str, float, float]] = []
+        self._stats: Optional[pstats.Stats] = None
+        # Calls of one request may finish on several executor threads
+        self._lock = threading.Lock()
+
+    def add_span(self, operation: str, seconds: float):
+        start = time.perf_counter() - seconds - self.started
+        with self._lock:
+            total = self._totals.get(operation)
+            if total is None:
+                total = self._totals[operation] = [0, 0.0]
+            total[0] += 1
+            total[1] += seconds
+            if self.profile and len(self._spans) < TRACE_MAX_SPANS:
+                self._spans.append((operation, start, seconds))
+
+    def add_profile(self, profile: cProfile.Profile):
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+
+    def _top_functions(self) -> list[dict]:
+        rows = sorted(
+            self._stats.stats.items(), key=lambda row: row[1][3], reverse=True
+        )
+        return [
+            {
+                "function": pstats.func_std_string(function),
+                "calls": calls,
+                "own_ms": _ms(own),
+                "cumulative_ms": _ms(cumulative),
+            }
+            for function, (_, calls, own, cumulative, _) in rows[:TRACE_PROFILE_TOP]
+        ]
+
+    def summary(self) -> dict:
+        """Storage time per operation, plus spans and the profile when profiled"""
+        with self._lock:
+            operations = {
+                operation: {"calls": calls, "total_ms": _ms(seconds)}
+                for operation, (calls, seconds) in sorted(self._totals.items())
+            }
+            result = {
+                "storage_calls": sum(calls for calls, _ in self._totals.values()),
+                "storage_ms": _ms(sum(seconds for _, seconds in self._totals.values())),
+                "operations": operations,
+            }
+            if self.profile:
+                result["spans"] = [
+                    {
+                        "operation": operation,
+                        "start_ms": _ms(start),
+                        "duration_ms": _ms(duration),
+                    }
+                    for operation, start, duration in self._spans
+                ]
+                result["spans_dropped"] = result["storage_calls"] - len(self._spans)
+                if self._stats is not None:
+                    result["profile"] = self._top_functions()
+            return result
+
+
+_trace_var: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar(
+    "trace", default=None
+)
+
+
+def wants_profile(headers: Mapping[str, str]) -> bool:
+    requested = headers.get(PROFILE_HEADER, "").lower() in ("1", "true")
+    if TRACE_PROFILE_HEADER and requested:
+        return True
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+
+def start_trace(correlation_id: Optional[str], profile: bool = False) -> Trace:
+    """Starts a trace for the current context, run_blocking copies it to threads"""
+    trace = Trace(correlation_id, profile)
+    _trace_var.set(trace)
+    return trace
+
+
+def record_span(operation: str, seconds: float):
+    trace = _trace_var.get()
+    if trace is not None:
+        trace.add_span(operation, seconds)
+
+
+def profiled(func: Callable[..., T], *args, **kwargs) -> T:
+    """Calls func, under cProfile when the current trace is profiled"""
+    trace = _trace_var.get()
+    if trace is None or not trace.profile:
+        return func(*args, **kwargs)
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *args, **kwargs)
+    finally:
+        trace.add_profile(profile)